@@ -0,0 +1,337 @@
+"""
+Reproducible benchmarks of the dataset builders, on synthetic inputs of a configurable scale
+( CONcreTEXT sentences, PRELEARN pairs, a Wikipedia XML file and Ghigliottina games ).
+For each builder the throughput ( records per second, best of REPEAT runs ) and the peak memory
+allocated by Python ( traced by tracemalloc, in a separate run ) are measured, and compared with the
+baselines stored in BASELINE_FILE: the run fails if a builder got slower or uses more memory than allowed,
+or if it has no baseline ( the baselines are recorded with --update ).
+The inputs are generated with a fixed seed, so the runs are comparable. The throughputs depend on the
+machine, so the baselines are stored per machine ( see "machine_id" ): a run is only compared with the
+baselines recorded on the same kind of machine, and another machine records its own with --update.
+Run from the repository root with: python -m benchmarks.bench_builders [--scale large] [--update]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from xml.sax.saxutils import escape
+
+import task_13
+import task_14_distractors
+import task_15
+import tests
+
+######################### Settings #########################################
+
+# The number of synthetic records of each input, per scale
+SCALES = {
+    "small": {"sentences": 100_000, "wikipedia_docs": 10_000, "pairs": 100_000, "games": 20_000,
+              "contexts": 10_000},
+    "large": {"sentences": 1_000_000, "wikipedia_docs": 1_000_000, "pairs": 1_000_000, "games": 1_000_000,
+              "contexts": 100_000},
+}
+# The seed of the synthetic inputs
+SEED = 0
+# The number of times each measure is repeated ( the best one is reported )
+REPEAT = 3
+# The file storing the baseline of each benchmark, per scale
+BASELINE_FILE = "benchmarks/baselines.json"
+# The max allowed decrease of the throughput, and increase of the peak memory, with respect to the baseline.
+# The throughput tolerance is for REPEAT runs: it's widened for fewer runs ( see "throughput_tolerance" )
+THROUGHPUT_TOLERANCE = 0.2
+MEMORY_TOLERANCE = 0.2
+# The max throughput tolerance, with a single run
+MAX_THROUGHPUT_TOLERANCE = 0.5
+# The prompts rendered by the parse_prompt benchmark
+PROMPTS_FILE = "task-15/prompt-geometry.jsonl"
+
+
+############################################################################
+
+def _words(rng: random.Random, vocabulary: List[str], count: int) -> str:
+    return ' '.join(rng.choice(vocabulary) for _ in range(count))
+
+
+def write_concretext_tsv(file_path: str, sentences: int, rng: random.Random):
+    """
+    Writes a synthetic CONcreTEXT dataset. About 2% of the records are invalid
+    ( mean out of range, or target occurring twice ).
+    :param file_path: str. The path of the tsv file.
+    :param sentences: int. The number of records.
+    :param rng: random.Random. The random generator.
+    """
+    vocabulary = [f"parola{index}" for index in range(5000)]
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write("TARGET\tPOS\tINDEX\tTEXT\tMEAN\n")
+        for record in range(sentences):
+            lemma = f"lemma{record % 1000}"
+            tokens = _words(rng, vocabulary, rng.randint(6, 30)).split()
+            index = rng.randrange(len(tokens))
+            tokens[index] = lemma[:-1] + rng.choice('aeio')
+            if rng.random() < 0.01:
+                tokens.append(lemma)
+            mean = rng.uniform(0.9, 7.0)
+            file.write(f"{lemma}\tV\t{index}\t{' '.join(tokens)} . \t{mean:.2f}\n")
+
+
+def write_wikipedia_xml(file_path: str, docs: int, rng: random.Random):
+    """
+    Writes a synthetic Wikipedia file in the WikiExtractor format, with a <doc> per concept ( "Concetto {i}" ).
+    :param file_path: str. The path of the XML file.
+    :param docs: int. The number of <doc> elements.
+    :param rng: random.Random. The random generator.
+    """
+    vocabulary = [f"parola{index}" for index in range(20000)]
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write("<document>\n")
+        for doc in range(docs):
+            passage = '\n'.join(_words(rng, vocabulary, rng.randint(10, 40)) + '.' for _ in range(rng.randint(1, 6)))
+            file.write(f'<doc id="{doc}" url="https://it.wikipedia.org/wiki?curid={doc}">\n'
+                       f'<title>{escape(f"Concetto {doc}")}</title>\n<text>\n{escape(passage)}\n</text>\n</doc>\n')
+        file.write("</document>\n")
+
+
+def write_prelearn_pairs(file_path: str, pairs: int, concepts: int, rng: random.Random):
+    """
+    Writes a synthetic PRELEARN dataset of concept pairs.
+    :param file_path: str. The path of the pairs file.
+    :param pairs: int. The number of pairs.
+    :param concepts: int. The number of concepts ( "Concetto {i}", as in "write_wikipedia_xml" ).
+    :param rng: random.Random. The random generator.
+    """
+    with open(file_path, 'w', encoding='utf-8') as file:
+        for _ in range(pairs):
+            file.write(f"Concetto {rng.randrange(concepts)},Concetto {rng.randrange(concepts)},{rng.randint(0, 1)}\n")
+
+
+def write_ghigliottina_json(file_path: str, games: int, rng: random.Random):
+    """
+    Writes a synthetic Ghigliottina dataset, as a JSON array of games.
+    :param file_path: str. The path of the JSON file.
+    :param games: int. The number of games.
+    :param rng: random.Random. The random generator.
+    """
+    vocabulary = [f"indizio{index}" for index in range(max(1000, games // 10))]
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write("[\n")
+        for game in range(games):
+            record = {key: rng.choice(vocabulary) for key in task_14_distractors.HINT_KEYS}
+            record["solution"] = f"soluzione{game}"
+            file.write(("," if game else "") + json.dumps(record, ensure_ascii=False) + "\n")
+        file.write("]\n")
+
+
+_MISSING = object()
+
+
+@contextlib.contextmanager
+def patched(module: Any, **attributes: Any) -> Iterator[None]:
+    """
+    Temporarily replaces the settings of a module, or adds them ( e.g. a "print" shadowing the builtin one ).
+    :param module: Any. The module.
+    :param attributes: Any. The settings to replace, by name.
+    """
+    previous = {name: getattr(module, name, _MISSING) for name in attributes}
+    for name, value in attributes.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is _MISSING:
+                delattr(module, name)
+            else:
+                setattr(module, name, value)
+
+
+def _no_print(*args: Any, **kwargs: Any):
+    pass
+
+
+def measure(function: Callable[[], Any], records: int, repeat: int = REPEAT) -> Dict[str, float]:
+    """
+    Measures the throughput and the peak memory of a function. The standard output of the function is discarded.
+    :param function: Callable[[], Any]. The function to measure.
+    :param records: int. The number of records processed by a call of the function.
+    :param repeat: int. The number of timed runs ( the best one is reported ).
+    :return: Dict[str, float]. The records, the seconds, the records per second and the peak traced bytes.
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        seconds = float('inf')
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            function()
+            seconds = min(seconds, time.perf_counter() - started_at)
+        tracemalloc.start()
+        try:
+            function()
+            peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {"records": records, "seconds": seconds, "records_per_second": records / seconds,
+            "peak_traced_bytes": peak_traced_bytes}
+
+
+def run_benchmarks(scale: Dict[str, int], directory: str, only: Optional[List[str]] = None,
+                   repeat: int = REPEAT) -> Dict[str, Dict[str, float]]:
+    """
+    Generates the synthetic inputs and measures the builders on them.
+    :param scale: Dict[str, int]. The number of synthetic records of each input ( see SCALES ).
+    :param directory: str. The directory of the inputs and outputs.
+    :param only: Optional[List[str]]. The names of the benchmarks to run ( None means all of them ).
+    :param repeat: int. The number of timed runs of each benchmark.
+    :return: Dict[str, Dict[str, float]]. The measures of each benchmark ( see "measure" ).
+    """
+    rng = random.Random(SEED)
+    tsv_file = os.path.join(directory, "concretext.tsv")
+    xml_file = os.path.join(directory, "wikipedia.xml")
+    pairs_file = os.path.join(directory, "pairs.csv")
+    games_file = os.path.join(directory, "games.json")
+    print("Generating the synthetic inputs in: ", directory)
+    write_concretext_tsv(tsv_file, scale["sentences"], rng)
+    write_wikipedia_xml(xml_file, scale["wikipedia_docs"], rng)
+    write_prelearn_pairs(pairs_file, scale["pairs"], scale["wikipedia_docs"], rng)
+    write_ghigliottina_json(games_file, scale["games"], rng)
+
+    topics = task_15.extract_topics(xml_file)
+    lazy_topics = task_15.open_topics(xml_file)
+    prompts = tests.load_prompts(PROMPTS_FILE)
+    contexts = list(islice(task_15.process_tasks(task_15.extract_tasks(pairs_file), topics, "pairs"),
+                           scale["contexts"]))
+
+    def create_concretext_benchmark():
+        with patched(task_13, FILES=[(tsv_file, os.path.join(directory, "concretext.jsonl"))]):
+            task_13.create_benchmark(workers=1, force=True)
+
+    def check_distractors():
+        # The builder prints every game: the printing is not timed, even to the discarded standard output
+        with patched(task_14_distractors, FILE_NAME=games_file, print=_no_print):
+            task_14_distractors.check_distractors()
+
+    def render_prompts():
+        for prompt in prompts:
+            for context in contexts:
+                tests.parse_prompt(prompt, context)
+
+    benchmarks = {
+        "task_13.create_benchmark": (create_concretext_benchmark, scale["sentences"]),
+        "task_15.extract_topics": (lambda: task_15.extract_topics(xml_file), scale["wikipedia_docs"]),
+        "task_15.process_tasks": (lambda: deque(task_15.process_tasks(task_15.extract_tasks(pairs_file),
+                                                                      topics, "pairs"), maxlen=0), scale["pairs"]),
+        "task_15.process_tasks[lazy_topics]": (lambda: deque(task_15.process_tasks(
+            task_15.extract_tasks(pairs_file), lazy_topics, "pairs"), maxlen=0), scale["pairs"]),
+        "task_14_distractors.check_distractors": (check_distractors, scale["games"]),
+        "tests.parse_prompt": (render_prompts, len(prompts) * len(contexts)),
+    }
+    results = {}
+    try:
+        for name, (function, records) in benchmarks.items():
+            if only and name not in only:
+                continue
+            print("Running: ", name)
+            results[name] = measure(function, records, repeat)
+    finally:
+        lazy_topics.close()
+    return results
+
+
+def machine_id() -> str:
+    """
+    Identifies the kind of machine running the benchmarks ( not the host, which can change at every run
+    in a container ): the architecture, the CPU model, the number of cores and the Python version.
+    :return: str. The identifier of the machine.
+    """
+    processor = platform.processor()
+    try:
+        with open("/proc/cpuinfo", 'r', encoding='utf-8') as file:
+            processor = next(line.split(':', 1)[1].strip() for line in file if line.startswith("model name"))
+    except (OSError, StopIteration):
+        pass
+    major, minor, _ = platform.python_version_tuple()
+    return (f"{platform.machine()} {processor or 'unknown CPU'} x{os.cpu_count()}, "
+            f"{platform.python_implementation()} {major}.{minor}")
+
+
+def throughput_tolerance(repeat: int) -> float:
+    """
+    :param repeat: int. The number of timed runs of each benchmark.
+    :return: float. The max allowed decrease of the throughput: THROUGHPUT_TOLERANCE for REPEAT runs or more,
+    wider for fewer runs, whose best time is noisier, up to MAX_THROUGHPUT_TOLERANCE.
+    """
+    return min(MAX_THROUGHPUT_TOLERANCE, THROUGHPUT_TOLERANCE * max(1.0, REPEAT / max(repeat, 1)))
+
+
+def find_regressions(results: Dict[str, Dict[str, float]], baselines: Dict[str, Dict[str, float]],
+                     tolerance: float = THROUGHPUT_TOLERANCE) -> List[str]:
+    """
+    Compares the measures with their baselines.
+    :param results: Dict[str, Dict[str, float]]. The measures of each benchmark ( see "measure" ).
+    :param baselines: Dict[str, Dict[str, float]]. The baseline measures of each benchmark.
+    :param tolerance: float. The max allowed decrease of the throughput ( see "throughput_tolerance" ).
+    :return: List[str]. The description of each regression, or missing baseline ( empty if there are none ).
+    """
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            regressions.append(f"{name}: no baseline ( record it with --update )")
+            continue
+        if result["records_per_second"] < baseline["records_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['records_per_second']:.0f} records/s "
+                               f"( baseline {baseline['records_per_second']:.0f} )")
+        if result["peak_traced_bytes"] > baseline["peak_traced_bytes"] * (1 + MEMORY_TOLERANCE):
+            regressions.append(f"{name}: {result['peak_traced_bytes'] / 2 ** 20:.1f} MiB peak "
+                               f"( baseline {baseline['peak_traced_bytes'] / 2 ** 20:.1f} MiB )")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmarks the dataset builders on synthetic inputs.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="the size of the inputs")
+    parser.add_argument("--only", action="append", help="run only this benchmark ( repeatable )")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="the number of timed runs of each benchmark")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="the JSON file of the baselines")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baselines")
+    arguments = parser.parse_args(argv)
+    if not arguments.update and not os.path.exists(arguments.baseline):
+        # Without the baselines nothing would be compared, and the run would always pass
+        sys.exit(f"No baselines in {arguments.baseline}: record them with --update")
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run_benchmarks(SCALES[arguments.scale], directory, arguments.only, arguments.repeat)
+    for name, result in results.items():
+        print(f"{name:40} {result['records_per_second']:12.0f} records/s "
+              f"{result['peak_traced_bytes'] / 2 ** 20:10.1f} MiB peak")
+
+    baselines = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline, 'r', encoding='utf-8') as file:
+            baselines = json.load(file)
+    machine = machine_id()
+    if arguments.update:
+        baselines.setdefault(machine, {}).setdefault(arguments.scale, {}).update(results)
+        with open(arguments.baseline, 'w', encoding='utf-8') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print("Baselines updated: ", arguments.baseline, " for ", machine)
+        return
+    if machine not in baselines:
+        print("No baselines for this machine: ", machine)
+    regressions = find_regressions(results, baselines.get(machine, {}).get(arguments.scale, {}),
+                                   throughput_tolerance(arguments.repeat))
+    if regressions:
+        print("Regressions:\n" + '\n'.join(regressions))
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
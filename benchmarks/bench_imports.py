@@ -0,0 +1,142 @@
+"""
+Import-time regression checks of the commands of cli.py.
+Each command is started with "--help" in a new interpreter under "python -X importtime", so only its
+startup is measured: the imports of cli.py and of the module of the command. The run fails if a command
+imports a heavy module it doesn't need at startup ( HEAVY_MODULES ), if its import time ( the best of
+REPEAT runs ) got slower than the baseline stored in BASELINE_FILE, or if it has no baseline.
+The heavy modules are also checked by tests/test_cli.py.
+The import times depend on the machine, so the baselines should be recorded on the machine running the comparison.
+Run from the repository root with: python -m benchmarks.bench_imports [--update]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+######################### Settings #########################################
+
+# The modules that are slow to import, loaded only by the functions using them
+HEAVY_MODULES = ("numpy", "scipy", "jinja2", "replicate", "nltk", "gensim", "tiktoken", "tokenizers",
+                 "asyncio", "multiprocessing", "urllib.request")
+# The arguments of each command checked, and the heavy modules it's allowed to import at startup
+COMMANDS = {
+    "cli": ([], ()),
+    "build task13": (["build", "task13"], ("numpy",)),
+    "build task14": (["build", "task14"], ("numpy",)),
+    "build task15": (["build", "task15"], ()),
+    "build ghigliottina": (["build", "ghigliottina"], ("numpy", "scipy")),
+    "render": (["render"], ()),
+    "eval": (["eval"], ("asyncio",)),
+    "score": (["score"], ("numpy", "asyncio")),
+    "bench": (["bench"], ("numpy", "urllib.request")),
+}
+# The number of runs of each command ( the fastest one is compared )
+REPEAT = 5
+BASELINE_FILE = "benchmarks/import_baselines.json"
+# The slowdown allowed with respect to the baselines
+IMPORT_TIME_TOLERANCE = 0.3
+CLI_FILE = "cli.py"
+
+
+############################################################################
+
+
+def import_profile(arguments: List[str]) -> Tuple[int, Set[str]]:
+    """
+    Starts a command of cli.py with "--help", under "python -X importtime".
+    :param arguments: List[str]. The arguments of the command.
+    :return: Tuple[int, Set[str]]. The total import time, in microseconds, and the modules imported.
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", CLI_FILE] + arguments + ["--help"],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    total = 0
+    modules = set()
+    # The lines are "import time: {self us} | {cumulative us} | {indented module}", after a header
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, _, module = line[len("import time:"):].split('|')
+        if not self_time.strip().isdigit():
+            continue
+        total += int(self_time)
+        modules.add(module.strip())
+    return total, modules
+
+
+def measure_commands(repeat: int = REPEAT, only: Optional[List[str]] = None) -> Dict[str, Dict[str, object]]:
+    """
+    Measures the startup of the commands.
+    :param repeat: int. The number of runs of each command.
+    :param only: Optional[List[str]]. The names of the commands measured ( None means all of them ).
+    :return: Dict[str, Dict[str, object]]. The best import time ( "import_us" ) of each command,
+    and the heavy modules it imported but isn't allowed to ( "unexpected" ).
+    """
+    results = {}
+    for name, (arguments, allowed) in COMMANDS.items():
+        if only and name not in only:
+            continue
+        times = []
+        modules = set()
+        for _ in range(repeat):
+            total, modules = import_profile(arguments)
+            times.append(total)
+        unexpected = sorted(module for module in HEAVY_MODULES if module in modules and module not in allowed)
+        results[name] = {"import_us": min(times), "unexpected": unexpected}
+    return results
+
+
+def find_regressions(results: Dict[str, Dict[str, object]], baselines: Dict[str, Dict[str, object]]) -> List[str]:
+    """
+    :param results: Dict[str, Dict[str, object]]. The measures ( see "measure_commands" ).
+    :param baselines: Dict[str, Dict[str, object]]. The baselines, in the same format.
+    :return: List[str]. A description of each regression.
+    """
+    regressions = []
+    for name, result in results.items():
+        if result["unexpected"]:
+            regressions.append(f"{name}: imports {', '.join(result['unexpected'])} at startup")
+        baseline = baselines.get(name)
+        if baseline is None:
+            regressions.append(f"{name}: no baseline ( record it with --update )")
+        elif result["import_us"] > baseline["import_us"] * (1 + IMPORT_TIME_TOLERANCE):
+            regressions.append(f"{name}: {result['import_us'] / 1000:.1f} ms of imports "
+                               f"( baseline {baseline['import_us'] / 1000:.1f} ms )")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Checks the import time of the commands of cli.py.")
+    parser.add_argument("--only", action="append", help="check only this command, e.g. 'build task13' ( repeatable )")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="the number of runs of each command")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="the JSON file of the baselines")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baselines")
+    arguments = parser.parse_args(argv)
+    if not arguments.update and not os.path.exists(arguments.baseline):
+        # Without the baselines only the heavy modules would be checked, not the import times
+        sys.exit(f"No baselines in {arguments.baseline}: record them with --update")
+
+    results = measure_commands(arguments.repeat, arguments.only)
+    for name, result in results.items():
+        print(f"{name:20} {result['import_us'] / 1000:8.1f} ms  {' '.join(result['unexpected'])}")
+
+    baselines = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline, 'r', encoding='utf-8') as file:
+            baselines = json.load(file)
+    if arguments.update:
+        baselines.update(results)
+        with open(arguments.baseline, 'w', encoding='utf-8') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print("Baselines updated: ", arguments.baseline)
+        return
+    regressions = find_regressions(results, baselines)
+    if regressions:
+        print("Regressions:\n" + '\n'.join(regressions))
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
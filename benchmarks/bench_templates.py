@@ -0,0 +1,42 @@
+"""
+Micro-benchmark of the prompt rendering: compiling the template at every call
+versus reusing the compiled template ( tests.compile_template ).
+Run from the repository root with: python -m benchmarks.bench_templates
+"""
+import timeit
+
+from jinja2 import Template
+
+from tests import compile_template, load_contexts, load_prompts, parse_prompt, render_batch
+
+PROMPTS_FILE = "task-15/prompt-geometry.jsonl"
+BENCHMARK_FILE = "task-15/benchmarks/PRELEARN-geometry-pairs_test.jsonl"
+# The number of times each measure is repeated ( the best one is reported )
+REPEAT = 5
+
+
+def render_uncached(prompt, contexts):
+    return [Template(prompt).render(**context) for context in contexts]
+
+
+def render_cached(prompt, contexts):
+    return [parse_prompt(prompt, context) for context in contexts]
+
+
+def main():
+    prompts = load_prompts(PROMPTS_FILE)
+    contexts = list(load_contexts(BENCHMARK_FILE))
+    print("Rendering", len(prompts), "prompts with", len(contexts), "contexts")
+    for prompt in prompts:
+        compile_template(prompt)
+        uncached = min(timeit.repeat(lambda: render_uncached(prompt, contexts), number=1, repeat=REPEAT))
+        cached = min(timeit.repeat(lambda: render_cached(prompt, contexts), number=1, repeat=REPEAT))
+        batch = min(timeit.repeat(lambda: list(render_batch(prompt, contexts)), number=1, repeat=REPEAT))
+        print(f"per-call compile: {uncached * 1e6 / len(contexts):8.1f} us/context | "
+              f"cached: {cached * 1e6 / len(contexts):8.1f} us/context | "
+              f"render_batch: {batch * 1e6 / len(contexts):8.1f} us/context | "
+              f"speedup: {uncached / cached:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
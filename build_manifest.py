@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Any, Dict, Iterable
+
+# The suffix of the manifest file, written next to each built output
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+@lru_cache(maxsize=None)
+def _fingerprint(file_path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path: str) -> str:
+    """
+    Computes the SHA-256 of a file content. A file is hashed at most once per process,
+    unless its modification time or size change.
+    :param file_path: str. The path of the file.
+    :return: str. The hex digest of the file content.
+    """
+    stat = os.stat(file_path)
+    return _fingerprint(os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+def create_manifest(inputs: Iterable[str], parameters: Dict[str, Any], code_files: Iterable[str]) -> Dict[str, Any]:
+    """
+    Creates the manifest of an output: everything that, if changed, requires the output to be rebuilt.
+    :param inputs: Iterable[str]. The input files of the output.
+    :param parameters: Dict[str, Any]. The hyperparameters used to build the output ( JSON serializable ).
+    :param code_files: Iterable[str]. The source files of the code building the output ( the code version ).
+    :return: Dict[str, Any]. The manifest.
+    """
+    manifest = {
+        "inputs": {file_path: file_fingerprint(file_path) for file_path in inputs},
+        "parameters": parameters,
+        "code": {os.path.basename(file_path): file_fingerprint(file_path) for file_path in code_files},
+    }
+    # The manifest is normalized as it would be read from disk ( e.g. int keys become strings )
+    return json.loads(json.dumps(manifest, sort_keys=True))
+
+
+def is_up_to_date(output_path: str, manifest: Dict[str, Any]) -> bool:
+    """
+    Checks whether an output was built with the same manifest, so it doesn't need to be rebuilt.
+    :param output_path: str. The path of the output.
+    :param manifest: Dict[str, Any]. The manifest the output would be built with.
+    :return: bool. True if the output exists and its manifest is the same, False else.
+    """
+    if not os.path.exists(output_path):
+        return False
+    try:
+        with open(output_path + MANIFEST_SUFFIX, 'r', encoding='utf-8') as file:
+            return json.load(file) == manifest
+    except (OSError, ValueError):
+        return False
+
+
+def invalidate_manifest(output_path: str):
+    """
+    Removes the manifest of an output before it's rebuilt, so that a build interrupted midway
+    leaves no manifest, and the partial output is never taken as up to date.
+    :param output_path: str. The path of the output.
+    """
+    try:
+        os.remove(output_path + MANIFEST_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def write_manifest(output_path: str, manifest: Dict[str, Any]):
+    """
+    Writes the manifest of a built output next to it, once the output is complete.
+    :param output_path: str. The path of the output.
+    :param manifest: Dict[str, Any]. The manifest the output was built with.
+    """
+    with open(output_path + MANIFEST_SUFFIX, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
@@ -0,0 +1,67 @@
+"""
+The single command line entry point of the project:
+    python cli.py build task13|task14|task15|ghigliottina [options]
+    python cli.py render [options]
+    python cli.py eval [options]
+    python cli.py score [options]
+    python cli.py bench [options]
+The options of each command are the ones of its module, e.g. "python cli.py build task13 --help".
+Only the module of the command is imported, so each command loads only the heavy dependencies it uses
+( numpy, jinja2, replicate... ). The import time of every command is checked by benchmarks/bench_imports.py.
+"""
+import argparse
+import importlib
+from typing import List, Optional
+
+######################### Settings #########################################
+
+# The module of each build target, whose "main" function parses the options
+BUILD_TARGETS = {
+    "task13": "task_13",
+    "task14": "task_14_embeddings",
+    "task15": "task_15",
+    "ghigliottina": "task_14_generator",
+}
+# The module of each other command, whose "main" function parses the options, and its help
+COMMANDS = {
+    "render": ("tests", "parse the prompts with random contexts"),
+    "eval": ("sharded_evaluation", "evaluate the prompts in resumable shards"),
+    "score": ("scoring", "score the results of an evaluation and compare the prompts"),
+    "bench": ("benchmarks.bench_builders", "benchmark the dataset builders"),
+}
+
+############################################################################
+
+
+def parse_command(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command, leaving its options to the module running it.
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    :return: argparse.Namespace. The module of the command ( "module" ) and its options ( "options" ).
+    """
+    parser = argparse.ArgumentParser(description="Builds the benchmarks, renders and evaluates the prompts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", add_help=False, help="build the benchmark of a task")
+    build.add_argument("target", choices=sorted(BUILD_TARGETS), help="the task")
+    build.set_defaults(module=None)
+    for command, (module, description) in COMMANDS.items():
+        commands.add_parser(command, add_help=False, help=description).set_defaults(module=module)
+    # The arguments unknown to the command ( including --help ) are the options of its module
+    arguments, options = parser.parse_known_args(argv)
+    arguments.options = options
+    if arguments.module is None:
+        arguments.module = BUILD_TARGETS[arguments.target]
+    return arguments
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Runs a command, importing only its module.
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    """
+    arguments = parse_command(argv)
+    importlib.import_module(arguments.module).main(arguments.options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+import asyncio
+import json
+import random
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+######################### Settings #########################################
+
+# The max number of requests in flight at the same time
+CONCURRENCY = 8
+# The max number of requests sent per second ( None means unlimited )
+REQUESTS_PER_SECOND = None
+# The number of times a failed request is retried
+RETRIES = 3
+# The delay before the first retry, in seconds. It doubles at every retry
+BACKOFF = 1.0
+# The number of records whose choices are scored in a single request ( see "run_choice_evaluation" )
+CHOICE_BATCH_SIZE = 16
+
+
+############################################################################
+
+# The errors of a request that would fail again if retried ( e.g. a backend that can't compute log-likelihoods )
+_NON_RETRYABLE_ERRORS = (NotImplementedError, TypeError, ValueError)
+# The subclasses of those errors that are transient, e.g. a response truncated by the network
+_RETRYABLE_ERRORS = (json.JSONDecodeError,)
+
+
+class Backend:
+    """
+    The interface of a LLM backend: it generates the output of a prompt.
+    """
+    # The id of the model used by the backend
+    model: str = ""
+    # The generation parameters sent with every prompt
+    params: Dict[str, Any] = {}
+
+    async def generate(self, prompt: str) -> str:
+        """
+        Generates the output of a prompt.
+        :param prompt: str. The rendered prompt.
+        :return: str. The output of the model.
+        """
+        raise NotImplementedError
+
+    async def loglikelihoods(self, requests: List[Tuple[str, List[str]]]) -> List[List[float]]:
+        """
+        Computes the log-likelihood of some continuations of some prompts, in a single request.
+        :param requests: List[Tuple[str, List[str]]]. The (rendered prompt, continuations) pairs.
+        :return: List[List[float]]. The log-likelihood of each continuation given its prompt, per request.
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't compute log-likelihoods.")
+
+    def supports_loglikelihoods(self) -> bool:
+        """
+        :return: bool. Whether the backend can compute log-likelihoods ( see "loglikelihoods" ).
+        """
+        return type(self).loglikelihoods is not Backend.loglikelihoods
+
+
+class ReplicateBackend(Backend):
+    """
+    A backend running the prompts on Replicate. It needs the REPLICATE_API_TOKEN environment variable.
+    """
+
+    def __init__(self, model: str = "meta/llama-2-70b-chat", params: Optional[Dict[str, Any]] = None):
+        """
+        :param model: str. The Replicate model id.
+        :param params: Optional[Dict[str, Any]]. The generation parameters ( e.g. "system_prompt" ).
+        """
+        self.model = model
+        self.params = params or {}
+
+    def _run(self, prompt: str) -> str:
+        import replicate
+
+        return ''.join(replicate.run(self.model, input={"prompt": prompt, **self.params}))
+
+    async def generate(self, prompt: str) -> str:
+        # The Replicate client is blocking, so it runs in the default thread pool
+        return await asyncio.get_running_loop().run_in_executor(None, self._run, prompt)
+
+
+class HttpBackend(Backend):
+    """
+    A backend posting the prompts to an HTTP server, e.g. a local stand-in of a hosted model.
+    The server receives { "model": str, "prompt": str, **params } and answers { "output": str }.
+    The log-likelihoods are posted to the same server as
+    { "model": str, "requests": [ { "prompt": str, "continuations": [str] } ], **params }
+    and the server answers { "loglikelihoods": [[float]] }.
+    """
+
+    def __init__(self, url: str, model: str = "", params: Optional[Dict[str, Any]] = None, timeout: float = 60):
+        """
+        :param url: str. The URL of the server.
+        :param model: str. The model id sent to the server.
+        :param params: Optional[Dict[str, Any]]. The generation parameters.
+        :param timeout: float. The timeout of a request, in seconds.
+        """
+        self.url = url
+        self.model = model
+        self.params = params or {}
+        self.timeout = timeout
+
+    def _post(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        import urllib.request
+
+        data = json.dumps({"model": self.model, **body, **self.params}).encode('utf-8')
+        request = urllib.request.Request(self.url, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    async def generate(self, prompt: str) -> str:
+        response = await asyncio.get_running_loop().run_in_executor(None, self._post, {"prompt": prompt})
+        return response["output"]
+
+    async def loglikelihoods(self, requests: List[Tuple[str, List[str]]]) -> List[List[float]]:
+        body = {"requests": [{"prompt": prompt, "continuations": continuations} for prompt, continuations in requests]}
+        response = await asyncio.get_running_loop().run_in_executor(None, self._post, body)
+        return response["loglikelihoods"]
+
+
+class FakeBackend(Backend):
+    """
+    A local backend for testing, which answers after a simulated latency and can fail randomly.
+    """
+
+    def __init__(self, answer: Callable[[str], str] = lambda prompt: "si", latency: float = 0.0,
+                 failure_rate: float = 0.0, seed: Optional[int] = None, model: str = "fake",
+                 loglikelihood: Optional[Callable[[str, str], float]] = None):
+        """
+        :param answer: Callable[[str], str]. The function computing the output of a prompt.
+        :param latency: float. The simulated latency of each request, in seconds.
+        :param failure_rate: float. The probability that a request fails.
+        :param seed: Optional[int]. The seed of the simulated failures.
+        :param model: str. The model id.
+        :param loglikelihood: Optional[Callable[[str, str], float]]. The function computing the log-likelihood
+        of a continuation of a prompt ( None means a deterministic pseudo-random value in [-10, 0) ).
+        """
+        self.answer = answer
+        self.loglikelihood = loglikelihood or _fake_loglikelihood
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.model = model
+        self.params = {}
+        # The requests received, the ones failed, and the max number of requests in flight at the same time
+        self.calls = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _request(self, respond: Callable[[], Any]) -> Any:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.random.random() < self.failure_rate:
+                self.failures += 1
+                raise RuntimeError("Simulated backend failure")
+            return respond()
+        finally:
+            self.in_flight -= 1
+
+    async def generate(self, prompt: str) -> str:
+        return await self._request(lambda: self.answer(prompt))
+
+    async def loglikelihoods(self, requests: List[Tuple[str, List[str]]]) -> List[List[float]]:
+        return await self._request(lambda: [[self.loglikelihood(prompt, continuation) for continuation in continuations]
+                                            for prompt, continuations in requests])
+
+
+def _fake_loglikelihood(prompt: str, continuation: str) -> float:
+    return -(zlib.crc32((prompt + '\0' + continuation).encode('utf-8')) % 1000) / 100 - 0.01
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter: a request can be sent only after acquiring a token, and the
+    tokens are refilled at a constant rate, up to the capacity of the bucket.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: float. The tokens added per second.
+        :param capacity: Optional[float]. The max number of tokens ( None means one second of tokens, at least 1 ).
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Waits until a token is available, and takes it.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """
+    Computes a percentile of some values, with the nearest-rank method.
+    :param values: List[float]. The values.
+    :param fraction: float. The percentile, in [0, 1].
+    :return: Optional[float]. The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))]
+
+
+async def call_with_retries(request: Callable[[], Awaitable[Any]], retries: int = RETRIES,
+                            backoff: float = BACKOFF, bucket: Optional[TokenBucket] = None) -> Any:
+    """
+    Sends a request to a backend, retrying with exponential backoff ( and jitter ) when it fails.
+    The errors that would happen again ( NotImplementedError, TypeError, ValueError ) are not retried,
+    except for the responses that aren't valid JSON ( json.JSONDecodeError ).
+    :param request: Callable[[], Awaitable[Any]]. The function sending the request.
+    :param retries: int. The number of retries.
+    :param backoff: float. The delay before the first retry, in seconds.
+    :param bucket: Optional[TokenBucket]. The rate limiter of the requests, if any.
+    :return: Any. The response of the backend.
+    """
+    for attempt in range(retries + 1):
+        if bucket is not None:
+            await bucket.acquire()
+        try:
+            return await request()
+        except Exception as error:
+            if isinstance(error, _NON_RETRYABLE_ERRORS) and not isinstance(error, _RETRYABLE_ERRORS):
+                raise
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+async def _run_workers(produce: Callable[[], Awaitable[None]], worker: Callable[[], Awaitable[None]],
+                       concurrency: int):
+    # The producer fills the queue of the workers. If any of them fails ( e.g. writing a result ), the others
+    # are cancelled, so the producer is never left waiting for a full queue
+    tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def generate_with_retries(backend: Backend, prompt: str, retries: int = RETRIES,
+                                backoff: float = BACKOFF, bucket: Optional[TokenBucket] = None) -> str:
+    """
+    Generates the output of a prompt, retrying with exponential backoff ( and jitter ) when the backend fails.
+    :param backend: Backend. The backend.
+    :param prompt: str. The rendered prompt.
+    :param retries: int. The number of retries.
+    :param backoff: float. The delay before the first retry, in seconds.
+    :param bucket: Optional[TokenBucket]. The rate limiter of the requests, if any.
+    :return: str. The output of the model.
+    """
+    return await call_with_retries(lambda: backend.generate(prompt), retries, backoff, bucket)
+
+
+async def run_evaluation(backend: Backend, items: Iterable[Tuple[str, str]], output_file: str,
+                         concurrency: int = CONCURRENCY, requests_per_second: Optional[float] = REQUESTS_PER_SECOND,
+                         retries: int = RETRIES, backoff: float = BACKOFF) -> Dict[str, Any]:
+    """
+    Runs the prompts on a backend, with at most "concurrency" requests in flight.
+    The results are appended to a JSONL file as soon as they complete ( so not in input order ),
+    each one in the format { "id": str, "prompt": str, "output": str, "latency": float },
+    or { "id": str, "prompt": str, "error": str } if all the retries failed.
+    The items are consumed lazily, so they can be a generator of any size.
+    :param backend: Backend. The backend.
+    :param items: Iterable[Tuple[str, str]]. The (id, rendered prompt) pairs to run.
+    :param output_file: str. The JSONL results file.
+    :param concurrency: int. The max number of requests in flight.
+    :param requests_per_second: Optional[float]. The max number of requests per second ( None means unlimited ).
+    :param retries: int. The number of retries of a failed request.
+    :param backoff: float. The delay before the first retry, in seconds.
+    :return: Dict[str, Any]. The report of the run: completed and failed items, elapsed seconds,
+    throughput ( completed items per second ) and p50/p95 latency of the completed items, in seconds.
+    """
+    bucket = TokenBucket(requests_per_second) if requests_per_second else None
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    latencies: List[float] = []
+    failed = 0
+
+    with open(output_file, 'a', encoding='utf-8') as file:
+        async def worker():
+            nonlocal failed
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                item_id, prompt = item
+                started_at = time.monotonic()
+                try:
+                    output = await generate_with_retries(backend, prompt, retries, backoff, bucket)
+                except Exception as error:
+                    failed += 1
+                    result = {"id": item_id, "prompt": prompt, "error": repr(error)}
+                else:
+                    latency = time.monotonic() - started_at
+                    latencies.append(latency)
+                    result = {"id": item_id, "prompt": prompt, "output": output, "latency": latency}
+                file.write(json.dumps(result, ensure_ascii=False) + '\n')
+                file.flush()
+
+        async def produce():
+            for item in items:
+                await queue.put(item)
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        started_at = time.monotonic()
+        await _run_workers(produce, worker, concurrency)
+        elapsed = time.monotonic() - started_at
+
+    return {
+        "completed": len(latencies),
+        "failed": failed,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else None,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+    }
+
+
+def evaluate(backend: Backend, items: Iterable[Tuple[str, str]], output_file: str, **options) -> Dict[str, Any]:
+    """
+    Runs the prompts on a backend from synchronous code ( see "run_evaluation" ).
+    :param backend: Backend. The backend.
+    :param items: Iterable[Tuple[str, str]]. The (id, rendered prompt) pairs to run.
+    :param output_file: str. The JSONL results file.
+    :return: Dict[str, Any]. The report of the run.
+    """
+    return asyncio.run(run_evaluation(backend, items, output_file, **options))
+
+
+async def run_choice_evaluation(backend: Backend, items: Iterable[Tuple[str, str, List[str]]], output_file: str,
+                                batch_size: int = CHOICE_BATCH_SIZE, concurrency: int = CONCURRENCY,
+                                requests_per_second: Optional[float] = REQUESTS_PER_SECOND,
+                                retries: int = RETRIES, backoff: float = BACKOFF) -> Dict[str, Any]:
+    """
+    Scores the choices of multiple-choice prompts by their log-likelihood, instead of generating an answer.
+    The choices of "batch_size" items are sent in a single request, with at most "concurrency" requests in flight.
+    The results are appended to a JSONL file as soon as they complete, each one in the format
+    { "id": str, "choices": [str], "loglikelihoods": [float], "prediction": int, "latency": float }
+    ( the prediction is the choice with the highest log-likelihood ), or { "id": str, "error": str }
+    if all the retries failed. If the backend can't compute log-likelihoods, a NotImplementedError is raised
+    before sending any request.
+    :param backend: Backend. The backend ( see "Backend.loglikelihoods" ).
+    :param items: Iterable[Tuple[str, str, List[str]]]. The (id, rendered prompt, choices) triples to score.
+    Each choice is scored as a continuation of the prompt, so it should start with a space if needed.
+    :param output_file: str. The JSONL results file.
+    :param batch_size: int. The number of items per request.
+    :param concurrency: int. The max number of requests in flight.
+    :param requests_per_second: Optional[float]. The max number of requests per second ( None means unlimited ).
+    :param retries: int. The number of retries of a failed request.
+    :param backoff: float. The delay before the first retry, in seconds.
+    :return: Dict[str, Any]. The report of the run: completed and failed items, requests sent, elapsed seconds,
+    throughput ( completed items per second ) and p50/p95 latency of the requests, in seconds.
+    """
+    if not backend.supports_loglikelihoods():
+        raise NotImplementedError(f"{type(backend).__name__} can't compute log-likelihoods.")
+    bucket = TokenBucket(requests_per_second) if requests_per_second else None
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    latencies: List[float] = []
+    completed = 0
+    failed = 0
+
+    with open(output_file, 'a', encoding='utf-8') as file:
+        async def worker():
+            nonlocal completed, failed
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                requests = [(prompt, choices) for _, prompt, choices in batch]
+                started_at = time.monotonic()
+                try:
+                    scores = await call_with_retries(lambda: backend.loglikelihoods(requests), retries, backoff,
+                                                     bucket)
+                except Exception as error:
+                    failed += len(batch)
+                    results = [{"id": item_id, "error": repr(error)} for item_id, _, _ in batch]
+                else:
+                    latency = time.monotonic() - started_at
+                    latencies.append(latency)
+                    completed += len(batch)
+                    results = [{"id": item_id, "choices": choices, "loglikelihoods": loglikelihoods,
+                                "prediction": max(range(len(choices)), key=loglikelihoods.__getitem__),
+                                "latency": latency}
+                               for (item_id, _, choices), loglikelihoods in zip(batch, scores)]
+                file.write(''.join(json.dumps(result, ensure_ascii=False) + '\n' for result in results))
+                file.flush()
+
+        async def produce():
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) == batch_size:
+                    await queue.put(batch)
+                    batch = []
+            if batch:
+                await queue.put(batch)
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        started_at = time.monotonic()
+        await _run_workers(produce, worker, concurrency)
+        elapsed = time.monotonic() - started_at
+
+    return {
+        "completed": completed,
+        "failed": failed,
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "throughput": completed / elapsed if elapsed > 0 else None,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+    }
+
+
+def evaluate_choices(backend: Backend, items: Iterable[Tuple[str, str, List[str]]], output_file: str,
+                     **options) -> Dict[str, Any]:
+    """
+    Scores the choices of multiple-choice prompts from synchronous code ( see "run_choice_evaluation" ).
+    :param backend: Backend. The backend.
+    :param items: Iterable[Tuple[str, str, List[str]]]. The (id, rendered prompt, choices) triples to score.
+    :param output_file: str. The JSONL results file.
+    :return: Dict[str, Any]. The report of the run.
+    """
+    return asyncio.run(run_choice_evaluation(backend, items, output_file, **options))
@@ -0,0 +1,253 @@
+import functools
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    import cProfile
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: the peak RSS is not measured
+    resource = None
+
+# The flag of the generator functions ( inspect.CO_GENERATOR ): inspect is not imported, since every module
+# using the instrumentation would pay for it
+_CO_GENERATOR = 0x20
+
+
+class Instrumentation:
+    """
+    Opt-in timers and memory probes for the stages of the benchmark builders.
+    For each stage it records the wall time, the number of calls, the number of records processed
+    and, if enabled, the peak memory of the Python allocations traced by tracemalloc during the stage.
+    The peak RSS of the whole process when the stage ended is recorded too: it's not a per-stage measure.
+    The times are inclusive: a stage consuming a timed generator also includes its time.
+    While disabled, a timed function costs a single attribute check per call.
+    tracemalloc and cProfile are imported only when enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.profiler: Optional['cProfile.Profile'] = None
+        # The peak traced memory of the stages being measured, innermost last
+        self._peaks: List[int] = []
+
+    def enable(self, trace_memory: bool = True, profile: bool = False):
+        """
+        Enables the instrumentation, discarding the stages recorded so far.
+        :param trace_memory: bool. Whether to trace the Python allocations with tracemalloc ( slower ).
+        :param profile: bool. Whether to run the cProfile profiler too ( see "dump_profile" ).
+        """
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.stages = {}
+        if trace_memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        if profile:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def disable(self):
+        """
+        Disables the instrumentation, keeping the stages recorded so far.
+        """
+        self.enabled = False
+        if self.trace_memory:
+            import tracemalloc
+
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def record(self, name: str, seconds: float, calls: int = 1, records: int = 0, peak_traced: int = 0):
+        """
+        Adds a measure to a stage.
+        :param name: str. The name of the stage.
+        :param seconds: float. The wall time spent in the stage.
+        :param calls: int. The number of calls of the stage.
+        :param records: int. The number of records processed by the stage.
+        :param peak_traced: int. The peak traced memory during the stage, in bytes.
+        """
+        stats = self.stages.setdefault(name, {"calls": 0, "records": 0, "seconds": 0.0,
+                                              "process_peak_rss_kb": 0, "peak_traced_bytes": 0})
+        stats["calls"] += calls
+        stats["records"] += records
+        stats["seconds"] += seconds
+        if resource is not None:
+            # The peak RSS of the process so far ( ru_maxrss ), including the previous stages
+            stats["process_peak_rss_kb"] = max(stats["process_peak_rss_kb"],
+                                               resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        stats["peak_traced_bytes"] = max(stats["peak_traced_bytes"], peak_traced)
+
+    def _start_peak(self) -> bool:
+        # Starts measuring the peak traced memory of a stage, if enabled
+        if not self.trace_memory:
+            return False
+        import tracemalloc
+
+        if not tracemalloc.is_tracing() or not hasattr(tracemalloc, 'reset_peak'):
+            return False
+        # The peak reached so far belongs to the enclosing stage
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._peaks.append(0)
+        return True
+
+    def _stop_peak(self) -> int:
+        # Stops measuring the peak traced memory of the innermost stage, and returns it
+        import tracemalloc
+
+        peak_traced = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak_traced)
+        tracemalloc.reset_peak()
+        return peak_traced
+
+    @contextmanager
+    def _measure(self, name: str, records: int) -> Iterator[None]:
+        measure_memory = self._start_peak()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started_at
+            peak_traced = self._stop_peak() if measure_memory else 0
+            self.record(name, seconds, records=records, peak_traced=peak_traced)
+
+    def stage(self, name: str, records: int = 0):
+        """
+        A context manager measuring a stage.
+        :param name: str. The name of the stage.
+        :param records: int. The number of records processed by the stage.
+        """
+        if not self.enabled:
+            return _NO_STAGE
+        return self._measure(name, records)
+
+    def _time_generator(self, name: str, generator: Iterator[Any]) -> Iterator[Any]:
+        # Only the time and the memory spent producing the items are measured, not the consumer's ones
+        seconds = 0.0
+        records = 0
+        peak_traced = 0
+        try:
+            while True:
+                measure_memory = self._start_peak()
+                started_at = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started_at
+                    if measure_memory:
+                        peak_traced = max(peak_traced, self._stop_peak())
+                records += 1
+                yield item
+        finally:
+            self.record(name, seconds, records=records, peak_traced=peak_traced)
+
+    def timed(self, name: str, records: Optional[Callable[..., int]] = None) -> Callable:
+        """
+        A decorator measuring each call of a function as a stage.
+        For a generator function, the time spent producing the items is measured, and each item is a record.
+        :param name: str. The name of the stage.
+        :param records: Optional[Callable[..., int]]. A function computing the number of records processed
+        by a call from its arguments ( None means one record per call ).
+        """
+
+        def decorator(function: Callable) -> Callable:
+            if function.__code__.co_flags & _CO_GENERATOR:
+                @functools.wraps(function)
+                def generator_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return function(*args, **kwargs)
+                    return self._time_generator(name, function(*args, **kwargs))
+
+                return generator_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self._measure(name, records(*args, **kwargs) if records is not None else 1):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: Dict[str, Dict[str, float]]. A copy of the stages recorded so far, e.g. to send them
+        from a worker process to the parent one ( see "merge" ).
+        """
+        return {name: dict(stats) for name, stats in self.stages.items()}
+
+    def merge(self, stages: Dict[str, Dict[str, float]]):
+        """
+        Adds the stages recorded by another process.
+        :param stages: Dict[str, Dict[str, float]]. The stages ( see "snapshot" ).
+        """
+        for name, stats in stages.items():
+            merged = self.stages.setdefault(name, {"calls": 0, "records": 0, "seconds": 0.0,
+                                                   "process_peak_rss_kb": 0, "peak_traced_bytes": 0})
+            for key in ("calls", "records", "seconds"):
+                merged[key] += stats[key]
+            for key in ("process_peak_rss_kb", "peak_traced_bytes"):
+                merged[key] = max(merged[key], stats[key])
+
+    def report(self) -> Dict[str, Any]:
+        """
+        :return: Dict[str, Any]. The machine-readable report of the stages, with their throughput
+        ( records per second ).
+        """
+        stages = {}
+        for name, stats in self.stages.items():
+            stages[name] = dict(stats)
+            stages[name]["records_per_second"] = stats["records"] / stats["seconds"] if stats["seconds"] else None
+        return {"python": sys.version.split()[0], "stages": stages}
+
+    def write_report(self, file_path: str):
+        """
+        Writes the report of the stages as JSON.
+        :param file_path: str. The path of the report.
+        """
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def dump_profile(self, file_path: str):
+        """
+        Writes the cProfile statistics, readable with pstats or snakeviz.
+        :param file_path: str. The path of the profile.
+        """
+        if self.profiler is not None:
+            self.profiler.dump_stats(file_path)
+
+
+class _NoStage:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+# The instrumentation shared by all the modules
+INSTRUMENTATION = Instrumentation()
+stage = INSTRUMENTATION.stage
+timed = INSTRUMENTATION.timed
@@ -0,0 +1,214 @@
+import gzip
+import itertools
+import json
+from typing import Any, Dict, Iterable, Iterator, List, TextIO
+
+from instrumentation import stage, timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+######################### Settings #########################################
+
+# The number of records buffered by a writer before writing them to the file
+WRITE_BATCH_SIZE = 1024
+# The number of characters read at a time when streaming a JSON array
+READ_CHUNK_SIZE = 1 << 16
+
+
+############################################################################
+
+# The characters that can follow an item of a JSON array
+_DELIMITERS = ' \t\r\n,]'
+
+
+def open_text(file_path: str, mode: str = 'r') -> TextIO:
+    """
+    Opens a UTF-8 text file, compressing or decompressing it transparently if its
+    name ends in ".gz" ( gzip ) or ".zst" ( zstandard, if installed ).
+    :param file_path: str. The path of the file.
+    :param mode: str. The mode of the file: 'r', 'w' or 'a'.
+    :return: TextIO. The opened file.
+    """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode + 't', encoding='utf-8')
+    if file_path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading or writing .zst files needs the 'zstandard' package.")
+        return zstandard.open(file_path, mode + 't', encoding='utf-8')
+    return open(file_path, mode, encoding='utf-8')
+
+
+def dumps(record: Any) -> str:
+    """
+    Serializes a record as compact JSON, keeping the non-ASCII characters. The non-string keys are
+    converted to strings, like json does. With or without orjson installed the output is the same,
+    except for the floats: orjson writes NaN and Infinity as null ( json writes NaN and Infinity,
+    which aren't valid JSON ), and the exponents without "+" and leading zeros ( 1e16, not 1e+16 ).
+    :param record: Any. The record to serialize.
+    :return: str. The JSON string.
+    """
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(line: str) -> Any:
+    """
+    Deserializes a JSON string.
+    :param line: str. The JSON string.
+    :return: Any. The record.
+    """
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def read_jsonl(file_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Reads the records of a JSONL file one at a time. Empty lines are skipped.
+    :param file_path: str. The path of the file.
+    :return: Iterator[Dict[str, Any]]. The records, in file order.
+    """
+    with open_text(file_path, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield loads(line)
+
+
+class JsonlWriter:
+    """
+    A buffered JSONL writer: the records are serialized as they're written,
+    and written to the file in batches.
+    The serialization is timed per batch of records ( see "write_batch" ), not per record.
+    """
+
+    def __init__(self, file_path: str, mode: str = 'w', batch_size: int = WRITE_BATCH_SIZE):
+        """
+        :param file_path: str. The path of the file.
+        :param mode: str. 'w' to overwrite the file, 'a' to append to it.
+        :param batch_size: int. The number of records buffered before writing them.
+        """
+        self.file = open_text(file_path, mode)
+        self.batch_size = batch_size
+        self.buffer: List[str] = []
+        self.count = 0
+
+    def write(self, record: Any):
+        """
+        Writes a record.
+        :param record: Any. The record to write.
+        """
+        self.buffer.append(dumps(record) + '\n')
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def write_batch(self, records: List[Any]):
+        """
+        Writes many records, timing their serialization as a "json_encode" stage per batch of the writer.
+        :param records: List[Any]. The records to write.
+        """
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            with stage("json_encode", records=len(batch)):
+                self.buffer.extend([dumps(record) + '\n' for record in batch])
+            self.count += len(batch)
+            if len(self.buffer) >= self.batch_size:
+                self.flush()
+
+    @timed("disk_write", records=lambda self: len(self.buffer))
+    def flush(self):
+        """
+        Writes the buffered records to the file.
+        """
+        self.file.write(''.join(self.buffer))
+        self.buffer = []
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self) -> 'JsonlWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_jsonl(file_path: str, records: Iterable[Any], mode: str = 'w',
+                batch_size: int = WRITE_BATCH_SIZE) -> int:
+    """
+    Writes records to a JSONL file, consuming them lazily.
+    :param file_path: str. The path of the file.
+    :param records: Iterable[Any]. The records to write.
+    :param mode: str. 'w' to overwrite the file, 'a' to append to it.
+    :param batch_size: int. The number of records buffered before writing them.
+    :return: int. The number of records written.
+    """
+    records = iter(records)
+    with JsonlWriter(file_path, mode, batch_size) as writer:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            writer.write_batch(batch)
+    return writer.count
+
+
+def iter_json_array(file_path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Reads the items of a file containing a JSON array one at a time, without loading the whole array.
+    :param file_path: str. The path of the file.
+    :param chunk_size: int. The number of characters read at a time.
+    :return: Iterator[Any]. The items of the array, in file order.
+    """
+    decoder = json.JSONDecoder()
+    with open_text(file_path, 'r') as file:
+        buffer = ''
+        position = 0
+        at_end = False
+        started = False
+
+        def read_more() -> bool:
+            nonlocal buffer, position
+            chunk = file.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            return chunk != ''
+
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n' + (',' if started else ''):
+                position += 1
+            if position == len(buffer):
+                if at_end:
+                    raise ValueError("The file does not contain a complete JSON array.")
+                at_end = not read_more()
+                continue
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError("The file does not contain a JSON array.")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if at_end:
+                    raise
+                at_end = not read_more()
+                continue
+            # A number ( or a literal ) could continue in the next chunk, e.g. "1." of "1.25e3":
+            # a value is complete only if a delimiter follows it
+            if not at_end and (end == len(buffer) or buffer[end] not in _DELIMITERS):
+                at_end = not read_more()
+                continue
+            position = end
+            yield item
@@ -0,0 +1,115 @@
+import math
+import re
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+from evaluation import Backend
+
+######################### Hyperparameters ######################################
+
+# The length of the n-grams
+ORDER = 3
+# The add-k smoothing of the probabilities
+SMOOTHING = 0.1
+
+##########################################################################
+
+_TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lowercase words and punctuation marks.
+    :param text: str. The text.
+    :return: List[str]. The tokens.
+    """
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class NgramModel:
+    """
+    A tiny word n-gram language model with add-k smoothing. When a context was never seen,
+    the probability of the next token backs off to the longest seen suffix of the context.
+    """
+
+    def __init__(self, order: int = ORDER, smoothing: float = SMOOTHING):
+        """
+        :param order: int. The length of the n-grams.
+        :param smoothing: float. The count added to every n-gram ( add-k smoothing ).
+        """
+        self.order = order
+        self.smoothing = smoothing
+        # The count of each n-gram of every length up to "order", and of each context
+        self.ngrams: Counter = Counter()
+        self.contexts: Counter = Counter()
+        self.vocabulary = set()
+
+    def train(self, texts: Iterable[str]) -> 'NgramModel':
+        """
+        Counts the n-grams of some texts.
+        :param texts: Iterable[str]. The texts.
+        :return: NgramModel. The model itself.
+        """
+        for text in texts:
+            tokens = tokenize(text)
+            self.vocabulary.update(tokens)
+            for end in range(1, len(tokens) + 1):
+                for length in range(1, min(self.order, end) + 1):
+                    ngram = tuple(tokens[end - length:end])
+                    self.ngrams[ngram] += 1
+                    self.contexts[ngram[:-1]] += 1
+        return self
+
+    def logprob(self, context: Tuple[str, ...], token: str) -> float:
+        """
+        :param context: Tuple[str, ...]. The previous tokens ( only the last order - 1 ones are used ).
+        :param token: str. The next token.
+        :return: float. The natural log-probability of the token after the context.
+        """
+        # The unknown tokens share a single entry of the vocabulary
+        vocabulary_size = len(self.vocabulary) + 1
+        context = context[len(context) - self.order + 1:] if self.order > 1 else ()
+        while context and self.contexts[context] == 0:
+            context = context[1:]
+        count = self.ngrams[context + (token,)]
+        return math.log((count + self.smoothing) / (self.contexts[context] + self.smoothing * vocabulary_size))
+
+    def loglikelihood(self, prompt_tokens: List[str], continuation: str) -> float:
+        """
+        :param prompt_tokens: List[str]. The tokens of the prompt.
+        :param continuation: str. The continuation of the prompt.
+        :return: float. The log-likelihood of the continuation after the prompt.
+        """
+        context = tuple(prompt_tokens[len(prompt_tokens) - self.order + 1:]) if self.order > 1 else ()
+        total = 0.0
+        for token in tokenize(continuation):
+            total += self.logprob(context, token)
+            context = (context + (token,))[len(context) + 2 - self.order:] if self.order > 1 else ()
+        return total
+
+
+class NgramBackend(Backend):
+    """
+    A local reference backend scoring the choices with an NgramModel, for testing the log-likelihood
+    evaluation offline. It can't generate text.
+    """
+
+    def __init__(self, model: NgramModel, name: str = "ngram"):
+        """
+        :param model: NgramModel. The trained model.
+        :param name: str. The model id.
+        """
+        self.ngram_model = model
+        self.model = name
+        self.params = {"order": model.order, "smoothing": model.smoothing}
+        self.requests = 0
+
+    async def loglikelihoods(self, requests: List[Tuple[str, List[str]]]) -> List[List[float]]:
+        self.requests += 1
+        scores = []
+        for prompt, continuations in requests:
+            # The prompt is tokenized once, and shared by all its continuations
+            prompt_tokens = tokenize(prompt)
+            scores.append([self.ngram_model.loglikelihood(prompt_tokens, continuation)
+                           for continuation in continuations])
+        return scores
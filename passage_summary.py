@@ -0,0 +1,145 @@
+import argparse
+import re
+from bisect import bisect_right
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import jsonl_io
+from build_manifest import create_manifest, invalidate_manifest, is_up_to_date, write_manifest
+from jsonl_io import write_jsonl
+from task_15 import WIKIPEDIA_FILE, iter_topics
+
+######################### Settings #########################################
+
+# The tokenizer counting the tokens of the passages ( see "load_tokenizer" )
+TOKENIZER = "regex"
+# The JSONL file of the passage summaries, in the format
+# { "id": concept, "ends": sentence end offsets, "tokens": cumulative token counts }
+SUMMARIES_FILE = "task-15/benchmarks/passage_summaries.jsonl"
+
+# The source files whose changes require the summaries to be rebuilt
+CODE_FILES = (__file__, jsonl_io.__file__)
+
+############################################################################
+
+# A sentence ends with its punctuation ( and closing quotes or brackets ) followed by spaces, or with a new line
+_SENTENCE_END = re.compile(r'[.!?…]+["\'»)\]]*\s+|\n+')
+_TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+
+def load_tokenizer(name: str = TOKENIZER) -> Callable[[str], int]:
+    """
+    Loads a tokenizer, as a function counting the tokens of a text. All of them run locally:
+        - "regex": words and punctuation marks ( no dependencies )
+        - "whitespace": the words separated by spaces
+        - "tiktoken:{encoding}": a tiktoken encoding, e.g. "tiktoken:cl100k_base" ( needs tiktoken )
+        - "hf:{file}": a Hugging Face tokenizer.json file ( needs tokenizers )
+    :param name: str. The name of the tokenizer.
+    :return: Callable[[str], int]. The function counting the tokens of a text.
+    """
+    if name == "regex":
+        return lambda text: sum(1 for _ in _TOKEN_PATTERN.finditer(text))
+    if name == "whitespace":
+        return lambda text: len(text.split())
+    if name.startswith("tiktoken:"):
+        import tiktoken
+        encoding = tiktoken.get_encoding(name[len("tiktoken:"):])
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    if name.startswith("hf:"):
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_file(name[len("hf:"):])
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+    raise ValueError(f"Unknown tokenizer: {name}")
+
+
+def sentence_ends(passage: str) -> List[int]:
+    """
+    Splits a passage into sentences.
+    :param passage: str. The passage.
+    :return: List[int]. The end offset of each sentence, including its trailing spaces.
+    The last one is the length of the passage.
+    """
+    ends = [match.end() for match in _SENTENCE_END.finditer(passage)]
+    if not ends or ends[-1] < len(passage):
+        ends.append(len(passage))
+    return ends
+
+
+def summarize_passage(passage: str, count_tokens: Callable[[str], int]) -> Tuple[List[int], List[int]]:
+    """
+    Computes the sentence boundaries and the cumulative token counts of a passage.
+    :param passage: str. The passage.
+    :param count_tokens: Callable[[str], int]. The tokenizer ( see "load_tokenizer" ).
+    :return: Tuple[List[int], List[int]]. The end offset of each sentence ( see "sentence_ends" ) and
+    the number of tokens of the passage up to the end of each sentence.
+    """
+    ends = sentence_ends(passage)
+    tokens = []
+    total = 0
+    start = 0
+    for end in ends:
+        total += count_tokens(passage[start:end])
+        tokens.append(total)
+        start = end
+    return ends, tokens
+
+
+def truncate_passage(passage: str, ends: List[int], tokens: List[int], budget: int) -> Tuple[str, int]:
+    """
+    Cuts a passage to the longest prefix of whole sentences within a token budget, by binary search
+    on its summary ( see "summarize_passage" ), without tokenizing it again.
+    :param passage: str. The passage.
+    :param ends: List[int]. The end offset of each sentence.
+    :param tokens: List[int]. The cumulative token counts.
+    :param budget: int. The max number of tokens.
+    :return: Tuple[str, int]. The cut passage ( empty if even the first sentence is over budget )
+    and the number of tokens removed.
+    """
+    if not tokens or tokens[-1] <= budget:
+        return passage, 0
+    sentences = bisect_right(tokens, budget)
+    if sentences == 0:
+        return '', tokens[-1]
+    return passage[:ends[sentences - 1]].rstrip(), tokens[-1] - tokens[sentences - 1]
+
+
+def iter_summaries(passages: Iterable[Tuple[str, str]],
+                   count_tokens: Callable[[str], int]) -> Iterator[Dict[str, object]]:
+    """
+    Summarizes some passages, lazily.
+    :param passages: Iterable[Tuple[str, str]]. The (concept, passage) pairs ( see "task_15.iter_topics" ).
+    :param count_tokens: Callable[[str], int]. The tokenizer ( see "load_tokenizer" ).
+    :return: Iterator[Dict[str, object]]. The summaries, in the format of SUMMARIES_FILE.
+    """
+    for concept, passage in passages:
+        ends, tokens = summarize_passage(passage, count_tokens)
+        yield {"id": concept, "ends": ends, "tokens": tokens}
+
+
+def build_summaries(xml_file_path: str = WIKIPEDIA_FILE, file_path: str = SUMMARIES_FILE,
+                    tokenizer: str = TOKENIZER, force: bool = False):
+    """
+    Writes the summary of every passage of a wikipedia file, streaming it.
+    The summaries are rebuilt only if the wikipedia file, the tokenizer or the code changed ( see build_manifest ).
+    :param xml_file_path: str. The wikipedia file ( see "task_15.iter_topics" ).
+    :param file_path: str. The JSONL file of the summaries.
+    :param tokenizer: str. The name of the tokenizer ( see "load_tokenizer" ).
+    :param force: bool. If True, the summaries are rebuilt even if up to date.
+    """
+    manifest = create_manifest([xml_file_path], {"TOKENIZER": tokenizer}, CODE_FILES)
+    if not force and is_up_to_date(file_path, manifest):
+        print("Summaries up to date: ", file_path)
+        return
+    invalidate_manifest(file_path)
+    print("Summarizing passages from: ", xml_file_path)
+    count = write_jsonl(file_path, iter_summaries(iter_topics(xml_file_path), load_tokenizer(tokenizer)))
+    write_manifest(file_path, manifest)
+    print("Summaries written: ", count, " in ", file_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precomputes the sentence boundaries and token counts "
+                                                 "of the wikipedia passages.")
+    parser.add_argument("--tokenizer", default=TOKENIZER, help="the tokenizer ( see load_tokenizer )")
+    parser.add_argument("--force", action="store_true", help="rebuild the summaries, even if up to date")
+    arguments = parser.parse_args()
+    build_summaries(tokenizer=arguments.tokenizer, force=arguments.force)
@@ -0,0 +1,325 @@
+import argparse
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from task_15 import extract_tasks
+
+######################### Settings ######################################
+
+# The pair files whose prerequisite relations form the graph. Only the training data is used,
+# so that the pairs mined from the graph never leak the test labels
+PAIR_FILES = [
+    "task-15/PRELEARN_dataset/PRELEARN_training_data/data_mining-pairs_train.csv",
+    "task-15/PRELEARN_dataset/PRELEARN_training_data/physics-pairs_train.csv",
+    "task-15/PRELEARN_dataset/PRELEARN_training_data/geometry-pairs_train.csv",
+    "task-15/PRELEARN_dataset/PRELEARN_training_data/precalculus-pairs_train.csv",
+]
+
+# The max number of strongly connected components for which the transitive closure is precomputed.
+# The closure takes components^2 / 8 bytes: beyond this limit the queries visit the graph instead
+CLOSURE_MAX_COMPONENTS = 20000
+
+
+##########################################################################
+
+def strongly_connected_components(indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Finds the strongly connected components of a graph, with an iterative version of Tarjan's algorithm.
+    :param indptr: np.ndarray. The CSR offsets of the graph: the successors of node i are indices[indptr[i]:indptr[i+1]].
+    :param indices: np.ndarray. The CSR successors of the graph.
+    :return: np.ndarray. The component of each node. The components are numbered in reverse topological
+    order: the successors of a component always have a lower number.
+    """
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    nodes = len(indptr) - 1
+    index = [-1] * nodes
+    low = [0] * nodes
+    on_stack = [False] * nodes
+    component = [-1] * nodes
+    stack = []
+    visited = 0
+    components = 0
+    for root in range(nodes):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = visited
+        visited += 1
+        stack.append(root)
+        on_stack[root] = True
+        # The nodes being visited, with the position of their next successor to visit
+        work = [(root, indptr[root])]
+        while work:
+            node, edge = work[-1]
+            end = indptr[node + 1]
+            while edge < end:
+                successor = indices[edge]
+                edge += 1
+                if index[successor] == -1:
+                    work[-1] = (node, edge)
+                    index[successor] = low[successor] = visited
+                    visited += 1
+                    stack.append(successor)
+                    on_stack[successor] = True
+                    work.append((successor, indptr[successor]))
+                    break
+                if on_stack[successor]:
+                    low[node] = min(low[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = components
+                        if member == node:
+                            break
+                    components += 1
+    return np.array(component, dtype=np.int32)
+
+
+def _to_csr(sources: np.ndarray, targets: np.ndarray, nodes: int) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.lexsort((targets, sources))
+    indptr = np.zeros(nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=nodes), out=indptr[1:])
+    return indptr, targets[order].astype(np.int32)
+
+
+class PrerequisiteGraph:
+    """
+    The prerequisite relations between concepts, as a directed graph: an edge A -> B means that
+    B is a prerequisite of A ( the pair (A, B, 1) of a PRELEARN file ).
+    The concepts are numbered, and the edges are stored as CSR arrays.
+    The transitive closure is precomputed as a bitset per strongly connected component, if there are
+    at most CLOSURE_MAX_COMPONENTS of them; else the queries visit the graph of the components breadth first.
+    """
+
+    def __init__(self, concepts: List[str], indptr: np.ndarray, indices: np.ndarray, labeled: np.ndarray,
+                 closure_max_components: int = CLOSURE_MAX_COMPONENTS):
+        """
+        :param concepts: List[str]. The concept of each node.
+        :param indptr: np.ndarray. The CSR offsets: the prerequisites of node i are indices[indptr[i]:indptr[i+1]].
+        :param indices: np.ndarray. The CSR prerequisites.
+        :param labeled: np.ndarray. The sorted keys ( A * len(concepts) + B ) of the pairs labeled in the datasets,
+        either positive or negative.
+        :param closure_max_components: int. The max number of components for which the closure is precomputed.
+        """
+        self.concepts = concepts
+        self.ids: Dict[str, int] = {concept: node for node, concept in enumerate(concepts)}
+        self.indptr = indptr
+        self.indices = indices
+        self.labeled = labeled
+        self.component = strongly_connected_components(indptr, indices)
+        self.components = int(self.component.max()) + 1 if len(concepts) else 0
+        # A component is cyclic if an edge connects two of its nodes ( or a node to itself )
+        sources = np.repeat(np.arange(len(concepts), dtype=np.int32), np.diff(indptr))
+        internal = self.component[sources] == self.component[indices]
+        self.cyclic = np.zeros(self.components, dtype=bool)
+        self.cyclic[self.component[sources[internal]]] = True
+        # The edges between the components, as CSR
+        edges = np.unique(self.component[sources[~internal]].astype(np.int64) * self.components
+                          + self.component[indices[~internal]])
+        self.component_indptr, self.component_indices = _to_csr(edges // self.components, edges % self.components,
+                                                                self.components)
+        self.closure: Optional[np.ndarray] = None
+        if self.components <= closure_max_components:
+            self.closure = self._compute_closure()
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[str, str, int]], **kwargs) -> 'PrerequisiteGraph':
+        """
+        Builds the graph of some labeled pairs.
+        :param pairs: Iterable[Tuple[str, str, int]]. The pairs (A, B, label), where label is 1 if B is
+        a prerequisite of A, 0 else ( see "task_15.extract_tasks" ).
+        :param kwargs: The other arguments of the constructor.
+        :return: PrerequisiteGraph. The graph.
+        """
+        ids: Dict[str, int] = {}
+        sources, targets, labels = [], [], []
+        for concept_A, concept_B, label in pairs:
+            sources.append(ids.setdefault(concept_A, len(ids)))
+            targets.append(ids.setdefault(concept_B, len(ids)))
+            labels.append(label)
+        nodes = len(ids)
+        sources = np.array(sources, dtype=np.int64)
+        targets = np.array(targets, dtype=np.int64)
+        positive = np.array(labels, dtype=np.int8) == 1
+        edges = np.unique(sources[positive] * nodes + targets[positive])
+        indptr, indices = _to_csr(edges // nodes, edges % nodes, nodes)
+        return cls(list(ids), indptr, indices, np.unique(sources * nodes + targets), **kwargs)
+
+    def _compute_closure(self) -> np.ndarray:
+        indptr, indices = self.component_indptr, self.component_indices
+        words = (self.components + 63) // 64
+        closure = np.zeros((self.components, words), dtype=np.uint64)
+        bits = np.left_shift(np.uint64(1), (np.arange(self.components) % 64).astype(np.uint64))
+        for component in range(self.components):
+            successors = indices[indptr[component]:indptr[component + 1]]
+            row = closure[component]
+            if successors.size:
+                # The components are numbered in reverse topological order: the successors have a lower number, so their closure is already computed
+                np.bitwise_or.reduce(closure[successors], axis=0, out=row)
+                np.bitwise_or.at(row, successors // 64, bits[successors])
+            if self.cyclic[component]:
+                row[component // 64] |= bits[component]
+        return closure
+
+    def __len__(self) -> int:
+        return len(self.concepts)
+
+    @property
+    def edges(self) -> int:
+        return len(self.indices)
+
+    def prerequisites(self, concept: str) -> List[str]:
+        """
+        :param concept: str. A concept of the graph.
+        :return: List[str]. The direct prerequisites of the concept.
+        """
+        node = self.ids[concept]
+        return [self.concepts[prerequisite] for prerequisite in self.indices[self.indptr[node]:self.indptr[node + 1]]]
+
+    def cycles(self) -> List[List[str]]:
+        """
+        :return: List[List[str]]. The concepts of each cycle of prerequisites ( strongly connected component ),
+        which should not exist in a consistent dataset.
+        """
+        members = np.flatnonzero(self.cyclic[self.component])
+        cycles: Dict[int, List[str]] = {}
+        for node in members.tolist():
+            cycles.setdefault(int(self.component[node]), []).append(self.concepts[node])
+        return list(cycles.values())
+
+    def node_ids(self, concepts: Iterable[str]) -> np.ndarray:
+        """
+        :param concepts: Iterable[str]. Some concepts.
+        :return: np.ndarray. The node of each concept, or -1 if it's not in the graph.
+        """
+        return np.array([self.ids.get(concept, -1) for concept in concepts], dtype=np.int64)
+
+    def _visit(self, component: int) -> np.ndarray:
+        # Breadth first visit of the components, expanding the whole frontier at once
+        reached = np.zeros(self.components, dtype=bool)
+        reached[component] = self.cyclic[component]
+        frontier = np.array([component], dtype=np.int64)
+        while frontier.size:
+            starts = self.component_indptr[frontier]
+            lengths = self.component_indptr[frontier + 1] - starts
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            successors = np.unique(self.component_indices[offsets])
+            frontier = successors[~reached[successors]]
+            reached[frontier] = True
+        return reached
+
+    def reachable(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        Checks, for many pairs of nodes at once, whether the target is a transitive prerequisite of the source.
+        :param sources: np.ndarray. The source nodes ( -1 means unknown ).
+        :param targets: np.ndarray. The target nodes ( -1 means unknown ).
+        :return: np.ndarray. True for each pair in which the target is reachable from the source
+        with at least an edge, False else.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        result = np.zeros(len(sources), dtype=bool)
+        known = (sources >= 0) & (targets >= 0)
+        source_components = self.component[sources[known]]
+        target_components = self.component[targets[known]].astype(np.int64)
+        if self.closure is not None:
+            words = self.closure[source_components, target_components // 64]
+            result[known] = (words >> (target_components % 64).astype(np.uint64)) & np.uint64(1) == 1
+            return result
+        # A single visit per source component
+        positions = np.flatnonzero(known)
+        order = np.argsort(source_components, kind='stable')
+        unique_components, starts = np.unique(source_components[order], return_index=True)
+        for component, group in zip(unique_components.tolist(), np.split(order, starts[1:])):
+            result[positions[group]] = self._visit(component)[target_components[group]]
+        return result
+
+    def is_prerequisite(self, concept: str, prerequisite: str) -> bool:
+        """
+        :param concept: str. A concept.
+        :param prerequisite: str. Another concept.
+        :return: bool. True if "prerequisite" is a transitive prerequisite of "concept", False else.
+        """
+        return bool(self.reachable(self.node_ids([concept]), self.node_ids([prerequisite]))[0])
+
+    def reachable_from(self, source: int) -> np.ndarray:
+        """
+        :param source: int. A node.
+        :return: np.ndarray. The nodes that are transitive prerequisites of the node, sorted.
+        """
+        if self.closure is None:
+            return np.flatnonzero(self._visit(self.component[source])[self.component])
+        bits = np.unpackbits(self.closure[self.component[source]].view(np.uint8), bitorder='little')
+        return np.flatnonzero(bits[:self.components].astype(bool)[self.component])
+
+    def is_labeled(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        :param sources: np.ndarray. The first node of some pairs.
+        :param targets: np.ndarray. The second node of the pairs.
+        :return: np.ndarray. True for each pair labeled in the datasets, either positive or negative.
+        """
+        keys = np.asarray(sources, dtype=np.int64) * len(self.concepts) + np.asarray(targets, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.labeled, keys), max(len(self.labeled) - 1, 0))
+        return (self.labeled[positions] == keys) if len(self.labeled) else np.zeros(len(keys), dtype=bool)
+
+
+def load_graph(file_paths: Iterable[str] = PAIR_FILES, **kwargs) -> PrerequisiteGraph:
+    """
+    Builds the graph of the pairs of some PRELEARN files, streaming them.
+    :param file_paths: Iterable[str]. The pair files.
+    :param kwargs: The other arguments of the PrerequisiteGraph constructor.
+    :return: PrerequisiteGraph. The graph.
+    """
+    return PrerequisiteGraph.from_pairs((pair for file_path in file_paths for pair in extract_tasks(file_path)),
+                                        **kwargs)
+
+
+def augmented_pairs(graph: PrerequisiteGraph, negatives: bool = True) -> Iterator[Tuple[str, str, int]]:
+    """
+    Mines the pairs implied by the graph that are not labeled in the datasets, lazily:
+        - (A, B, 1) if B is a transitive prerequisite of A
+        - (B, A, 0) if B is a transitive prerequisite of A, and A is not a transitive prerequisite of B
+    The pairs have the same format of "task_15.extract_tasks", so they can be given to "task_15.process_tasks".
+    :param graph: PrerequisiteGraph. The graph.
+    :param negatives: bool. Whether to mine the negative pairs too.
+    :return: Iterator[Tuple[str, str, int]]. The pairs (A, B, label), grouped by concept.
+    """
+    concepts = graph.concepts
+    for source in range(len(graph)):
+        targets = graph.reachable_from(source)
+        targets = targets[targets != source]
+        if not targets.size:
+            continue
+        sources = np.full(len(targets), source, dtype=np.int64)
+        for target in targets[~graph.is_labeled(sources, targets)].tolist():
+            yield concepts[source], concepts[target], 1
+        if negatives:
+            reverse = ~graph.reachable(targets, sources) & ~graph.is_labeled(targets, sources)
+            for target in targets[reverse].tolist():
+                yield concepts[target], concepts[source], 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the prerequisite graph of the PRELEARN pairs.")
+    parser.add_argument("--output", help="write the augmented pairs to this file, in the format of the pair files")
+    parser.add_argument("--no-negatives", action="store_true", help="don't mine negative pairs")
+    arguments = parser.parse_args()
+    print("Loading pairs from: ", PAIR_FILES)
+    prerequisite_graph = load_graph()
+    print("The graph has ", len(prerequisite_graph), " concepts and ", prerequisite_graph.edges, " edges.")
+    for cycle in prerequisite_graph.cycles():
+        print("Cycle of prerequisites: ", cycle)
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as file:
+            pairs = 0
+            for concept_A, concept_B, label in augmented_pairs(prerequisite_graph, not arguments.no_negatives):
+                file.write(f"{concept_A},{concept_B},{label}\n")
+                pairs += 1
+        print("Augmented pairs written: ", pairs, " in ", arguments.output)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from evaluation import Backend
+
+######################### Settings #########################################
+
+# The SQLite file storing the cached responses
+CACHE_FILE = "responses.sqlite"
+# The max total size of the cached outputs, in bytes. The least recently used ones are evicted first
+MAX_BYTES = 512 * 1024 * 1024
+
+
+############################################################################
+
+
+class ResponseCache:
+    """
+    A persistent cache of the model outputs, stored in SQLite and keyed by the hash of
+    the model id, the rendered prompt and the generation parameters.
+    When the cached outputs exceed the size limit, the least recently used ones are evicted.
+    The cache file can be shared by several processes: the size is always read from the file.
+    """
+
+    def __init__(self, file_path: str = CACHE_FILE, max_bytes: int = MAX_BYTES):
+        """
+        :param file_path: str. The SQLite file ( created if it doesn't exist ).
+        :param max_bytes: int. The max total size of the cached outputs, in bytes.
+        """
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(file_path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, output TEXT, size INTEGER, used_at REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        self.total_bytes = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, prompt: str, params: Dict[str, Any]) -> str:
+        """
+        Computes the key of a request.
+        :param model: str. The model id.
+        :param prompt: str. The rendered prompt.
+        :param params: Dict[str, Any]. The generation parameters.
+        :return: str. The SHA-256 hex digest identifying the request.
+        """
+        request = json.dumps([model, prompt, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Reads a cached output, marking it as recently used.
+        :param key: str. The key of the request.
+        :return: Optional[str]. The cached output, or None if it's not cached.
+        """
+        row = self.connection.execute("SELECT output FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute("UPDATE responses SET used_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, model: str, output: str):
+        """
+        Caches an output, evicting the least recently used ones if the size limit is exceeded.
+        :param key: str. The key of the request.
+        :param model: str. The model id.
+        :param output: str. The output of the model.
+        """
+        size = len(output.encode('utf-8'))
+        # The insertion and the eviction are a single transaction, so the processes sharing the file
+        # see the size limit respected
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, output, size, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, output, size, time.time())
+            )
+            self._evict()
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _evict(self):
+        # The total size is read inside the transaction, since other processes may have changed it
+        self.total_bytes = self._stored_bytes()
+        if self.total_bytes <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY used_at, rowid"):
+            evicted.append((key,))
+            self.total_bytes -= size
+            if self.total_bytes <= self.max_bytes:
+                break
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: Dict[str, int]. The hits and misses since the cache was opened,
+        and the number and total size of the cached outputs.
+        """
+        entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        self.total_bytes = self._stored_bytes()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self.total_bytes}
+
+    def close(self):
+        self.connection.close()
+
+
+class CachedBackend(Backend):
+    """
+    A backend answering from a ResponseCache when possible, and caching the outputs of the wrapped backend.
+    """
+
+    def __init__(self, backend: Backend, cache: ResponseCache):
+        """
+        :param backend: Backend. The backend generating the outputs that are not cached.
+        :param cache: ResponseCache. The cache.
+        """
+        self.backend = backend
+        self.cache = cache
+        self.model = backend.model
+        self.params = backend.params
+
+    async def generate(self, prompt: str) -> str:
+        key = ResponseCache.key(self.model, prompt, self.params)
+        output = self.cache.get(key)
+        if output is None:
+            output = await self.backend.generate(prompt)
+            self.cache.put(key, self.model, output)
+        return output
+
+    async def loglikelihoods(self, requests: List[Tuple[str, List[str]]]) -> List[List[float]]:
+        # The log-likelihoods are not cached: they're cheap, and not generated text
+        return await self.backend.loglikelihoods(requests)
+
+    def supports_loglikelihoods(self) -> bool:
+        return self.backend.supports_loglikelihoods()
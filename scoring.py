@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from evaluation import Backend, evaluate_choices
+from jsonl_io import read_jsonl
+from sharded_evaluation import MERGED_FILE, SWEEPS
+from tests import load_contexts, parse_prompt
+
+######################### Settings #########################################
+
+# The format of the answers and the key of the gold label in the benchmark records, per task
+TASKS = {
+    "task-13": ("choice", "label"),
+    "task-14": ("choice", "label"),
+    "task-15": ("yes_no", "target"),
+}
+# The number of bootstrap samples of the confidence intervals
+BOOTSTRAP_SAMPLES = 1000
+# The confidence level of the confidence intervals
+CONFIDENCE = 0.95
+# The seed of the bootstrap sampling
+RANDOM_SEED = 42
+# The JSON file of the comparison of the prompts
+SCORES_FILE = "evaluation-scores.json"
+
+############################################################################
+
+# The index of a choice: a single digit, not part of a longer number
+_CHOICE_PATTERN = re.compile(r'(?<!\d)(\d)(?!\d)')
+# The answer of a yes/no question ( task-15 classes: 0 is "no", 1 is "si" )
+_YES_NO_PATTERN = re.compile(r'\b(s[iì]|no)\b', re.IGNORECASE)
+
+
+def parse_answers(outputs: Sequence[str], answer_format: str, classes: int) -> np.ndarray:
+    """
+    Parses the answers of many outputs with a precompiled regex.
+    :param outputs: Sequence[str]. The raw outputs of the model.
+    :param answer_format: str. "choice" ( the first single digit is the index of the chosen answer )
+    or "yes_no" ( the first "si" or "no" is the answer: 1 or 0 ).
+    :param classes: int. The number of classes: an answer out of range is not valid.
+    :return: np.ndarray. The answer of each output, or -1 if it couldn't be parsed.
+    """
+    if answer_format == "choice":
+        matches = map(_CHOICE_PATTERN.search, outputs)
+        answers = np.fromiter((int(match.group(1)) if match else -1 for match in matches),
+                              dtype=np.int64, count=len(outputs))
+    elif answer_format == "yes_no":
+        matches = map(_YES_NO_PATTERN.search, outputs)
+        answers = np.fromiter((-1 if not match else 0 if match.group(1).lower() == "no" else 1 for match in matches),
+                              dtype=np.int64, count=len(outputs))
+    else:
+        raise ValueError(f"Unknown answer format: {answer_format}")
+    answers[answers >= classes] = -1
+    return answers
+
+
+def match_choice(output: str, choices: Sequence[str]) -> int:
+    """
+    Finds the choice written in an output, for the outputs answering with the text of a choice instead of its index.
+    :param output: str. The raw output of the model.
+    :param choices: Sequence[str]. The choices of the record.
+    :return: int. The index of the first choice written in the output ( the longest one, if more start
+    at the same position, e.g. "concreta" and "concreta in parte" ), or -1 if there's none.
+    """
+    output = output.lower()
+    best = (len(output) + 1, 0, -1)
+    for index, choice in enumerate(choices):
+        position = output.find(choice.lower())
+        if position != -1:
+            best = min(best, (position, -len(choice), index))
+    return best[2]
+
+
+def confusion_matrix(predictions: np.ndarray, labels: np.ndarray, classes: int) -> np.ndarray:
+    """
+    :param predictions: np.ndarray. The predicted class of each output ( -1 if not parsed ).
+    :param labels: np.ndarray. The gold class of each output.
+    :param classes: int. The number of classes.
+    :return: np.ndarray. A (classes, classes + 1) matrix, in which matrix[gold][predicted] is the number
+    of outputs of class "gold" predicted as "predicted". The last column counts the outputs not parsed.
+    """
+    cells = labels * (classes + 1) + np.where(predictions < 0, classes, predictions)
+    return np.bincount(cells, minlength=classes * (classes + 1)).reshape(classes, classes + 1)
+
+
+def _metrics(confusions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # The accuracy, the F1 of each class and the macro-F1 of a stack of confusion matrices
+    classes = confusions.shape[-2]
+    true_positives = np.diagonal(confusions[..., :classes], axis1=-2, axis2=-1)
+    totals = confusions.sum(axis=(-2, -1))
+    predicted = confusions[..., :classes].sum(axis=-2)
+    gold = confusions.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accuracy = true_positives.sum(axis=-1) / totals
+        # The F1 of a class is 0 when it's never predicted nor in the gold labels
+        f1 = np.nan_to_num(2 * true_positives / (predicted + gold))
+    return accuracy, f1, f1.mean(axis=-1)
+
+
+def score(predictions: np.ndarray, labels: np.ndarray, classes: int, bootstrap_samples: int = BOOTSTRAP_SAMPLES,
+          confidence: float = CONFIDENCE, seed: Optional[int] = RANDOM_SEED) -> Dict[str, Any]:
+    """
+    Scores the predictions against the gold labels.
+    The confidence intervals are computed by bootstrap. Since the metrics only depend on the confusion matrix,
+    resampling the outputs is the same as sampling the confusion matrix from a multinomial distribution,
+    so the cost doesn't depend on the number of outputs.
+    :param predictions: np.ndarray. The predicted class of each output ( -1 if not parsed ).
+    :param labels: np.ndarray. The gold class of each output.
+    :param classes: int. The number of classes.
+    :param bootstrap_samples: int. The number of bootstrap samples.
+    :param confidence: float. The confidence level of the intervals.
+    :param seed: Optional[int]. The seed of the bootstrap sampling ( None means unseeded ).
+    :return: Dict[str, Any]. The number of outputs, the fraction of parsed ones, the accuracy, the F1 per class,
+    the macro-F1, the confusion matrix ( see "confusion_matrix" ) and the confidence intervals of
+    the accuracy and of the macro-F1.
+    """
+    predictions = np.asarray(predictions, dtype=np.int64)
+    labels = np.asarray(labels, dtype=np.int64)
+    confusion = confusion_matrix(predictions, labels, classes)
+    accuracy, f1, macro_f1 = _metrics(confusion)
+    report = {
+        "outputs": len(predictions),
+        "parsed": float(np.mean(predictions >= 0)) if len(predictions) else None,
+        "accuracy": float(accuracy),
+        "f1": f1.tolist(),
+        "macro_f1": float(macro_f1),
+        "confusion": confusion.tolist(),
+    }
+    if bootstrap_samples and len(predictions):
+        rng = np.random.default_rng(seed)
+        samples = rng.multinomial(len(predictions), confusion.ravel() / len(predictions), size=bootstrap_samples)
+        sampled_accuracy, _, sampled_macro_f1 = _metrics(samples.reshape(bootstrap_samples, *confusion.shape))
+        tails = [(1 - confidence) / 2, (1 + confidence) / 2]
+        report["accuracy_ci"] = np.quantile(sampled_accuracy, tails).tolist()
+        report["macro_f1_ci"] = np.quantile(sampled_macro_f1, tails).tolist()
+    return report
+
+
+def score_outputs(outputs: Sequence[str], records: Sequence[Dict[str, Any]], task: str, **options) -> Dict[str, Any]:
+    """
+    Parses and scores the outputs of a prompt on a benchmark. The outputs of a "choice" task without
+    the index of a choice are matched against the text of the choices ( see "match_choice" ).
+    :param outputs: Sequence[str]. The raw outputs of the model.
+    :param records: Sequence[Dict[str, Any]]. The benchmark record of each output.
+    :param task: str. The task of the benchmark ( a key of TASKS ).
+    :param options: The options of "score".
+    :return: Dict[str, Any]. The scores ( see "score" ).
+    """
+    answer_format, label_key = TASKS[task]
+    classes = max(len(record["choices"]) for record in records)
+    labels = np.fromiter((record[label_key] for record in records), dtype=np.int64, count=len(records))
+    predictions = parse_answers(outputs, answer_format, classes)
+    if answer_format == "choice":
+        # Only the outputs without an index are searched for the text of a choice
+        unparsed = np.flatnonzero(predictions < 0)
+        predictions[unparsed] = [match_choice(outputs[position], records[position]["choices"])
+                                 for position in unparsed.tolist()]
+    return score(predictions, labels, classes, **options)
+
+
+def score_choices(prompt: str, contexts: Iterable[Dict[str, Any]], task: str, backend: Backend, output_file: str,
+                  normalize: bool = False, evaluation_options: Optional[Dict[str, Any]] = None,
+                  **options) -> Dict[str, Any]:
+    """
+    Scores a prompt on a benchmark by the log-likelihood of the choices, instead of generating and parsing
+    an answer ( see evaluation.run_choice_evaluation ): no output token is generated.
+    Each choice is scored as a continuation of the rendered prompt, after a space.
+    :param prompt: str. The prompt template.
+    :param contexts: Iterable[Dict[str, Any]]. The benchmark records.
+    :param task: str. The task of the benchmark ( a key of TASKS ).
+    :param backend: Backend. The backend ( see "Backend.loglikelihoods" ).
+    :param output_file: str. The JSONL file of the log-likelihoods. It's overwritten, so that only the results
+    of this run are scored.
+    :param normalize: bool. Whether to divide the log-likelihood of each choice by its length in characters,
+    so that the longer choices are not penalized.
+    :param evaluation_options: Optional[Dict[str, Any]]. The options of evaluation.run_choice_evaluation
+    ( batch_size, concurrency... ).
+    :param options: The options of "score".
+    :return: Dict[str, Any]. The scores ( see "score" ), with the report of the run in "run".
+    """
+    label_key = TASKS[task][1]
+    labels: Dict[str, Tuple[int, int]] = {}
+
+    def items():
+        for position, context in enumerate(contexts):
+            item_id = context.get("id", str(position))
+            labels[item_id] = (context[label_key], len(context["choices"]))
+            yield item_id, parse_prompt(prompt, context), [" " + str(choice) for choice in context["choices"]]
+
+    # The results are appended by the evaluation: the ones of a previous run must not be mixed in
+    open(output_file, 'w').close()
+    run_report = evaluate_choices(backend, items(), output_file, **(evaluation_options or {}))
+    predictions: Dict[str, int] = {}
+    for result in read_jsonl(output_file):
+        if result["id"] not in labels or "loglikelihoods" not in result:
+            continue
+        scores = np.array(result["loglikelihoods"])
+        if normalize:
+            scores = scores / np.array([max(len(choice), 1) for choice in result["choices"]])
+        predictions[result["id"]] = int(np.argmax(scores))
+    classes = max((choices for _, choices in labels.values()), default=0)
+    gold = np.fromiter((label for label, _ in labels.values()), dtype=np.int64, count=len(labels))
+    predicted = np.fromiter((predictions.get(item_id, -1) for item_id in labels), dtype=np.int64, count=len(labels))
+    return {**score(predicted, gold, classes, **options), "run": run_report}
+
+
+def compare_prompts(results_file: str = MERGED_FILE, sweeps: Iterable[Tuple[str, str]] = SWEEPS,
+                    **options) -> List[Dict[str, Any]]:
+    """
+    Scores every prompt of an evaluation ( see sharded_evaluation.merge_shards ) on its benchmark.
+    :param results_file: str. The JSONL results file, whose ids are "{prompts file name}:{prompt position}:{context id}".
+    :param sweeps: Iterable[Tuple[str, str]]. The (prompts file, benchmark file) pairs evaluated.
+    :param options: The options of "score".
+    :return: List[Dict[str, Any]]. The scores of each prompt ( see "score" ), with its "prompt" id and "task",
+    from the most accurate one.
+    """
+    # Only the gold label and the number of choices of each record are kept in memory
+    records: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    for prompts_file, benchmark_file in sweeps:
+        task = os.path.basename(os.path.dirname(prompts_file))
+        name = os.path.splitext(os.path.basename(prompts_file))[0]
+        label_key = TASKS[task][1]
+        for position, context in enumerate(load_contexts(benchmark_file)):
+            records[f"{name}:{context.get('id', str(position))}"] = (
+                task, {label_key: context[label_key], "choices": context["choices"]})
+
+    outputs: Dict[str, List[str]] = {}
+    prompt_records: Dict[str, List[Dict[str, Any]]] = {}
+    tasks: Dict[str, str] = {}
+    for result in read_jsonl(results_file):
+        if "output" not in result:
+            continue
+        name, prompt_position, context_id = result["id"].split(':', 2)
+        prompt_id = f"{name}:{prompt_position}"
+        task, record = records[f"{name}:{context_id}"]
+        tasks[prompt_id] = task
+        outputs.setdefault(prompt_id, []).append(result["output"])
+        prompt_records.setdefault(prompt_id, []).append(record)
+
+    comparison = []
+    for prompt_id, prompt_outputs in outputs.items():
+        scores = score_outputs(prompt_outputs, prompt_records[prompt_id], tasks[prompt_id], **options)
+        comparison.append({"prompt": prompt_id, "task": tasks[prompt_id], **scores})
+    comparison.sort(key=lambda scores: (scores["task"], -scores["accuracy"]))
+    return comparison
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    The command line of the scoring ( see "cli.py" ).
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    """
+    parser = argparse.ArgumentParser(description="Scores the outputs of an evaluation and compares the prompts.")
+    parser.add_argument("--results", default=MERGED_FILE, help="the JSONL results file")
+    parser.add_argument("--output", default=SCORES_FILE, help="the JSON file of the comparison")
+    arguments = parser.parse_args(argv)
+    prompt_scores = compare_prompts(arguments.results)
+    for scores in prompt_scores:
+        low, high = scores.get("accuracy_ci", (float('nan'), float('nan')))
+        print(f"{scores['prompt']:30} accuracy {scores['accuracy']:.3f} [{low:.3f}, {high:.3f}] "
+              f"macro-F1 {scores['macro_f1']:.3f} parsed {scores['parsed']:.1%} ( {scores['outputs']} outputs )")
+    with open(arguments.output, 'w', encoding='utf-8') as file:
+        json.dump(prompt_scores, file, indent=2)
+    print("Scores written: ", arguments.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import tests
+from evaluation import Backend, FakeBackend, ReplicateBackend, evaluate, percentile
+from jsonl_io import JsonlWriter, loads
+
+######################### Settings #########################################
+
+# The prompts evaluated, each one with every context of its benchmark, in the format (Prompts, Benchmark)
+SWEEPS = [
+    ("task-13/CONcreTEX-prompt.jsonl", "task-13/CONcreTEXT-test-data.jsonl"),
+    ("task-15/prompt-data_mining.jsonl", "task-15/benchmarks/PRELEARN-data_mining-pairs_test.jsonl"),
+    ("task-15/prompt-phisycs.jsonl", "task-15/benchmarks/PRELEARN-physics-test.jsonl"),
+    ("task-15/prompt-geometry.jsonl", "task-15/benchmarks/PRELEARN-geometry-pairs_test.jsonl"),
+    ("task-15/prompt-precalculus.jsonl", "task-15/benchmarks/PRELEARN-precalculus-pairs_test.jsonl"),
+]
+
+# The number of shards the (prompt x context) work is partitioned into
+SHARDS = 4
+# The directory of the checkpoint of each shard
+CHECKPOINT_DIR = "evaluation-checkpoints"
+# The JSONL file of the merged results, in work order
+MERGED_FILE = "evaluation-results.jsonl"
+# The JSON file of the merged report
+REPORT_FILE = "evaluation-report.json"
+
+
+############################################################################
+
+
+def iter_work(sweeps: Iterable[Tuple[str, str]] = SWEEPS) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Enumerates the (prompt x context) work of some sweeps, lazily and always in the same order.
+    The contexts are read once per benchmark, and paired with every prompt.
+    :param sweeps: Iterable[Tuple[str, str]]. The (prompts file, benchmark file) pairs.
+    :return: Iterator[Tuple[str, str, Dict[str, Any]]]. The (item id, prompt, context) triples.
+    The item id is "{prompts file name}:{prompt position}:{context id}".
+    """
+    for prompts_file, benchmark_file in sweeps:
+        prompts = tests.load_prompts(prompts_file)
+        name = os.path.splitext(os.path.basename(prompts_file))[0]
+        for position, context in enumerate(tests.load_contexts(benchmark_file)):
+            context_id = context.get("id", str(position))
+            for prompt_position, prompt in enumerate(prompts):
+                yield f"{name}:{prompt_position}:{context_id}", prompt, context
+
+
+def shard_of(item_id: str, shards: int) -> int:
+    """
+    Assigns an item to a shard. The assignment only depends on the item id, so it's the same
+    on every process and machine, and doesn't change when other items are added.
+    :param item_id: str. The item id.
+    :param shards: int. The number of shards.
+    :return: int. The shard of the item, in [0, shards).
+    """
+    return zlib.crc32(item_id.encode('utf-8')) % shards
+
+
+def checkpoint_file(shard: int, shards: int, directory: str = CHECKPOINT_DIR) -> str:
+    """
+    :param shard: int. The shard.
+    :param shards: int. The number of shards.
+    :param directory: str. The directory of the checkpoints.
+    :return: str. The path of the checkpoint of the shard.
+    """
+    return os.path.join(directory, f"shard-{shard:03d}-of-{shards:03d}.jsonl")
+
+
+def read_checkpoint(file_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Reads the results of a checkpoint ( see "evaluation.run_evaluation" ). A line cut by a crash is skipped.
+    :param file_path: str. The path of the checkpoint.
+    :return: Iterator[Dict[str, Any]]. The results, in completion order.
+    """
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                yield loads(line)
+            except ValueError:
+                continue
+
+
+def _repair_checkpoint(file_path: str):
+    # A crash can leave a line without its new line: the next results must not be appended to it
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        return
+    with open(file_path, 'rb+') as file:
+        file.seek(-1, os.SEEK_END)
+        if file.read(1) != b'\n':
+            file.write(b'\n')
+
+
+def completed_items(file_path: str) -> Set[str]:
+    """
+    :param file_path: str. The path of a checkpoint.
+    :return: Set[str]. The ids of the items completed successfully ( the failed ones are run again ).
+    """
+    return {result["id"] for result in read_checkpoint(file_path) if "output" in result}
+
+
+def run_shard(shard: int, shards: int, backend: Backend, sweeps: Iterable[Tuple[str, str]] = SWEEPS,
+              directory: str = CHECKPOINT_DIR, **options) -> Dict[str, Any]:
+    """
+    Runs the items of a shard, appending each result to the checkpoint of the shard as soon as it completes.
+    If the checkpoint already exists, the run resumes it: the items already completed are skipped.
+    :param shard: int. The shard, in [0, shards).
+    :param shards: int. The number of shards.
+    :param backend: Backend. The backend.
+    :param sweeps: Iterable[Tuple[str, str]]. The (prompts file, benchmark file) pairs.
+    :param directory: str. The directory of the checkpoints.
+    :param options: The options of "evaluation.run_evaluation" ( concurrency, retries... ).
+    :return: Dict[str, Any]. The report of the run ( see "evaluation.run_evaluation" ), with the shard
+    and the number of items skipped because already completed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    file_path = checkpoint_file(shard, shards, directory)
+    _repair_checkpoint(file_path)
+    completed = completed_items(file_path)
+    print("Running shard ", shard, " of ", shards, " ( ", len(completed), " items already completed )")
+    # The prompts are rendered only for the items still to run
+    items = ((item_id, tests.parse_prompt(prompt, context)) for item_id, prompt, context in iter_work(sweeps)
+             if shard_of(item_id, shards) == shard and item_id not in completed)
+    report = evaluate(backend, items, file_path, **options)
+    report["shard"] = shard
+    report["skipped"] = len(completed)
+    return report
+
+
+def _run_shard_in_worker(shard: int, shards: int, backend_factory: Callable[[int], Backend],
+                         sweeps: List[Tuple[str, str]], directory: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    return run_shard(shard, shards, backend_factory(shard), sweeps, directory, **options)
+
+
+def run_shards(shards: int, backend_factory: Callable[[int], Backend], sweeps: Iterable[Tuple[str, str]] = SWEEPS,
+               directory: str = CHECKPOINT_DIR, workers: Optional[int] = None, **options) -> List[Dict[str, Any]]:
+    """
+    Runs all the shards on this machine, each one in its own process.
+    :param shards: int. The number of shards.
+    :param backend_factory: Callable[[int], Backend]. A module-level function creating the backend of a shard.
+    :param sweeps: Iterable[Tuple[str, str]]. The (prompts file, benchmark file) pairs.
+    :param directory: str. The directory of the checkpoints.
+    :param workers: Optional[int]. The number of processes ( None means one per shard ).
+    :param options: The options of "evaluation.run_evaluation".
+    :return: List[Dict[str, Any]]. The report of each shard.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    start_methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in start_methods else None)
+    with ProcessPoolExecutor(max_workers=workers or shards, mp_context=context) as executor:
+        futures = [executor.submit(_run_shard_in_worker, shard, shards, backend_factory, list(sweeps), directory,
+                                   options)
+                   for shard in range(shards)]
+        return [future.result() for future in futures]
+
+
+def merge_shards(shards: int, sweeps: Iterable[Tuple[str, str]] = SWEEPS, directory: str = CHECKPOINT_DIR,
+                 output_file: str = MERGED_FILE, report_file: Optional[str] = REPORT_FILE) -> Dict[str, Any]:
+    """
+    Merges the checkpoints of the shards into a single results file, in work order ( see "iter_work" ).
+    If an item was run more than once, its last successful result is kept.
+    :param shards: int. The number of shards.
+    :param sweeps: Iterable[Tuple[str, str]]. The (prompts file, benchmark file) pairs.
+    :param directory: str. The directory of the checkpoints.
+    :param output_file: str. The JSONL file of the merged results.
+    :param report_file: Optional[str]. The JSON file of the report, if any.
+    :return: Dict[str, Any]. The report: the number of items, completed, failed and missing ( never run ),
+    the p50/p95 latency, and the same counts per prompt ( "{prompts file name}:{prompt position}" ).
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for shard in range(shards):
+        for result in read_checkpoint(checkpoint_file(shard, shards, directory)):
+            if "output" in result or result["id"] not in results:
+                results[result["id"]] = result
+
+    report = {"items": 0, "completed": 0, "failed": 0, "missing": 0}
+    prompts: Dict[str, Dict[str, int]] = {}
+    latencies = []
+    with JsonlWriter(output_file) as writer:
+        for item_id, _, _ in iter_work(sweeps):
+            prompt_id = item_id.rsplit(':', 1)[0]
+            counts = prompts.setdefault(prompt_id, {"items": 0, "completed": 0, "failed": 0, "missing": 0})
+            result = results.get(item_id)
+            status = "missing" if result is None else "completed" if "output" in result else "failed"
+            for stats in (report, counts):
+                stats["items"] += 1
+                stats[status] += 1
+            if result is not None:
+                writer.write(result)
+            if status == "completed":
+                latencies.append(result["latency"])
+    report["latency_p50"] = percentile(latencies, 0.50)
+    report["latency_p95"] = percentile(latencies, 0.95)
+    report["prompts"] = prompts
+    if report_file is not None:
+        with open(report_file, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+def replicate_backend(shard: int) -> Backend:
+    return ReplicateBackend(tests.MODEL)
+
+
+def fake_backend(shard: int) -> Backend:
+    return FakeBackend(latency=0.01, failure_rate=0.05, seed=shard)
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    The command line of the sharded evaluation ( see "cli.py" ).
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    """
+    parser = argparse.ArgumentParser(description="Evaluates every prompt with every context of its benchmark, "
+                                                 "in resumable shards.")
+    parser.add_argument("--shards", type=int, default=SHARDS, help="the number of shards")
+    parser.add_argument("--shard", type=int, help="run only this shard ( e.g. on another machine )")
+    parser.add_argument("--merge", action="store_true", help="merge the checkpoints of the shards")
+    parser.add_argument("--fake", action="store_true", help="use a local fake model instead of Replicate")
+    parser.add_argument("--workers", type=int, help="the number of processes running the shards")
+    arguments = parser.parse_args(argv)
+    factory = fake_backend if arguments.fake else replicate_backend
+    if arguments.merge:
+        print(merge_shards(arguments.shards))
+    elif arguments.shard is not None:
+        print(run_shard(arguments.shard, arguments.shards, factory(arguments.shard)))
+    else:
+        for shard_report in run_shards(arguments.shards, factory, workers=arguments.workers):
+            print(shard_report)
+        print(merge_shards(arguments.shards))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,19 @@
+import argparse
+import itertools
+import math
 import os.path
-import random, json
-from typing import Set, Dict
+import random
+from collections import Counter
+from functools import lru_cache
+from typing import Set, Dict, Optional, List, Tuple
 
 import numpy as np
 import csv
-from scipy.stats import truncnorm
+
+import jsonl_io
+from build_manifest import create_manifest, invalidate_manifest, is_up_to_date, write_manifest
+from instrumentation import INSTRUMENTATION, timed
+from jsonl_io import JsonlWriter
 
 ######################### Hyperparameters ######################################
 
@@ -24,6 +33,11 @@ CLASSES_NAMES = {
 GAUSSIAN_STD_DEV = 2
 # Number of  distractors to create
 DISTRACTORS = 3
+# The seed of the random sampling. Each benchmark is sampled with its own seed ( RANDOM_SEED + file index ),
+# so the output doesn't depend on the order in which the benchmarks are created. None means unseeded
+RANDOM_SEED = 42
+# The min number of initial letters shared by the token at INDEX and its lemma ( TARGET ), e.g. "lenisce" -> "lenire"
+ROOT_LENGTH = 3
 
 ######################### Settings ######################################
 
@@ -36,10 +50,99 @@ FILES = [
 
 ]
 
+# The number of processes creating the benchmarks concurrently ( None means one per CPU core, 1 disables the pool )
+WORKERS = None
+# The number of records whose choices are sampled together
+BATCH_SIZE = 4096
+# The number of rows validated ( and timed ) together: each chunk of rows is held in memory
+VALIDATION_CHUNK_SIZE = 256
+
+# The source files whose changes require the benchmarks to be rebuilt
+CODE_FILES = (__file__, jsonl_io.__file__)
+
 
 ##########################################################################
 
-def get_gaussian_samples(center: int, lower_limit: int, upper_limit, num_samples: int, std_dev: float) -> Set[int]:
+@lru_cache(maxsize=None)
+def get_probability_table(lower_limit: int, upper_limit: int, std_dev: float) -> np.ndarray:
+    """
+    Computes the probabilities of sampling each integer number in [lower_limit, upper_limit] by
+    rounding a limited gaussian distribution, for every possible center. The center itself has probability 0,
+    since it's never sampled as a distractor.
+    :param lower_limit: Lower number to sample ( included ).
+    :param upper_limit: Highest number to sample ( included ).
+    :param std_dev: Standard Deviation of the Gaussian Distribution.
+    :return: np.ndarray. A (numbers, numbers) table, in which table[center - lower_limit][number - lower_limit]
+    is the probability of sampling "number" from the gaussian centered in "center".
+    """
+    numbers = range(lower_limit, upper_limit + 1)
+    table = np.zeros((len(numbers), len(numbers)))
+    for center in numbers:
+        def cdf(x: float) -> float:
+            return 0.5 * (1 + math.erf((x - center) / (std_dev * math.sqrt(2))))
+
+        for number in numbers:
+            if number != center:
+                table[center - lower_limit][number - lower_limit] = \
+                    cdf(min(number + 0.5, upper_limit)) - cdf(max(number - 0.5, lower_limit))
+    table /= table.sum(axis=1, keepdims=True)
+    table.setflags(write=False)
+    return table
+
+
+def sample_distractors(centers: np.ndarray, lower_limit: int, upper_limit: int, num_distractors: int,
+                       std_dev: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Samples the distractors of many centers at once, using a limited gaussian distribution
+    for each one of them. The distractors of a center are distinct and different from the center.
+    The sampling without replacement is done with the Gumbel-top-k trick, in a single pass for all the centers.
+    :param centers: np.ndarray. The mean values of the Gaussians ( integers in [lower_limit, upper_limit] ).
+    :param lower_limit: Lower number to sample ( included ).
+    :param upper_limit: Highest number to sample ( included ).
+    :param num_distractors: Number of distractors desired per center.
+    :param std_dev: Standard Deviation of the Gaussian Distribution.
+    :param rng: np.random.Generator. The random generator used for sampling.
+    :return: np.ndarray. A (len(centers), num_distractors) array of sampled values.
+    """
+    if num_distractors > upper_limit - lower_limit:
+        raise ValueError(f"Cannot sample {num_distractors} distinct distractors in [{lower_limit}, {upper_limit}].")
+    centers = np.asarray(centers, dtype=np.int64)
+    probabilities = get_probability_table(lower_limit, upper_limit, std_dev)[centers - lower_limit]
+    # Numbers too far from the center can have a probability that underflows to 0, but they
+    # must still be preferred to the center itself
+    log_probabilities = np.log(np.maximum(probabilities, np.finfo(float).tiny))
+    log_probabilities[np.arange(len(centers)), centers - lower_limit] = -np.inf
+    keys = log_probabilities + rng.gumbel(size=log_probabilities.shape)
+    distractors = np.argpartition(-keys, num_distractors - 1, axis=1)[:, :num_distractors]
+    return distractors + lower_limit
+
+
+@timed("sample_choices", records=lambda centers, *args, **kwargs: len(centers))
+def sample_choices(centers: np.ndarray, lower_limit: int, upper_limit: int, num_samples: int,
+                   std_dev: float, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Samples the shuffled choices of many records at once ( see "sample_distractors" ).
+    :param centers: np.ndarray. The mean values of the Gaussians, which are the right choices.
+    :param lower_limit: Lower number to sample ( included ).
+    :param upper_limit: Highest number to sample ( included ).
+    :param num_samples: Number of choices desired per record ( center included ).
+    :param std_dev: Standard Deviation of the Gaussian Distribution.
+    :param rng: np.random.Generator. The random generator used for sampling.
+    :return: Tuple[np.ndarray, np.ndarray]. A (len(centers), num_samples) array of shuffled choices,
+    and the index of the center in the choices of each record.
+    """
+    centers = np.asarray(centers, dtype=np.int64)
+    distractors = sample_distractors(centers, lower_limit, upper_limit, num_samples - 1, std_dev, rng)
+    choices = np.column_stack((centers, distractors))
+    order = np.argsort(rng.random(choices.shape), axis=1)
+    choices = np.take_along_axis(choices, order, axis=1)
+    labels = np.argmax(order == 0, axis=1)
+    return choices, labels
+
+
+@timed("get_gaussian_samples")
+def get_gaussian_samples(center: int, lower_limit: int, upper_limit, num_samples: int, std_dev: float,
+                         rng: Optional[np.random.Generator] = None) -> Set[int]:
     """
     Samples some integer numbers using a limited gaussian distrbution. The "center" value is always included in the output.
     :param center: the mean value of the Gaussian.
@@ -47,16 +150,12 @@ def get_gaussian_samples(center: int, lower_limit: int, upper_limit, num_samples
     :param upper_limit: Highest number to sample ( included ).
     :param num_samples: Number of samples desired ( center included )
     :param std_dev: Standard Deviation of the Gaussian Distribution,
+    :param rng: Optional[np.random.Generator]. The random generator used for sampling ( None means unseeded ).
     :return: Set[int]. A set of sampled values ( center included )
     """
-    samples = {center}
-    while len(samples) < num_samples:
-        items = truncnorm.rvs((lower_limit - center) / std_dev, (upper_limit - center) / std_dev, loc=center,
-                              scale=std_dev, size=1)
-        number = int(np.round(items)[0])
-        if number != center:
-            samples.add(number)
-    return samples
+    rng = rng if rng is not None else np.random.default_rng()
+    distractors = sample_distractors(np.array([center]), lower_limit, upper_limit, num_samples - 1, std_dev, rng)
+    return {center, *distractors[0].tolist()}
 
 
 def is_json_invalid(validated_jason: dict) -> bool:
@@ -68,7 +167,8 @@ def is_json_invalid(validated_jason: dict) -> bool:
     return any([key for key, value in validated_jason.items() if value == ""])
 
 
-def process_text(text: str, target_word: str, avg: float, classes_names: Dict[int, str], record_id: str):
+def process_text(text: str, target_word: str, avg: float, classes_names: Dict[int, str], record_id: str,
+                 samples: Optional[List[int]] = None):
     """
     Processes the input parameters for creating a structured JSON string ( see return type ).
     :param text: str. The text to analyze. It contains the word to classify.
@@ -76,7 +176,9 @@ def process_text(text: str, target_word: str, avg: float, classes_names: Dict[in
     :param avg: float. The average classification value given to the target word in the context.
     :param classes_names: Dict[int,str]. The possible classes names mappings.
     :param record_id: The ID of the given record.
-    :return: str. A string json of the following structure:
+    :param samples: Optional[List[int]]. The already shuffled classes to use as choices ( round(avg) included ),
+    as sampled in batch by "sample_choices". If None, they're sampled here.
+    :return: dict. A JSON-like dict of the following structure:
     {
         "text": str, // The untouched text given in input.
         "target_word": str, // The untouched target word given in input.
@@ -87,11 +189,12 @@ def process_text(text: str, target_word: str, avg: float, classes_names: Dict[in
     }
     """
     choice = round(avg)
-    samples = get_gaussian_samples(center=choice, lower_limit=1,
-                                   upper_limit=7, num_samples=DISTRACTORS + 1,
-                                   std_dev=GAUSSIAN_STD_DEV)
-    samples = list(samples)
-    random.shuffle(samples)
+    if samples is None:
+        samples = get_gaussian_samples(center=choice, lower_limit=1,
+                                       upper_limit=7, num_samples=DISTRACTORS + 1,
+                                       std_dev=GAUSSIAN_STD_DEV)
+        samples = list(samples)
+        random.shuffle(samples)
     label = samples.index(choice)
     samples = [classes_names[x] for x in samples]
 
@@ -106,64 +209,275 @@ def process_text(text: str, target_word: str, avg: float, classes_names: Dict[in
     return test
 
 
-def is_record_valid(target: str, text: str, avg: float, classes_numbers: int) -> bool:
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a CONcreTEXT sentence into its tokens ( the sentences are already tokenized, with spaces ).
+    :param text: str. The sentence.
+    :return: List[str]. The tokens, whose positions are the ones of the INDEX column.
+    """
+    return text.split()
+
+
+def shares_root(token: str, lemma: str) -> bool:
+    """
+    Checks whether a token can be a surface form of a lemma, i.e. whether they start with the same
+    ROOT_LENGTH letters ( or the token is the lemma itself, if it's shorter ).
+    :param token: str. The lowercase token.
+    :param lemma: str. The lowercase lemma.
+    :return: bool. True if they share the root, False else.
+    """
+    length = min(ROOT_LENGTH, len(lemma))
+    return token[:length] == lemma[:length]
+
+
+@timed("build_lemma_table")
+def build_lemma_table(dataset_file_path: str) -> Dict[str, Set[str]]:
+    """
+    Builds the lookup table between each surface form and its lemmas, from the dataset itself:
+    the token at INDEX in each sentence is a surface form of the TARGET lemma ( e.g. "affascinata" -> "affascinare" ).
+    The misaligned rows, whose token at INDEX doesn't share the root of TARGET ( see "shares_root" ), are skipped.
+    :param dataset_file_path: str. The dataset tsv file.
+    :return: Dict[str, Set[str]]. A mapping between a lowercase surface form and its lemmas.
+    Each lemma is also a surface form of itself.
     """
-    Checks whether the record in the dataset is valid.
+    lemma_table: Dict[str, Set[str]] = {}
+    with open(dataset_file_path, "r") as tsv:
+        for row in csv.DictReader(tsv, delimiter='\t'):
+            target = row["TARGET"].lower()
+            lemma_table.setdefault(target, set()).add(target)
+            tokens = tokenize(row["TEXT"])
+            index = row.get("INDEX")
+            if index is not None and index.isdigit() and int(index) < len(tokens):
+                token = tokens[int(index)].lower()
+                if shares_root(token, target):
+                    lemma_table.setdefault(token, set()).add(target)
+    return lemma_table
+
+
+def validate_record(target: str, tokens: List[str], index: Optional[int], avg: float, classes_numbers: int,
+                    lemma_table: Dict[str, Set[str]]) -> Optional[str]:
+    """
+    Checks whether the record in the dataset is valid, returning the reason why it's not.
     A record is valid if:
+        - "target" and the text are not empty
         - 1<avg<=classes_numbers
-        - "target" is contained only once inside "text"
-        - If "target" and "text" are not empty
+        - "index" is the position of a surface form of "target" in the text ( if given )
+        - "target" occurs only once inside the text, in any of its surface forms
+    :param target: str. The target word ( lemma ) to classify in the text.
+    :param tokens: List[str]. The tokens of the text ( see "tokenize" ).
+    :param index: Optional[int]. The position of the target in the tokens, if known. The target is located
+    there, and any other surface form of it in the text is another occurrence.
+    :param avg: float. The average classification value given to the target word in the context.
+    :param classes_numbers: int. The max number of classes used for classification of "target".
+    :param lemma_table: Dict[str, Set[str]]. The lemmas of each surface form ( see "build_lemma_table" ).
+    :return: Optional[str]. None if the record is valid, else the reason: "empty", "avg_out_of_range",
+    "index_out_of_range", "index_mismatch" or "multiple_occurrences".
+    """
+    if target == '' or not tokens:
+        return "empty"
+    if not 1 < avg <= classes_numbers:
+        return "avg_out_of_range"
+    if index is not None and not 0 <= index < len(tokens):
+        return "index_out_of_range"
+    lemma = target.lower()
+    target_occurrences = 0
+    if index is not None:
+        if not shares_root(tokens[index].lower(), lemma):
+            return "index_mismatch"
+        target_occurrences = 1
+    for position, token in enumerate(tokens):
+        if position == index:
+            continue
+        token = token.lower()
+        if lemma in lemma_table.get(token, ()) or token == lemma:
+            target_occurrences += 1
+            if target_occurrences > 1:
+                return "multiple_occurrences"
+    return None
+
+
+def is_record_valid(target: str, text: str, avg: float, classes_numbers: int,
+                    lemma_table: Optional[Dict[str, Set[str]]] = None) -> bool:
+    """
+    Checks whether the record in the dataset is valid ( see "validate_record" ).
     :param text: str. The text to analyze. It contains the word to classify.
     :param target: str. The target word to classify in the text.
     :param avg: float. The average classification value given to the target word in the context.
     :param classes_numbers: int. The max number of classes used for classification of "target".
+    :param lemma_table: Optional[Dict[str, Set[str]]]. The lemmas of each surface form. If None, only
+    the exact occurrences of "target" are counted.
     :return: bool. True if it's valid, False else.
     """
-    words = text.split(' ')
-    target_occurrences = len([word for word in words if word == target])
-    if target_occurrences > 1:
-        return False
-    return target != '' and text != '' and 1 < avg <= classes_numbers
-
-
-def create_benchmark():
-    """
-    Creates the benchmark by reading data from the datasets, processing
-    it and writing it to a created benchmark file.
-    """
-
-    for dataset_file_path, benchmark_file_path in FILES:
-
-        print("Creating benchmark: ", benchmark_file_path)
-
-        # Opening benchmark file
-        with open(benchmark_file_path, "w") as benchmark:
-            # Iterating over all the datasets
-            record_id = 0
-            # Reading from the dataset tsv_file to process information and write it in benchmark file
-            with open(dataset_file_path, "r") as tsv:
-                print("Reading data from ", dataset_file_path)
-                reader = csv.DictReader(tsv, delimiter='\t')
-
-                file_name = os.path.splitext(os.path.basename(dataset_file_path))[0]
-                record_number = 0
-                for row in reader:
-                    target = row["TARGET"]
-                    text = row["TEXT"]
-                    avg = row.get("AVG") or row["MEAN"]
-                    avg = float(avg)
-                    if not is_record_valid(target, text, avg, len(CLASSES_NAMES)):
-                        continue
-                    task_id = f"{file_name}_task-13_{record_number}"
-                    record_number = record_number + 1
-                    processed_text = process_text(text, target, avg, CLASSES_NAMES, task_id)
-                    if is_json_invalid(processed_text):
-                        continue
-                    line = json.dumps(processed_text)
-                    benchmark.write(line + "\n")
+    return validate_record(target, tokenize(text), None, avg, classes_numbers, lemma_table or {}) is None
+
+
+def process_batch(batch: List[Tuple[str, str, float, str]], rng: np.random.Generator) -> List[dict]:
+    """
+    Processes a batch of valid records, sampling the choices of all of them at once.
+    :param batch: List[Tuple[str, str, float, str]]. The records to process, in the form (text, target_word, avg, record_id).
+    :param rng: np.random.Generator. The random generator used for sampling.
+    :return: List[dict]. The processed records ( see "process_text" ), in the same order.
+    """
+    centers = np.array([round(avg) for _, _, avg, _ in batch], dtype=np.int64)
+    choices, _ = sample_choices(centers, lower_limit=1, upper_limit=len(CLASSES_NAMES),
+                                num_samples=DISTRACTORS + 1, std_dev=GAUSSIAN_STD_DEV, rng=rng)
+    # Timed per batch: a timer per record would cost more than the processing itself
+    with INSTRUMENTATION.stage("process_text", records=len(batch)):
+        return [process_text(text, target, avg, CLASSES_NAMES, task_id, samples)
+                for (text, target, avg, task_id), samples in zip(batch, choices.tolist())]
+
+
+@timed("build_benchmark")
+def build_benchmark(dataset_file_path: str, benchmark_file_path: str, seed: Optional[int]) -> Dict[str, int]:
+    """
+    Creates a single benchmark by reading data from a dataset, processing
+    it and writing it to the created benchmark file.
+    The records are validated, processed and written in a single streaming pass,
+    after building the lemma table of the dataset.
+    :param dataset_file_path: str. The dataset tsv file.
+    :param benchmark_file_path: str. The benchmark file to create.
+    :param seed: Optional[int]. The seed of the random sampling ( None means unseeded ).
+    :return: Dict[str, int]. The number of rejected records per reason ( see "validate_record",
+    and "invalid_index" for a non-numeric INDEX ).
+    """
+    rng = np.random.default_rng(seed)
+    lemma_table = build_lemma_table(dataset_file_path)
+    rejected_records = Counter()
+
+    print("Creating benchmark: ", benchmark_file_path)
+
+    # Opening benchmark file
+    with JsonlWriter(benchmark_file_path) as benchmark:
+        def write_batch(batch: List[Tuple[str, str, float, str]]):
+            valid_records = []
+            for processed_text in process_batch(batch, rng):
+                if is_json_invalid(processed_text):
+                    rejected_records["invalid_json"] += 1
+                    continue
+                valid_records.append(processed_text)
+            benchmark.write_batch(valid_records)
+
+        # Reading from the dataset tsv_file to process information and write it in benchmark file
+        with open(dataset_file_path, "r") as tsv:
+            print("Reading data from ", dataset_file_path)
+            reader = csv.DictReader(tsv, delimiter='\t')
+
+            file_name = os.path.splitext(os.path.basename(dataset_file_path))[0]
+            record_number = 0
+            batch = []
+            while True:
+                rows = list(itertools.islice(reader, VALIDATION_CHUNK_SIZE))
+                if not rows:
+                    break
+                # The rows are validated in chunks, timed as a single stage
+                with INSTRUMENTATION.stage("validate_record", records=len(rows)):
+                    for row in rows:
+                        target = row["TARGET"]
+                        text = row["TEXT"]
+                        avg = row.get("AVG") or row["MEAN"]
+                        avg = float(avg)
+                        index = row.get("INDEX")
+                        # The same guard of "build_lemma_table": a malformed INDEX rejects the row, not the whole build
+                        if index and not index.isdigit():
+                            rejected_records["invalid_index"] += 1
+                            continue
+                        index = int(index) if index else None
+                        reason = validate_record(target, tokenize(text), index, avg, len(CLASSES_NAMES), lemma_table)
+                        if reason is not None:
+                            rejected_records[reason] += 1
+                            continue
+                        task_id = f"{file_name}_task-13_{record_number}"
+                        record_number = record_number + 1
+                        batch.append((text, target, avg, task_id))
+                # The valid records are processed in batches of BATCH_SIZE, whatever the chunks they come from
+                while len(batch) >= BATCH_SIZE:
+                    write_batch(batch[:BATCH_SIZE])
+                    batch = batch[BATCH_SIZE:]
+            if batch:
+                write_batch(batch)
+
+    print("Rejected records of ", dataset_file_path, ": ", dict(rejected_records))
+    return dict(rejected_records)
+
+
+def _build_benchmark_in_worker(dataset_file_path: str, benchmark_file_path: str, seed: Optional[int],
+                               instrumented: bool) -> Dict[str, Dict[str, float]]:
+    # The stages measured in the worker are sent back to the parent process
+    if instrumented:
+        INSTRUMENTATION.enable(INSTRUMENTATION.trace_memory)
+    build_benchmark(dataset_file_path, benchmark_file_path, seed)
+    return INSTRUMENTATION.snapshot()
+
+
+def create_benchmark(workers: Optional[int] = WORKERS, force: bool = False):
+    """
+    Creates the benchmarks by reading data from the datasets, processing
+    it and writing it to the created benchmark files.
+    The benchmarks are created concurrently by a pool of processes. Since each
+    benchmark has its own seed, the output doesn't depend on the number of processes.
+    A benchmark is rebuilt only if its dataset, the hyperparameters, the seed or the code changed
+    since it was built ( see build_manifest ).
+    :param workers: Optional[int]. The number of processes ( None means one per CPU core, 1 disables the pool ).
+    :param force: bool. If True, all the benchmarks are rebuilt.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = []
+    for file_index, (dataset_file_path, benchmark_file_path) in enumerate(FILES):
+        seed = RANDOM_SEED + file_index if RANDOM_SEED is not None else None
+        parameters = {
+            "CLASSES_NAMES": CLASSES_NAMES,
+            "GAUSSIAN_STD_DEV": GAUSSIAN_STD_DEV,
+            "DISTRACTORS": DISTRACTORS,
+            "BATCH_SIZE": BATCH_SIZE,
+            "seed": seed
+        }
+        manifest = create_manifest([dataset_file_path], parameters, CODE_FILES)
+        if not force and is_up_to_date(benchmark_file_path, manifest):
+            print("Benchmark up to date: ", benchmark_file_path)
+            continue
+        invalidate_manifest(benchmark_file_path)
+        jobs.append((dataset_file_path, benchmark_file_path, seed, manifest))
+
+    if workers == 1 or len(jobs) <= 1:
+        for dataset_file_path, benchmark_file_path, seed, manifest in jobs:
+            build_benchmark(dataset_file_path, benchmark_file_path, seed)
+            write_manifest(benchmark_file_path, manifest)
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        start_methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in start_methods else None)
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=context) as executor:
+            futures = [executor.submit(_build_benchmark_in_worker, dataset_file_path, benchmark_file_path, seed,
+                                       INSTRUMENTATION.enabled)
+                       for dataset_file_path, benchmark_file_path, seed, _ in jobs]
+            for future, (_, benchmark_file_path, _, manifest) in zip(futures, jobs):
+                INSTRUMENTATION.merge(future.result())
+                write_manifest(benchmark_file_path, manifest)
 
     print("Done")
 
 
+def main(argv: Optional[List[str]] = None):
+    """
+    The command line of the benchmark builder ( see "cli.py" ).
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    """
+    parser = argparse.ArgumentParser(description="Creates the CONcreTEXT benchmarks.")
+    parser.add_argument("--force", action="store_true", help="rebuild all the benchmarks, even if up to date")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="number of processes ( default: one per core )")
+    parser.add_argument("--report", help="write a JSON report of the time and memory of each stage")
+    parser.add_argument("--profile", help="write the cProfile statistics of the run ( of this process only )")
+    arguments = parser.parse_args(argv)
+    if arguments.report or arguments.profile:
+        INSTRUMENTATION.enable(trace_memory=arguments.report is not None, profile=arguments.profile is not None)
+    create_benchmark(arguments.workers, arguments.force)
+    if arguments.report:
+        INSTRUMENTATION.write_report(arguments.report)
+    if arguments.profile:
+        INSTRUMENTATION.dump_profile(arguments.profile)
+
+
 if __name__ == '__main__':
-    create_benchmark()
+    main()
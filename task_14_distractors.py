@@ -1,8 +1,30 @@
-import json
+import heapq
+from collections import Counter, defaultdict
 
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Optional
+
+from jsonl_io import iter_json_array
 
 FILE_NAME = "task-14/dataset.json"
+# The keys of the hint words in each record
+HINT_KEYS = ("w1", "w2", "w3", "w4", "w5")
+# The max number of similar solutions extracted per record ( None means all of them )
+TOP_K = 10
+
+
+def iter_json(file_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Reads a file containing a list of JSON objects one object at a time.
+    :param file_path: str. The path of the file to read.
+    Returns: Iterator[Dict[str, Any]]: An iterator of dictionaries.
+    """
+    try:
+        for item in iter_json_array(file_path):
+            if not isinstance(item, dict):
+                raise TypeError("The file does not contain a list of JSON dictionaries.")
+            yield item
+    except ValueError:
+        raise TypeError("The file does not contain a list of JSON dictionaries.")
 
 
 def load_json(file_path: str) -> List[Dict[str, Any]]:
@@ -11,41 +33,67 @@ def load_json(file_path: str) -> List[Dict[str, Any]]:
     :param file_path: str. The path of the file to load.
     Returns: List[Dict[str, Any]]: A list of dictionaries if loading is successful.
     """
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-        if isinstance(data, list) and all(isinstance(item, dict) for item in data):
-            return data
-        else:
-            raise TypeError("The file does not contain a list of JSON dictionaries.")
+    return list(iter_json(file_path))
+
 
+def build_hint_index(dataset: Iterable[Dict[str, Any]]) -> Dict[str, List[int]]:
+    """
+    Builds an inverted index between each hint word and the records containing it.
+    :param dataset: Iterable[Dict[str, Any]]. The records of the dataset ( e.g. streamed by "iter_json" ).
+    :return: Dict[str, List[int]]. A mapping between a hint word and the positions in the dataset of the
+    records containing it ( index[word] = [position, ...] ). A position is repeated once per occurrence.
+    """
+    hint_index = defaultdict(list)
+    for position, item in enumerate(dataset):
+        for key in HINT_KEYS:
+            hint_index[item[key]].append(position)
+    return dict(hint_index)
 
-def count_common_words(first_dict: Dict[str, Any], second_dict: Dict[str, Any]) -> int:
-    count = 0
-    for first_elem in first_dict.values():
-        for second_elem in second_dict.values():
-            if first_elem == second_elem:
-                count += 1
-    return count
 
+def rank_similar_records(element: Dict[str, Any], hint_index: Dict[str, List[int]], top_k: Optional[int] = None,
+                         excluded: Optional[Callable[[int], bool]] = None) -> List[Tuple[int, int]]:
+    """
+    Finds the records sharing hint words with a record, by counting the postings of its hint words
+    in the inverted index: only the records sharing at least one hint word are ever visited.
+    :param element: Dict[str, Any]. The record.
+    :param hint_index: Dict[str, List[int]]. The inverted index of the dataset ( see "build_hint_index" ).
+    :param top_k: Optional[int]. The max number of records to find ( None means all of them ).
+    :param excluded: Optional[Callable[[int], bool]]. Whether a position is excluded ( e.g. the record itself ).
+    :return: List[Tuple[int, int]]. The (position, number of common hint words) pairs, from the most similar one.
+    """
+    common_words = Counter()
+    for key in HINT_KEYS:
+        common_words.update(hint_index.get(element[key], ()))
+    candidates = ((-count, position) for position, count in common_words.items()
+                  if excluded is None or not excluded(position))
+    if top_k is None:
+        most_similar = sorted(candidates)
+    else:
+        most_similar = heapq.nsmallest(top_k, candidates)
+    return [(position, -count) for count, position in most_similar]
 
-def extract_similar_solutions(element: Dict[str, Any], dataset: List[Dict[str, Any]]) -> List[Tuple[str, int]]:
+
+def extract_similar_solutions(element: Dict[str, Any], dataset: List[Dict[str, Any]],
+                              hint_index: Optional[Dict[str, List[int]]] = None,
+                              top_k: Optional[int] = None) -> List[Tuple[str, int]]:
     """
     Extracts similair solutions to a given word. A solution is considered "similair" if
     in the same Dataset if the two records containing those are similair.
     We deem two records as "similar" if they share at least one hint word.
     Also, the degree of similarity is the number of the common hint words the two
-    records have.
+    records have ( see "rank_similar_records" ).
+    :param element: Dict[str, Any]. The record whose similar solutions are extracted.
+    :param dataset: List[Dict[str, Any]]. The records of the dataset.
+    :param hint_index: Optional[Dict[str, List[int]]]. The inverted index of the dataset ( see "build_hint_index" ).
+    If None, it's built here: it should be built once when extracting the solutions of many records.
+    :param top_k: Optional[int]. The max number of similar solutions to extract ( None means all of them ).
     :return List[Tuple[str, int]]. A list of tuple in the following
-     format: (similair solution, degree of similarity)
+     format: (similair solution, degree of similarity), from the most similar one
     """
-    possible_solutions: List[Tuple[str, int]] = []
-    for item in dataset:
-        if item == element:
-            continue
-        common_words = count_common_words(item, element)
-        if common_words > 0:
-            possible_solutions.append((item["solution"], common_words))
-    return possible_solutions
+    if hint_index is None:
+        hint_index = build_hint_index(dataset)
+    most_similar = rank_similar_records(element, hint_index, top_k, lambda position: dataset[position] == element)
+    return [(dataset[position]["solution"], count) for position, count in most_similar]
 
 
 """
@@ -65,14 +113,24 @@ def check_distractors():
     """
     Trying to extrapolate distractors by looking for similair words,
     trying to measure similarity from the same Dataset.
+    The dataset is streamed twice: only the inverted index and the solutions are kept in memory.
     :return:
     """
     print("Loading dataset: ", FILE_NAME)
-    dataset = load_json(FILE_NAME)
-    print("The dataset has ", len(dataset), " elements.")
-    for element in dataset:
+    solutions = []
+
+    def iter_records() -> Iterator[Dict[str, Any]]:
+        # The solutions are kept while the index is built
+        for item in iter_json(FILE_NAME):
+            solutions.append(item["solution"])
+            yield item
+
+    hint_index = build_hint_index(iter_records())
+    print("The dataset has ", len(solutions), " elements.")
+    for position, element in enumerate(iter_json(FILE_NAME)):
         solution = element["solution"]
-        similar_solutions = extract_similar_solutions(element, dataset)
+        most_similar = rank_similar_records(element, hint_index, TOP_K, lambda similar: similar == position)
+        similar_solutions = [(solutions[similar], count) for similar, count in most_similar]
         if len(similar_solutions) == 0:
             print("There are no similair solution for: ", solution)
         else:
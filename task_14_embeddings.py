@@ -0,0 +1,209 @@
+import argparse
+import os
+import random
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from jsonl_io import write_jsonl
+from task_14_distractors import HINT_KEYS, load_json
+
+######################### Hyperparameters ######################################
+
+# Number of distractors to create per game
+DISTRACTORS = 3
+# Number of nearest neighbours among which each distractor is chosen
+TOPN = 20
+# The fraction of the games written in the train file ( the others are written in the test file )
+TRAIN_SPLIT = 0.8
+# The seed of the random choices. None means unseeded
+RANDOM_SEED = 42
+
+######################### Settings ######################################
+
+DATASET_FILE = "task-14/dataset.json"
+# The italian word2vec model (https://mlunicampania.gitlab.io/italian-word2vec/), as gensim KeyedVectors
+KEYED_VECTORS_FILE = "task-14/SG-300-W10N20E50/W2V.kv"
+# The same model converted by "convert_keyed_vectors", as memory-mappable files
+VECTORS_FILE = "task-14/SG-300-W10N20E50/W2V"
+
+TRAIN_FILE = "task-14/Ghigliottin-AI-task1-train-data.jsonl"
+TEST_FILE = "task-14/Ghigliottin-AI-task1-test-data.jsonl"
+
+# The number of queries multiplied at once with the vectors matrix.
+# The peak memory of the search is about BLOCK_SIZE * vocabulary size * 4 bytes
+BLOCK_SIZE = 256
+
+
+##########################################################################
+
+def save_vectors(words: List[str], vectors: np.ndarray, file_path: str):
+    """
+    Saves word vectors as memory-mappable files: "{file_path}.vocab.txt" ( a word per line ),
+    "{file_path}.npy" ( the rows normalized to unit length, as float32 ) and "{file_path}.norms.npy"
+    ( the original length of each row ).
+    :param words: List[str]. The vocabulary, in the same order of the vectors.
+    :param vectors: np.ndarray. A (len(words), dimensions) matrix of word vectors.
+    :param file_path: str. The path of the files, without extension.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    np.save(file_path + ".npy", vectors / np.maximum(norms, np.finfo(np.float32).tiny)[:, None])
+    np.save(file_path + ".norms.npy", norms)
+    with open(file_path + ".vocab.txt", 'w', encoding='utf-8') as file:
+        file.writelines(word + '\n' for word in words)
+
+
+def convert_keyed_vectors(keyed_vectors_path: str, file_path: str):
+    """
+    Converts a gensim KeyedVectors model into memory-mappable files ( see "save_vectors" ).
+    :param keyed_vectors_path: str. The path of the KeyedVectors model.
+    :param file_path: str. The path of the converted files, without extension.
+    """
+    from gensim.models import KeyedVectors
+
+    model = KeyedVectors.load(keyed_vectors_path, mmap='r')
+    save_vectors(model.index_to_key, model.vectors, file_path)
+
+
+def load_vectors(file_path: str) -> Tuple[List[str], Dict[str, int], np.ndarray, np.ndarray]:
+    """
+    Loads the word vectors saved by "save_vectors". The vectors are memory-mapped, not read into memory.
+    :param file_path: str. The path of the files, without extension.
+    :return: Tuple[List[str], Dict[str, int], np.ndarray, np.ndarray]. The vocabulary, the mapping
+    between each word and its row, the ( memory-mapped ) unit length vectors and their original lengths.
+    """
+    with open(file_path + ".vocab.txt", 'r', encoding='utf-8') as file:
+        words = [line.rstrip('\n') for line in file]
+    word_index = {word: row for row, word in enumerate(words)}
+    vectors = np.load(file_path + ".npy", mmap_mode='r')
+    norms = np.load(file_path + ".norms.npy")
+    return words, word_index, vectors, norms
+
+
+def most_similar(queries: np.ndarray, vectors: np.ndarray, topn: int, block_size: int = BLOCK_SIZE) -> np.ndarray:
+    """
+    Finds the rows most similar ( by cosine similarity ) to each query, one block of queries at a time.
+    :param queries: np.ndarray. A (queries, dimensions) matrix.
+    :param vectors: np.ndarray. A (vocabulary, dimensions) matrix with unit length rows.
+    :param topn: int. The number of rows to find per query.
+    :param block_size: int. The number of queries multiplied at once with "vectors".
+    :return: np.ndarray. A (queries, topn) matrix of rows, from the most similar one.
+    """
+    topn = min(topn, len(vectors))
+    queries = np.asarray(queries, dtype=np.float32)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1), np.finfo(np.float32).tiny)[:, None]
+    nearest = np.empty((len(queries), topn), dtype=np.int64)
+    for start in range(0, len(queries), block_size):
+        similarities = queries[start:start + block_size] @ vectors.T
+        candidates = np.argpartition(-similarities, topn - 1, axis=1)[:, :topn]
+        order = np.argsort(-np.take_along_axis(similarities, candidates, axis=1), axis=1, kind='stable')
+        nearest[start:start + block_size] = np.take_along_axis(candidates, order, axis=1)
+    return nearest
+
+
+def load_stemmer() -> Callable[[str], str]:
+    """
+    Loads the stemmer used to check whether two words share the same root.
+    :return: Callable[[str], str]. The italian Snowball stemmer.
+    """
+    from nltk.stem import SnowballStemmer
+
+    return SnowballStemmer('italian').stem
+
+
+def choose_distractors(dataset: List[Dict[str, Any]], words: List[str], word_index: Dict[str, int],
+                       vectors: np.ndarray, norms: np.ndarray, stem: Callable[[str], str],
+                       rng: random.Random) -> List[Dict[str, Any]]:
+    """
+    Chooses the distractors of all the games at once.
+    Each distractor is the most similar word to the sum of the vectors of 2 to (hints - 1) random hint words,
+    which doesn't share the root with the hint words, the solution or the other distractors.
+    The similar words of all the distractors of all the games are found with a single batched search.
+    :param dataset: List[Dict[str, Any]]. The games, each one with the hint words (w1..w5) and the solution.
+    :param words: List[str]. The vocabulary.
+    :param word_index: Dict[str, int]. The mapping between each word and its row.
+    :param vectors: np.ndarray. The unit length vectors.
+    :param norms: np.ndarray. The original lengths of the vectors.
+    :param stem: Callable[[str], str]. The stemmer.
+    :param rng: random.Random. The random generator.
+    :return: List[Dict[str, Any]]. The games in the format { w1..w5, "choices": list[str], "label": int }.
+    """
+    stem = lru_cache(maxsize=None)(stem)
+
+    # The hint words out of the vocabulary are ignored
+    game_hints = []
+    queries = np.zeros((len(dataset) * DISTRACTORS, vectors.shape[1]), dtype=np.float32)
+    for position, game in enumerate(dataset):
+        hints = [game[key] for key in HINT_KEYS if game[key] in word_index]
+        if len(hints) < 3:
+            raise ValueError(f"Less than 3 hint words of game {position} are in the vocabulary.")
+        game_hints.append(hints)
+        for distractor in range(DISTRACTORS):
+            sampled_hints = rng.sample(hints, rng.randint(2, len(hints) - 1))
+            rows = [word_index[hint] for hint in sampled_hints]
+            queries[position * DISTRACTORS + distractor] = norms[rows] @ vectors[rows]
+
+    nearest = most_similar(queries, vectors, TOPN)
+
+    games = []
+    for position, (game, hints) in enumerate(zip(dataset, game_hints)):
+        solution = game["solution"]
+        banned_stems = {stem(word) for word in hints + [solution]}
+        distractors = []
+        for distractor in range(DISTRACTORS):
+            for row in nearest[position * DISTRACTORS + distractor]:
+                word_stem = stem(words[row])
+                if word_stem not in banned_stems:
+                    distractors.append(words[row])
+                    banned_stems.add(word_stem)
+                    break
+            else:
+                print("ALERT: No distractor found for: ", solution)
+
+        choices = distractors + [solution]
+        rng.shuffle(choices)
+        processed_game = {key: game[key] for key in HINT_KEYS}
+        processed_game["choices"] = choices
+        processed_game["label"] = choices.index(solution)
+        games.append(processed_game)
+    return games
+
+
+def create_benchmark():
+    """
+    Creates the train and test benchmarks by choosing the distractors of every game
+    of the dataset, and splitting them randomly.
+    """
+    rng = random.Random(RANDOM_SEED)
+    print("Loading dataset: ", DATASET_FILE)
+    dataset = load_json(DATASET_FILE)
+    if not os.path.exists(VECTORS_FILE + ".npy"):
+        print("Converting vectors: ", KEYED_VECTORS_FILE)
+        convert_keyed_vectors(KEYED_VECTORS_FILE, VECTORS_FILE)
+    print("Loading vectors: ", VECTORS_FILE)
+    words, word_index, vectors, norms = load_vectors(VECTORS_FILE)
+    print("Choosing distractors")
+    games = choose_distractors(dataset, words, word_index, vectors, norms, load_stemmer(), rng)
+    rng.shuffle(games)
+    split_index = int(TRAIN_SPLIT * len(games))
+    print("Creating benchmark: ", TRAIN_FILE)
+    write_jsonl(TRAIN_FILE, games[:split_index])
+    print("Creating benchmark: ", TEST_FILE)
+    write_jsonl(TEST_FILE, games[split_index:])
+    print("Done")
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    The command line of the benchmark builder ( see "cli.py" ).
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    """
+    parser = argparse.ArgumentParser(description="Creates the Ghigliottin-AI benchmarks.")
+    parser.parse_args(argv)
+    create_benchmark()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+import argparse
+import os
+import random
+import re
+from collections import Counter, deque
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+from jsonl_io import open_text, write_jsonl
+from task_14_distractors import HINT_KEYS
+from task_14_embeddings import load_stemmer
+
+######################### Hyperparameters ######################################
+
+# The number of words of the vocabulary ( the most frequent ones ). It bounds the size of the co-occurrence matrix
+VOCABULARY_SIZE = 50000
+# The min number of occurrences of a word of the vocabulary
+MIN_COUNT = 5
+# The number of most frequent words excluded from the vocabulary ( the stopwords, e.g. "della", "sono" )
+SKIP_MOST_FREQUENT = 200
+# The min length of a word of the vocabulary
+MIN_WORD_LENGTH = 3
+# The number of following words co-occurring with each word
+WINDOW = 5
+# The min number of co-occurrences of two associated words
+MIN_COOCCURRENCES = 3
+# The number of strongest associations kept per word ( the rest of the PMI matrix is dropped )
+TOP_ASSOCIATIONS = 100
+# Number of distractors to create per game
+DISTRACTORS = 3
+# The number of games to generate
+GAMES = 10000
+# The seed of the random choices. None means unseeded
+RANDOM_SEED = 42
+
+######################### Settings ######################################
+
+# The plain text corpus files ( optionally .gz or .zst ), e.g. a Wikipedia dump extracted with WikiExtractor.
+# The lines starting with "<" ( markup ) are skipped
+CORPUS_FILES = ["task-14/corpus.txt"]
+# A file with a word per line, from the most frequent one, used as vocabulary instead of counting the
+# words of the corpus ( e.g. the vocabulary of task_14_embeddings.VECTORS_FILE ). None means counting them
+VOCABULARY_FILE = None
+# The generated games, in the format of the Ghigliottin-AI benchmarks
+OUTPUT_FILE = "task-14/Ghigliottin-AI-generated-data.jsonl"
+
+# The number of processes counting the corpus ( None means one per CPU core, 1 disables the pool )
+WORKERS = None
+# The number of lines counted by a process at a time
+CHUNK_LINES = 20000
+# The number of counted chunks merged into the co-occurrence matrix at a time
+MERGE_CHUNKS = 16
+# The max number of distinct words tracked while counting the vocabulary: beyond it, the rarest ones are dropped
+MAX_TRACKED_WORDS = 2000000
+
+##########################################################################
+
+_WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+
+def tokenize(line: str) -> List[str]:
+    """
+    Splits a line of the corpus into lowercase words ( letters only ).
+    :param line: str. The line.
+    :return: List[str]. The words.
+    """
+    return _WORD_PATTERN.findall(line.lower())
+
+
+def iter_chunks(corpus_files: Iterable[str], chunk_lines: int = CHUNK_LINES) -> Iterator[List[str]]:
+    """
+    Streams the text lines of some corpus files, in chunks.
+    :param corpus_files: Iterable[str]. The corpus files.
+    :param chunk_lines: int. The number of lines per chunk.
+    :return: Iterator[List[str]]. The chunks of lines, in file order.
+    """
+    for corpus_file in corpus_files:
+        with open_text(corpus_file, 'r') as file:
+            lines = (line for line in file if not line.startswith('<') and line.strip())
+            while True:
+                chunk = list(islice(lines, chunk_lines))
+                if not chunk:
+                    break
+                yield chunk
+
+
+def map_chunks(function: Callable[[List[str]], Any], chunks: Iterable[List[str]], workers: Optional[int] = WORKERS,
+               initializer: Optional[Callable] = None, initargs: tuple = ()) -> Iterator[Any]:
+    """
+    Applies a function to chunks of lines in a pool of processes, lazily: at most two chunks per process
+    are pending, so the memory used doesn't depend on the corpus size.
+    :param function: Callable[[List[str]], Any]. A module-level function processing a chunk.
+    :param chunks: Iterable[List[str]]. The chunks.
+    :param workers: Optional[int]. The number of processes ( None means one per CPU core, 1 disables the pool ).
+    :param initializer: Optional[Callable]. The function initializing each process ( or this one, without a pool ).
+    :param initargs: tuple. The arguments of the initializer.
+    :return: Iterator[Any]. The results, in chunk order.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(function, chunks)
+        return
+    chunks = iter(chunks)
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    start_methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in start_methods else None)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer,
+                             initargs=initargs) as executor:
+        pending = deque()
+        while True:
+            for chunk in islice(chunks, workers * 2 - len(pending)):
+                pending.append(executor.submit(function, chunk))
+            if not pending:
+                return
+            yield pending.popleft().result()
+
+
+def _count_words(lines: List[str]) -> Counter:
+    counts = Counter()
+    for line in lines:
+        counts.update(tokenize(line))
+    return counts
+
+
+def build_vocabulary(corpus_files: Iterable[str], workers: Optional[int] = WORKERS) -> List[str]:
+    """
+    Builds the vocabulary by counting the words of a corpus. The counts are approximated if the corpus has more
+    than MAX_TRACKED_WORDS distinct words: the rarest ones are periodically dropped.
+    :param corpus_files: Iterable[str]. The corpus files.
+    :param workers: Optional[int]. The number of processes.
+    :return: List[str]. The VOCABULARY_SIZE most frequent words, from the most frequent one, excluding the
+    SKIP_MOST_FREQUENT most frequent ones, the short ones and the ones occurring less than MIN_COUNT times.
+    """
+    counts = Counter()
+    for chunk_counts in map_chunks(_count_words, iter_chunks(corpus_files), workers):
+        counts.update(chunk_counts)
+        if len(counts) > MAX_TRACKED_WORDS:
+            counts = Counter(dict(counts.most_common(MAX_TRACKED_WORDS // 2)))
+    words = [word for word, count in counts.most_common() if count >= MIN_COUNT]
+    words = [word for word in words[SKIP_MOST_FREQUENT:] if len(word) >= MIN_WORD_LENGTH]
+    return words[:VOCABULARY_SIZE]
+
+
+def load_vocabulary(file_path: str) -> List[str]:
+    """
+    Loads a vocabulary file, with the same filters of "build_vocabulary".
+    :param file_path: str. The file, with a word per line from the most frequent one.
+    :return: List[str]. The vocabulary.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        words = [line.strip().lower() for line in file]
+    words = [word for word in words[SKIP_MOST_FREQUENT:] if len(word) >= MIN_WORD_LENGTH and word.isalpha()]
+    return list(dict.fromkeys(words))[:VOCABULARY_SIZE]
+
+
+# The vocabulary shared by the parent process with the workers of the pool
+_worker_word_index: Optional[Dict[str, int]] = None
+
+
+def _init_worker(word_index: Dict[str, int]):
+    global _worker_word_index
+    _worker_word_index = word_index
+
+
+def _count_cooccurrences(lines: List[str]) -> sparse.csr_matrix:
+    size = len(_worker_word_index)
+    rows, columns = [], []
+    for line in lines:
+        # The words out of the vocabulary are removed before taking the window
+        ids = np.array([_worker_word_index[word] for word in tokenize(line) if word in _worker_word_index],
+                       dtype=np.int32)
+        for distance in range(1, min(WINDOW, len(ids) - 1) + 1):
+            rows.append(ids[:-distance])
+            columns.append(ids[distance:])
+    if not rows:
+        return sparse.csr_matrix((size, size), dtype=np.float32)
+    rows = np.concatenate(rows)
+    columns = np.concatenate(columns)
+    # The co-occurrences are symmetric. The duplicates are summed by the CSR conversion ( no sorting )
+    counts = sparse.csr_matrix((np.ones(2 * len(rows), dtype=np.float32),
+                                (np.concatenate([rows, columns]), np.concatenate([columns, rows]))),
+                               shape=(size, size))
+    counts.sum_duplicates()
+    return counts
+
+
+def _merge(matrices: List[sparse.spmatrix], size: int) -> sparse.csr_matrix:
+    matrices = [matrix.tocoo() for matrix in matrices]
+    return sparse.csr_matrix((np.concatenate([matrix.data for matrix in matrices]),
+                              (np.concatenate([matrix.row for matrix in matrices]),
+                               np.concatenate([matrix.col for matrix in matrices]))),
+                             shape=(size, size))
+
+
+def count_cooccurrences(corpus_files: Iterable[str], vocabulary: List[str],
+                        workers: Optional[int] = WORKERS) -> sparse.csr_matrix:
+    """
+    Counts the co-occurrences of the words of the vocabulary in a corpus, streaming it once.
+    Two words co-occur if they're in the same line, at most WINDOW words apart. The chunks of lines are counted
+    in a pool of processes, and the counts are merged MERGE_CHUNKS chunks at a time.
+    :param corpus_files: Iterable[str]. The corpus files.
+    :param vocabulary: List[str]. The vocabulary.
+    :param workers: Optional[int]. The number of processes.
+    :return: sparse.csr_matrix. The symmetric (vocabulary, vocabulary) matrix of co-occurrences.
+    """
+    size = len(vocabulary)
+    word_index = {word: row for row, word in enumerate(vocabulary)}
+    total = sparse.csr_matrix((size, size), dtype=np.float32)
+    pending = []
+    for chunk_counts in map_chunks(_count_cooccurrences, iter_chunks(corpus_files), workers,
+                                   _init_worker, (word_index,)):
+        pending.append(chunk_counts)
+        if len(pending) == MERGE_CHUNKS:
+            total = _merge([total] + pending, size)
+            pending = []
+    return _merge([total] + pending, size)
+
+
+def ppmi_matrix(cooccurrences: sparse.csr_matrix, min_cooccurrences: int = MIN_COOCCURRENCES,
+                top_associations: int = TOP_ASSOCIATIONS) -> sparse.csr_matrix:
+    """
+    Computes the positive pointwise mutual information of the co-occurring words,
+    PPMI(a, b) = max(0, log( P(a, b) / ( P(a) P(b) ) )), keeping only the strongest associations of each word.
+    :param cooccurrences: sparse.csr_matrix. The symmetric matrix of co-occurrences ( see "count_cooccurrences" ).
+    :param min_cooccurrences: int. The min number of co-occurrences of two associated words.
+    :param top_associations: int. The number of associations kept per word.
+    :return: sparse.csr_matrix. The (vocabulary, vocabulary) PPMI matrix, without the diagonal.
+    """
+    counts = cooccurrences.tocoo()
+    keep = (counts.data >= min_cooccurrences) & (counts.row != counts.col)
+    rows, columns, data = counts.row[keep], counts.col[keep], counts.data[keep].astype(np.float64)
+    marginals = np.asarray(cooccurrences.sum(axis=1)).ravel()
+    total = marginals.sum()
+    pmi = np.log(data * total / (marginals[rows] * marginals[columns]))
+    positive = pmi > 0
+    ppmi = sparse.csr_matrix((pmi[positive].astype(np.float32), (rows[positive], columns[positive])),
+                             shape=cooccurrences.shape)
+    # Only the top associations of each row are kept
+    for row in range(ppmi.shape[0]):
+        start, end = ppmi.indptr[row], ppmi.indptr[row + 1]
+        if end - start > top_associations:
+            values = ppmi.data[start:end]
+            values[np.argpartition(-values, top_associations)[top_associations:]] = 0
+    ppmi.eliminate_zeros()
+    return ppmi
+
+
+def generate_games(ppmi: sparse.csr_matrix, vocabulary: List[str], games: int, stem: Callable[[str], str],
+                   rng: random.Random) -> Iterator[Dict[str, Any]]:
+    """
+    Generates games from the word associations, lazily.
+    The solutions are the words with the strongest five associations. The hint words of a solution are its
+    five most associated words, and the distractors are the words most associated with all the hint words
+    ( the sum of their PPMI rows ), that aren't associated with the solution itself.
+    No two words of a game share the same root.
+    :param ppmi: sparse.csr_matrix. The PPMI matrix ( see "ppmi_matrix" ).
+    :param vocabulary: List[str]. The vocabulary.
+    :param games: int. The max number of games.
+    :param stem: Callable[[str], str]. The stemmer.
+    :param rng: random.Random. The random generator ( shuffling the choices ).
+    :return: Iterator[Dict[str, Any]]. The games in the format { w1..w5, "choices": list[str], "label": int }.
+    """
+    stem = lru_cache(maxsize=None)(stem)
+    hints_number = len(HINT_KEYS)
+    lengths = np.diff(ppmi.indptr)
+    # The strength of each candidate solution is the sum of its top five associations
+    strengths = np.zeros(ppmi.shape[0])
+    for row in np.flatnonzero(lengths >= hints_number):
+        values = ppmi.data[ppmi.indptr[row]:ppmi.indptr[row + 1]]
+        strengths[row] = np.partition(values, len(values) - hints_number)[-hints_number:].sum()
+    generated = 0
+    for solution in np.argsort(-strengths, kind='stable'):
+        if generated == games or strengths[solution] == 0:
+            return
+        start, end = ppmi.indptr[solution], ppmi.indptr[solution + 1]
+        associated = ppmi.indices[start:end][np.argsort(-ppmi.data[start:end], kind='stable')]
+        roots = {stem(vocabulary[solution])}
+        hints = []
+        for word in associated.tolist():
+            root = stem(vocabulary[word])
+            if root not in roots:
+                roots.add(root)
+                hints.append(word)
+                if len(hints) == hints_number:
+                    break
+        if len(hints) < hints_number:
+            continue
+        scores = np.asarray(ppmi[hints].sum(axis=0)).ravel()
+        scores[solution] = 0
+        scores[ppmi.indices[start:end]] = 0
+        distractors = []
+        for word in np.argsort(-scores, kind='stable').tolist():
+            if scores[word] <= 0:
+                break
+            root = stem(vocabulary[word])
+            if root not in roots:
+                roots.add(root)
+                distractors.append(vocabulary[word])
+                if len(distractors) == DISTRACTORS:
+                    break
+        if len(distractors) < DISTRACTORS:
+            continue
+        choices = distractors + [vocabulary[solution]]
+        rng.shuffle(choices)
+        game = {key: vocabulary[hint] for key, hint in zip(HINT_KEYS, hints)}
+        game["choices"] = choices
+        game["label"] = choices.index(vocabulary[solution])
+        generated += 1
+        yield game
+
+
+def create_games(corpus_files: List[str] = CORPUS_FILES, output_file: str = OUTPUT_FILE, games: int = GAMES,
+                 vocabulary_file: Optional[str] = VOCABULARY_FILE, workers: Optional[int] = WORKERS,
+                 stem: Optional[Callable[[str], str]] = None):
+    """
+    Generates games from a corpus and writes them to a JSONL file.
+    :param corpus_files: List[str]. The corpus files.
+    :param output_file: str. The JSONL file of the games.
+    :param games: int. The max number of games.
+    :param vocabulary_file: Optional[str]. The vocabulary file ( None means counting the words of the corpus,
+    which reads it one more time ).
+    :param workers: Optional[int]. The number of processes counting the corpus.
+    :param stem: Optional[Callable[[str], str]]. The stemmer ( None means the italian Snowball stemmer ).
+    """
+    if vocabulary_file is not None:
+        print("Loading vocabulary: ", vocabulary_file)
+        vocabulary = load_vocabulary(vocabulary_file)
+    else:
+        print("Counting words of: ", corpus_files)
+        vocabulary = build_vocabulary(corpus_files, workers)
+    print("The vocabulary has ", len(vocabulary), " words.")
+    print("Counting co-occurrences of: ", corpus_files)
+    cooccurrences = count_cooccurrences(corpus_files, vocabulary, workers)
+    print("Computing associations of ", cooccurrences.nnz, " co-occurring pairs")
+    ppmi = ppmi_matrix(cooccurrences)
+    del cooccurrences
+    print("Creating games: ", output_file)
+    count = write_jsonl(output_file, generate_games(ppmi, vocabulary, games, stem or load_stemmer(),
+                                                    random.Random(RANDOM_SEED)))
+    print("Games created: ", count)
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    The command line of the games generator ( see "cli.py" ).
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    """
+    parser = argparse.ArgumentParser(description="Generates Ghigliottina games from a corpus.")
+    parser.add_argument("corpus", nargs='*', default=CORPUS_FILES,
+                        help=f"the corpus files ( default: {' '.join(CORPUS_FILES)} )")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="the JSONL file of the games")
+    parser.add_argument("--games", type=int, default=GAMES, help="the max number of games")
+    parser.add_argument("--vocabulary", default=VOCABULARY_FILE, help="a vocabulary file, instead of counting it")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="number of processes ( default: one per core )")
+    arguments = parser.parse_args(argv)
+    missing = [corpus_file for corpus_file in arguments.corpus if not os.path.exists(corpus_file)]
+    if missing:
+        parser.error(f"corpus file not found: {', '.join(missing)} ( give the corpus files as arguments )")
+    create_games(arguments.corpus, arguments.output, arguments.games, arguments.vocabulary, arguments.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,15 @@
+import argparse
 import json
+import mmap
 import os
+import re
 import xml.etree.ElementTree as ET
-from typing import Dict, Tuple, List
+from typing import Any, Dict, Tuple, Iterator, Iterable, List, Mapping, Optional, Set
+
+import jsonl_io
+from build_manifest import create_manifest, invalidate_manifest, is_up_to_date, write_manifest
+from instrumentation import INSTRUMENTATION, timed
+from jsonl_io import write_jsonl
 
 ######################### Hyperparameters #########################################
 # The name of the binary classes
@@ -13,6 +21,21 @@ CLASSES_NAMES = {
 
 # The file containing the wikipedia definitions of the words
 WIKIPEDIA_FILE = "task-15/PRELEARN_dataset/PRELEARN_training_data/ITA_prereq-pages.xml"
+# The suffix of the offset index file, persisted next to the wikipedia XML file
+TOPICS_INDEX_SUFFIX = ".index.json"
+
+# Whether the benchmarks reference the wikipedia passages by id, instead of inlining them.
+# If so, every referenced passage is written only once in PASSAGES_FILE.
+SHARED_PASSAGES = False
+# The JSONL file containing the passages referenced by the benchmarks, in the format
+# { "id": concept, "passage": wikipedia_passage }
+PASSAGES_FILE = "task-15/benchmarks/passages.jsonl"
+
+# The number of processes creating the benchmarks concurrently ( None means one per CPU core, 1 disables the pool )
+WORKERS = None
+
+# The source files whose changes require the benchmarks to be rebuilt
+CODE_FILES = (__file__, jsonl_io.__file__)
 
 # The dataset classes and the respective benchmark created
 # in the format (Dataset,Benchmark)
@@ -40,37 +63,182 @@ FILES = [
 
 ##########################################################################
 
+def _clean_description(text: Optional[str]) -> str:
+    """
+    Removes the leading and trailing new lines from a wikipedia description.
+    :param text: Optional[str]. The raw text of a <text> element.
+    :return: str. The cleaned description.
+    """
+    return (text or '').strip('\n')
+
+
+@timed("iter_topics")
+def iter_topics(xml_file_path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Streams the words description from a XML-based file, one <doc> at a time.
+    Each element is cleared as soon as it's read, so the memory used doesn't depend on the file size.
+    :param xml_file_path: the path to the XML file containing the words description.
+    :return: Iterator[Tuple[str, str]]. An iterator of (word, description) pairs, in file order.
+    """
+    context = ET.iterparse(xml_file_path, events=('start', 'end'))
+    _, root = next(context)
+    for event, item in context:
+        if event != 'end' or item.tag != 'doc':
+            continue
+        yield item.findtext('title'), _clean_description(item.findtext('text'))
+        item.clear()
+        # The root keeps a reference to every processed <doc>, which has to be dropped too
+        root.clear()
+
+
+@timed("extract_topics")
 def extract_topics(xml_file_path: str) -> Dict[str, str]:
     """
     Extract the words description from a XML-based file.
     :param xml_file_path: the path to the XML file containing the words description.
     :return: Dict[str,str]. A mapping between a word and its description ( topics[word] = description ).
     """
-    extracted_topics = {}
-    tree = ET.parse(xml_file_path)
-    root = tree.getroot()
-    for item in root.findall('doc'):
-        title = item.find('title').text
-        text = item.find('text').text
-        text = text.rstrip('\n')
-        text = text.lstrip('\n')
-        extracted_topics[title] = text
-    return extracted_topics
+    return dict(iter_topics(xml_file_path))
+
 
+_TITLE_PATTERN = re.compile(rb'<title>(.*)</title>')
+_XML_ENTITIES = {'&quot;': '"', '&apos;': "'"}
 
-def extract_tasks(file_path: str) -> List[Tuple[str, str, int]]:
+
+def build_topics_index(xml_file_path: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Builds the offset index of a XML-based file in the WikiExtractor format, in which
+    every <doc>, <title> and </doc> tag starts a new line.
+    The file is scanned line by line, without parsing the descriptions.
+    :param xml_file_path: the path to the XML file containing the words description.
+    :return: Dict[str, Tuple[int, int]]. A mapping between a word and the byte offset
+    and length of its <doc> element ( index[word] = (offset, length) ).
+    """
+    # xml.sax.saxutils imports urllib.request: it's imported only when an index is built
+    from xml.sax.saxutils import unescape
+
+    index = {}
+    offset = 0
+    doc_offset = None
+    title = None
+    with open(xml_file_path, 'rb') as file:
+        for line in file:
+            # Not the root <document> element
+            if line.startswith((b'<doc ', b'<doc>')):
+                doc_offset = offset
+                title = None
+            elif doc_offset is not None and title is None and line.startswith(b'<title>'):
+                title = unescape(_TITLE_PATTERN.match(line).group(1).decode('utf-8'), _XML_ENTITIES)
+            elif doc_offset is not None and line.startswith(b'</doc>'):
+                index[title] = (doc_offset, offset + len(line) - doc_offset)
+                doc_offset = None
+            offset += len(line)
+    return index
+
+
+@timed("load_topics_index")
+def load_topics_index(xml_file_path: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Loads the offset index of a XML-based file ( see "build_topics_index" ).
+    The index is persisted next to the XML file and it's rebuilt whenever
+    the XML file modification time or size change.
+    :param xml_file_path: the path to the XML file containing the words description.
+    :return: Dict[str, Tuple[int, int]]. A mapping between a word and the byte offset
+    and length of its <doc> element ( index[word] = (offset, length) ).
+    """
+    index_file_path = xml_file_path + TOPICS_INDEX_SUFFIX
+    stat = os.stat(xml_file_path)
+    try:
+        with open(index_file_path, 'r', encoding='utf-8') as file:
+            stored_index = json.load(file)
+        if stored_index["mtime_ns"] == stat.st_mtime_ns and stored_index["size"] == stat.st_size:
+            return {title: tuple(position) for title, position in stored_index["offsets"].items()}
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_topics_index(xml_file_path)
+    try:
+        with open(index_file_path, 'w', encoding='utf-8') as file:
+            json.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "offsets": index}, file)
+    except OSError:
+        # The index is only a cache: a read-only dataset directory is not an error
+        pass
+    return index
+
+
+class LazyTopics(Mapping[str, str]):
+    """
+    A read-only mapping between a word and its description ( topics[word] = description ),
+    backed by the memory-mapped XML file. A description is parsed only the first time
+    its word is looked up, so only the referenced words are ever held in memory.
+    """
+
+    def __init__(self, xml_file_path: str, index: Dict[str, Tuple[int, int]]):
+        """
+        :param xml_file_path: the path to the XML file containing the words description.
+        :param index: Dict[str, Tuple[int, int]]. The offset index of the file ( see "build_topics_index" ).
+        """
+        self.xml_file_path = xml_file_path
+        self.index = index
+        self._descriptions: Dict[str, str] = {}
+        self._open()
+
+    def _open(self):
+        with open(self.xml_file_path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getitem__(self, word: str) -> str:
+        description = self._descriptions.get(word)
+        if description is None:
+            offset, length = self.index[word]
+            item = ET.fromstring(self._mmap[offset:offset + length])
+            description = _clean_description(item.findtext('text'))
+            self._descriptions[word] = description
+        return description
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, word: object) -> bool:
+        return word in self.index
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_mmap']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def close(self):
+        self._mmap.close()
+
+
+def open_topics(xml_file_path: str) -> LazyTopics:
+    """
+    Opens the words description of a XML-based file without parsing it, using its offset index.
+    :param xml_file_path: the path to the XML file containing the words description.
+    :return: LazyTopics. A lazy mapping between a word and its description ( topics[word] = description ).
+    """
+    return LazyTopics(xml_file_path, load_topics_index(xml_file_path))
+
+
+@timed("extract_tasks")
+def extract_tasks(file_path: str) -> Iterator[Tuple[str, str, int]]:
     """
     Parses information from a csv style path in which each line is organized in the following way: text,text,number\n.
+    The lines are parsed one at a time, as they're consumed.
     :param file_path: the file to read.
-    :return: List[Tuple[str, str, int]]. A list of tuple each of the following structure: (text,text,number)
+    :return: Iterator[Tuple[str, str, int]]. An iterator of tuples each of the following structure: (text,text,number)
     """
-
-    extracted_tasks = []
     with open(file_path, 'r') as file:
         for line in file:
             topic_A, topic_B, value = line.strip().split(',')
-            extracted_tasks.append((topic_A, topic_B, int(value)))
-    return extracted_tasks
+            yield topic_A, topic_B, int(value)
 
 
 def is_json_invalid(validated_jason: dict):
@@ -83,14 +251,19 @@ def is_json_invalid(validated_jason: dict):
     return any([key for key, value in validated_jason.items() if value == ""])
 
 
-def process_tasks(tasks: List[Tuple[str, str, int]], topics: Dict[str, str], file_name: str) -> List[str]:
+@timed("process_tasks")
+def process_tasks(tasks: Iterable[Tuple[str, str, int]], topics: Mapping[str, str], file_name: str,
+                  shared_passages: bool = False) -> Iterator[Dict[str, Any]]:
     """
-    Processes the tasks into a list of JSON-like strings.
-    :param tasks: List[Tuple[str, str, int]]. The list of tasks to process ( each one in the form of (text,text,number) ).
-    :param topics: Dict[str, str]. The mapping between each word to its meaning (in the form of topics[word] = meaning ).
+    Processes the tasks into JSON-like dicts, lazily.
+    :param tasks: Iterable[Tuple[str, str, int]]. The tasks to process ( each one in the form of (text,text,number) ).
+    :param topics: Mapping[str, str]. The mapping between each word to its meaning (in the form of topics[word] = meaning ).
     :param file_name: str. The file in which the dataset is stored. Used for ID generation.
-    :return: List[str]. A list of JSON-style strings.
-    Each JSON-style string has the following structure:
+    :param shared_passages: bool. If True, the wikipedia passages are not inlined: the fields
+    "wikipedia_passage_concept_A_id" and "wikipedia_passage_concept_B_id" reference them
+    by id in the passages file instead ( see "write_passages" ).
+    :return: Iterator[Dict[str, Any]]. An iterator of JSON-like dicts.
+    Each dict has the following structure:
     {
         "wikipedia_passage_concept_A": str. wikipedia_passage_A,
         "concept_A": str. topic_A,
@@ -105,7 +278,6 @@ def process_tasks(tasks: List[Tuple[str, str, int]], topics: Dict[str, str], fil
     }
 
     """
-    processed_tasks = []
     record_id = 0
     for topic_A, topic_B, value in tasks:
         wikipedia_passage_A = topics[topic_A]
@@ -124,30 +296,164 @@ def process_tasks(tasks: List[Tuple[str, str, int]], topics: Dict[str, str], fil
         }
         if is_json_invalid(processed_task):
             continue
+        if shared_passages:
+            # A passage is referenced by its concept, which is its id in the passages file
+            processed_task = {
+                "wikipedia_passage_concept_A_id": topic_A,
+                "concept_A": topic_A,
+                "wikipedia_passage_concept_B_id": topic_B,
+                "concept_B": topic_B,
+                "choices": processed_task["choices"],
+                "target": value,
+                "id": processed_task["id"]
+            }
         record_id = record_id + 1
-        task_json = json.dumps(processed_task)
-        processed_tasks.append(task_json + '\n')
-    return processed_tasks
+        yield processed_task
+
+
+@timed("write_passages")
+def write_passages(topics: Mapping[str, str], concepts: Iterable[str], file_path: str):
+    """
+    Writes the wikipedia passages of the given concepts to a JSONL file, once per concept.
+    Each line has the following structure: { "id": concept, "passage": wikipedia_passage }.
+    The "id" key is always the first one, so that readers can index the file without decoding the passages.
+    :param topics: Mapping[str, str]. The mapping between each word to its meaning (in the form of topics[word] = meaning ).
+    :param concepts: Iterable[str]. The concepts whose passage has to be written.
+    :param file_path: str. The path of the passages file.
+    """
+    write_jsonl(file_path, ({"id": concept, "passage": topics[concept]} for concept in sorted(set(concepts))))
+
+
+def extract_concepts(task_files: Iterable[str]) -> Set[str]:
+    """
+    Extracts all the concepts referenced by some datasets.
+    :param task_files: Iterable[str]. The dataset files.
+    :return: Set[str]. The referenced concepts.
+    """
+    return {concept for task_file in task_files
+            for topic_A, topic_B, _ in extract_tasks(task_file) for concept in (topic_A, topic_B)}
 
 
-def create_benchmark():
+@timed("build_benchmark")
+def build_benchmark(task_file: str, benchmark_file: str, topics: Mapping[str, str],
+                    shared_passages: bool = False):
     """
-    Creates the benchmark by reading data from the datasets, processing
+    Creates a single benchmark by reading data from a dataset, processing
     it and writing it to the created benchmark file.
+    :param task_file: str. The dataset file.
+    :param benchmark_file: str. The benchmark file to create.
+    :param topics: Mapping[str, str]. The mapping between each word to its meaning (in the form of topics[word] = meaning ).
+    :param shared_passages: bool. Whether the passages are referenced by id ( see "process_tasks" ).
+    """
+    print("Reading data from: ", task_file)
+    tasks = extract_tasks(task_file)
+    print("Creating benchmark: ", benchmark_file)
+    file_name = os.path.splitext(os.path.basename(task_file))[0]
+    write_jsonl(benchmark_file, process_tasks(tasks, topics, file_name, shared_passages))
+    print("Bechmark created: ", benchmark_file)
+
+
+# The topics shared by the parent process with the workers of the pool
+_worker_topics: Optional[Mapping[str, str]] = None
+
+
+def _init_worker(topics: Mapping[str, str]):
+    global _worker_topics
+    _worker_topics = topics
+
+
+def _build_benchmark_in_worker(task_file: str, benchmark_file: str, shared_passages: bool,
+                               instrumented: bool) -> Dict[str, Dict[str, float]]:
+    # The stages measured in the worker are sent back to the parent process
+    if instrumented:
+        INSTRUMENTATION.enable(INSTRUMENTATION.trace_memory)
+    build_benchmark(task_file, benchmark_file, _worker_topics, shared_passages)
+    return INSTRUMENTATION.snapshot()
+
+
+def create_benchmark(workers: Optional[int] = WORKERS, force: bool = False):
+    """
+    Creates the benchmarks by reading data from the datasets, processing
+    it and writing it to the created benchmark files.
+    The benchmarks are created concurrently by a pool of processes, sharing the
+    topics read-only ( copy-on-write, where the platform can fork ).
+    The output doesn't depend on the number of processes.
+    A benchmark is rebuilt only if its dataset, the wikipedia file, the hyperparameters or the code
+    changed since it was built ( see build_manifest ). If nothing changed, the wikipedia file is only hashed,
+not indexed or parsed.
+    :param workers: Optional[int]. The number of processes ( None means one per CPU core, 1 disables the pool ).
+    :param force: bool. If True, all the benchmarks are rebuilt.
     """
-    print("Extracting wikipedia topics from: ", WIKIPEDIA_FILE)
-    topics = extract_topics(WIKIPEDIA_FILE)
+    workers = workers or os.cpu_count() or 1
+    parameters = {"CLASSES_NAMES": CLASSES_NAMES, "SHARED_PASSAGES": SHARED_PASSAGES}
+    jobs = []
     for task_file, benchmark_file in FILES:
-        print("Reading data from: ", task_file)
-        tasks = extract_tasks(task_file)
-        print("Creating benchmark: ", benchmark_file)
-        with open(benchmark_file, 'w') as file:
-            file_name = os.path.splitext(os.path.basename(task_file))[0]
-            lines = process_tasks(tasks, topics, file_name)
-            file.writelines(lines)
-        print("Bechmark created")
+        manifest = create_manifest([task_file, WIKIPEDIA_FILE], parameters, CODE_FILES)
+        if not force and is_up_to_date(benchmark_file, manifest):
+            print("Benchmark up to date: ", benchmark_file)
+            continue
+        invalidate_manifest(benchmark_file)
+        jobs.append((task_file, benchmark_file, manifest))
+    passages_manifest = None
+    if SHARED_PASSAGES:
+        passages_manifest = create_manifest([task_file for task_file, _ in FILES] + [WIKIPEDIA_FILE],
+                                            parameters, CODE_FILES)
+        if not force and is_up_to_date(PASSAGES_FILE, passages_manifest):
+            print("Passages up to date: ", PASSAGES_FILE)
+            passages_manifest = None
+        else:
+            invalidate_manifest(PASSAGES_FILE)
+    if not jobs and passages_manifest is None:
+        print("Done")
+        return
+
+    print("Indexing wikipedia topics from: ", WIKIPEDIA_FILE)
+    topics = open_topics(WIKIPEDIA_FILE)
+    if workers == 1 or len(jobs) <= 1:
+        for task_file, benchmark_file, manifest in jobs:
+            build_benchmark(task_file, benchmark_file, topics, SHARED_PASSAGES)
+            write_manifest(benchmark_file, manifest)
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        start_methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in start_methods else None)
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=context,
+                                 initializer=_init_worker, initargs=(topics,)) as executor:
+            futures = [executor.submit(_build_benchmark_in_worker, task_file, benchmark_file, SHARED_PASSAGES,
+                                       INSTRUMENTATION.enabled)
+                       for task_file, benchmark_file, _ in jobs]
+            for future, (_, benchmark_file, manifest) in zip(futures, jobs):
+                INSTRUMENTATION.merge(future.result())
+                write_manifest(benchmark_file, manifest)
+    if passages_manifest is not None:
+        print("Writing passages: ", PASSAGES_FILE)
+        write_passages(topics, extract_concepts(task_file for task_file, _ in FILES), PASSAGES_FILE)
+        write_manifest(PASSAGES_FILE, passages_manifest)
+    topics.close()
     print("Done")
 
 
+def main(argv: Optional[List[str]] = None):
+    """
+    The command line of the benchmark builder ( see "cli.py" ).
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    """
+    parser = argparse.ArgumentParser(description="Creates the PRELEARN benchmarks.")
+    parser.add_argument("--force", action="store_true", help="rebuild all the benchmarks, even if up to date")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="number of processes ( default: one per core )")
+    parser.add_argument("--report", help="write a JSON report of the time and memory of each stage")
+    parser.add_argument("--profile", help="write the cProfile statistics of the run ( of this process only )")
+    arguments = parser.parse_args(argv)
+    if arguments.report or arguments.profile:
+        INSTRUMENTATION.enable(trace_memory=arguments.report is not None, profile=arguments.profile is not None)
+    create_benchmark(arguments.workers, arguments.force)
+    if arguments.report:
+        INSTRUMENTATION.write_report(arguments.report)
+    if arguments.profile:
+        INSTRUMENTATION.dump_profile(arguments.profile)
+
+
 if __name__ == '__main__':
-    create_benchmark()
+    main()
@@ -1,11 +1,19 @@
-# %pip install replicate
-import json
+import argparse
 import os
 import random
-from typing import Dict, List, Any
-from jinja2 import Template
+import re
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Iterable, Iterator, Tuple
 
-import replicate
+from build_manifest import MANIFEST_SUFFIX
+from jsonl_io import loads, read_jsonl
+
+if TYPE_CHECKING:
+    from jinja2 import Template
+
+    from evaluation import Backend
 
 ######################### Settings #########################################
 
@@ -16,9 +24,31 @@ BENCHMARK_FILE = "task-15/benchmarks/PRELEARN-geometry-pairs_test.jsonl"
 
 # The number of parses to be done per each prompt ( using the benchmark )
 PARSES_PER_PROMPT = 1
+
+# The model used to test the prompts
+MODEL = "meta/llama-2-70b-chat"
+# The JSONL file to which the outputs of the model are appended
+OUTPUTS_FILE = "task-15/outputs.jsonl"
+# The SQLite file caching the outputs of the model, so that identical prompts are not sent again ( None disables it )
+CACHE_FILE = "task-15/responses.sqlite"
+
+# The JSONL passages file referenced by the benchmark, if it was created
+# with shared passages ( see task_15.SHARED_PASSAGES ), None otherwise
+PASSAGES_FILE = None
+# The max number of passages kept in memory while loading the contexts
+PASSAGES_CACHE_SIZE = 1024
+
+# The number of contexts rendered by a worker process at a time, when rendering in parallel
+RENDER_CHUNK_SIZE = 512
+
+# The max number of tokens of each passage in the prompts, by field ( e.g. { "wikipedia_passage_concept_A": 256 } ).
+# The passages are cut to whole sentences. None means the passages are not cut
+PASSAGE_BUDGETS = None
+# The JSONL file of the passage summaries ( see passage_summary ). The passages without a summary are tokenized
+SUMMARIES_FILE = "task-15/benchmarks/passage_summaries.jsonl"
 ####################### API TOKENS ###########################################à
 
-os.environ["REPLICATE_API_TOKEN"] = "API_TOKEN"
+# The Replicate token is read from the REPLICATE_API_TOKEN environment variable ( see evaluation.ReplicateBackend )
 llama2_70b = "llama2_70b"
 llama2_13b = "llama2_70b"
 
@@ -36,23 +66,204 @@ def parse_prompt(prompt: str, context: Dict[str,Any]) -> str:
     :param context: Dict[str,Any]. The context used for parsing.
     :return: str. The parsed prompt.
     """
-    template = Template(prompt)
-    return template.render(**context)
+    return compile_template(prompt).render(**context)
 
 
-def load_contexts(file_name: str) -> List[Dict[str, Any]]:
+@lru_cache(maxsize=None)
+def compile_template(prompt: str) -> 'Template':
+    """
+    It compiles a prompt template. Each template is compiled only once, and then reused.
+    jinja2 is imported by the first compilation, so the modules using only the other functions start faster.
+    :param prompt: str. The prompt template.
+    :return: Template. The compiled template.
+    """
+    from jinja2 import Template
+
+    return Template(prompt)
+
+
+def _render_chunk(prompt: str, contexts: List[Dict[str, Any]]) -> List[str]:
+    return [parse_prompt(prompt, context) for context in contexts]
+
+
+def render_batch(prompt: str, contexts: Iterable[Dict[str, Any]], workers: Optional[int] = None,
+                 chunk_size: int = RENDER_CHUNK_SIZE) -> Iterator[str]:
+    """
+    It parses a prompt template with each context, lazily and in the same order of the contexts.
+    :param prompt: str. The prompt template to be parsed.
+    :param contexts: Iterable[Dict[str,Any]]. The contexts used for parsing.
+    :param workers: Optional[int]. The number of worker processes rendering chunks of contexts
+    ( None or 1 means rendering in this process ).
+    :param chunk_size: int. The number of contexts rendered by a worker at a time.
+    :return: Iterator[str]. The parsed prompts.
+    """
+    if workers is None or workers == 1:
+        for context in contexts:
+            yield parse_prompt(prompt, context)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    contexts = iter(contexts)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # At most two chunks per worker are pending, so the contexts are not all read at once
+        pending = deque()
+        while True:
+            while len(pending) < workers * 2:
+                chunk = list(islice(contexts, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_render_chunk, prompt, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+
+class PassageStore:
+    """
+    It reads the passages of a passages file ( see task_15.write_passages ) on demand.
+    Only the byte offset of each passage is kept in memory, while the most recently
+    used passages are cached.
+    """
+
+    _ID_PATTERN = re.compile(rb'^\{"id":\s*("(?:[^"\\]|\\.)*")')
+
+    def __init__(self, file_name: str, cache_size: int = PASSAGES_CACHE_SIZE):
+        """
+        :param file_name: str. The name of the passages file.
+        :param cache_size: int. The max number of passages kept in memory.
+        """
+        self.file_name = file_name
+        self.offsets: Dict[str, int] = {}
+        offset = 0
+        with open(file_name, 'rb') as file:
+            for line in file:
+                passage_id = loads(self._ID_PATTERN.match(line).group(1))
+                self.offsets[passage_id] = offset
+                offset += len(line)
+        self._file = open(file_name, 'rb')
+        self.get = lru_cache(maxsize=cache_size)(self._read)
+
+    def _read(self, passage_id: str) -> str:
+        self._file.seek(self.offsets[passage_id])
+        return loads(self._file.readline())["passage"]
+
+    def close(self):
+        self._file.close()
+
+
+class SummaryStore(PassageStore):
+    """
+    It reads the summaries of a summaries file ( see passage_summary.build_summaries ) on demand,
+    as (sentence ends, cumulative token counts) pairs.
+    The tokenizer the summaries were built with is read from the manifest of the file.
     """
-    It loads the benchmark values from a JSONL file.
+
+    def __init__(self, file_name: str, cache_size: int = PASSAGES_CACHE_SIZE):
+        """
+        :param file_name: str. The name of the summaries file.
+        :param cache_size: int. The max number of summaries kept in memory.
+        """
+        super().__init__(file_name, cache_size)
+        # The default tokenizer of passage_summary, if the file has no manifest
+        self.tokenizer: Optional[str] = None
+        try:
+            with open(file_name + MANIFEST_SUFFIX, 'r', encoding='utf-8') as file:
+                self.tokenizer = loads(file.read())["parameters"]["TOKENIZER"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _read(self, passage_id: str) -> Tuple[List[int], List[int]]:
+        self._file.seek(self.offsets[passage_id])
+        summary = loads(self._file.readline())
+        return summary["ends"], summary["tokens"]
+
+
+@lru_cache(maxsize=None)
+def _count_tokens(tokenizer: Optional[str] = None):
+    import passage_summary
+    return passage_summary.load_tokenizer(tokenizer or passage_summary.TOKENIZER)
+
+
+@lru_cache(maxsize=PASSAGES_CACHE_SIZE)
+def _summarize(passage: str, tokenizer: Optional[str] = None) -> Tuple[List[int], List[int]]:
+    import passage_summary
+    return passage_summary.summarize_passage(passage, _count_tokens(tokenizer))
+
+
+def parse_prompt_within_budget(prompt: str, context: Dict[str, Any], budgets: Dict[str, int],
+                               summaries: Optional[SummaryStore] = None) -> Tuple[str, int]:
+    """
+    It parses a prompt ( see "parse_prompt" ), cutting the passages of the context to a token budget
+    ( see passage_summary.truncate_passage ).
+    :param prompt: str. The prompt template to be parsed.
+    :param context: Dict[str,Any]. The context used for parsing.
+    :param budgets: Dict[str, int]. The max number of tokens of each passage field ( e.g. "wikipedia_passage_concept_A" ).
+    :param summaries: Optional[SummaryStore]. The summaries of the passages, by concept. The passages without
+    a summary ( or whose summary doesn't match ) are tokenized, with the tokenizer of the summaries.
+    :return: Tuple[str, int]. The parsed prompt and the number of tokens removed from the passages.
+    """
+    import passage_summary
+    tokenizer = summaries.tokenizer if summaries is not None else None
+    truncated_context = dict(context)
+    saved_tokens = 0
+    for field, budget in budgets.items():
+        passage = context.get(field)
+        if not passage:
+            continue
+        concept = context.get(field[len("wikipedia_passage_"):])
+        summary = None
+        if summaries is not None and concept in summaries.offsets:
+            summary = summaries.get(concept)
+        if summary is None or summary[0][-1] != len(passage):
+            summary = _summarize(passage, tokenizer)
+        truncated_context[field], saved = passage_summary.truncate_passage(passage, *summary, budget)
+        saved_tokens += saved
+    return parse_prompt(prompt, truncated_context), saved_tokens
+
+
+def rehydrate_context(context: Dict[str, Any], passages: PassageStore) -> Dict[str, Any]:
+    """
+    It replaces the passages referenced by id in a context ( keys ending in "_id" ) with their text.
+    For instance { "wikipedia_passage_concept_A_id": "Fisica" } becomes
+    { "wikipedia_passage_concept_A": passage of "Fisica" }.
+    :param context: Dict[str, Any]. The context to rehydrate.
+    :param passages: PassageStore. The store of the referenced passages.
+    :return: Dict[str, Any]. The rehydrated context.
+    """
+    rehydrated_context = {}
+    for key, value in context.items():
+        if key.startswith("wikipedia_passage_") and key.endswith("_id"):
+            rehydrated_context[key[:-len("_id")]] = passages.get(value)
+        else:
+            rehydrated_context[key] = value
+    return rehydrated_context
+
+
+def load_contexts(file_name: str, passages_file: Optional[str] = PASSAGES_FILE) -> Iterator[Dict[str, Any]]:
+    """
+    It loads the benchmark values from a JSONL file, one at a time.
     :param file_name: The name of the file where the contexts are.
-    :return: List[Dict[str, Any]]. The list of dicts from the benchmark file,
+    :param passages_file: Optional[str]. The passages file referenced by the benchmark, if any.
+    If given, the referenced passages are read from it and inlined in the contexts.
+    :return: Iterator[Dict[str, Any]]. The dicts from the benchmark file,
     each one with a format dict[name] = value.
+    :raises ValueError: if a context references its passages by id, and no passages file is given.
     """
-    contexts = []
-    with open(file_name, 'r', encoding='utf-8') as file:
-        for line in file:
-            dictionary = json.loads(line)
-            contexts.append(dictionary)
-    return contexts
+    if passages_file is None:
+        for dictionary in read_jsonl(file_name):
+            # Without the passages, the referenced ones would be rendered as empty strings
+            if any(key.startswith("wikipedia_passage_") and key.endswith("_id") for key in dictionary):
+                raise ValueError(f"The contexts of {file_name} reference shared passages "
+                                 f"( see task_15.SHARED_PASSAGES ): give their passages file ( PASSAGES_FILE ).")
+            yield dictionary
+        return
+    passages = PassageStore(passages_file)
+    try:
+        for dictionary in read_jsonl(file_name):
+            yield rehydrate_context(dictionary, passages)
+    finally:
+        passages.close()
 
 
 def load_prompts(file_name: str) -> List[str]:
@@ -63,64 +274,115 @@ def load_prompts(file_name: str) -> List[str]:
     :return: List[str]. A list of prompts template.
     """
     prompts = []
-    with open(file_name, 'r') as file:
-        for line in file:
-            dictionary = json.loads(line)
-            prompts.append(
-                dictionary["prompt"]
-            )
+    for dictionary in read_jsonl(file_name):
+        prompts.append(
+            dictionary["prompt"]
+        )
+        compile_template(dictionary["prompt"])
     return prompts
 
 
-def parse_prompt_randomly(prompt: str, contexts: List[Dict[str, Any]], count: int) -> List[str]:
+def parse_prompt_randomly(prompt: str, contexts: Iterable[Dict[str, Any]], count: int) -> List[str]:
     """
     It parses the prompt template with [count] random contexts.
+    The contexts are sampled in a single pass ( reservoir sampling ), keeping only [count] of them in memory.
     :param prompt: str. The prompt template to be parsed.
-    :param contexts: List[Dict[str,Any]]. The list of contexts used for parsing.
+    :param contexts: Iterable[Dict[str,Any]]. The contexts used for parsing.
     :param count: int. The count of context to sample randomly ( uniformly ) from "contexts".
     :return: List[str]. The list of parsed templates.
     """
-    sampled_contexts = random.sample(contexts, count)
+    sampled_contexts = []
+    for position, context in enumerate(contexts):
+        if position < count:
+            sampled_contexts.append(context)
+        else:
+            replaced_position = random.randint(0, position)
+            if replaced_position < count:
+                sampled_contexts[replaced_position] = context
+    if len(sampled_contexts) < count:
+        raise ValueError("Sample larger than the number of contexts.")
+    random.shuffle(sampled_contexts)
     return [parse_prompt(prompt, context) for context in sampled_contexts]
 
 
-def test_prompt(prompt: str, contexts: List[Dict]):
+def test_prompt(prompt: str, contexts: Iterable[Dict], backend: Optional['Backend'] = None,
+                output_file: str = OUTPUTS_FILE) -> Dict[str, Any]:
     """
-    NOT COMPLETED! Need a valid access API Token
     It tests a prompt template with a list of contexes with a LLM API,
-    showing the accuracy of the model.
+    running the requests concurrently ( see evaluation.run_evaluation ).
+    The outputs are appended to "output_file" as soon as they're received, and
+    cached in CACHE_FILE: the prompts already answered are not sent again.
+    If PASSAGE_BUDGETS is set, the passages are cut to it, and the tokens saved are reported.
     :param prompt: str. The prompt template to be parsed.
-    :param contexts: List[Dict[str,Any]]. The list of contexts used for parsing.
-    """
-    prompt_outputs = []
-    for context in contexts:
-        parsed_prompt = parse_prompt(prompt, context)
-        output = replicate.run(
-            "meta/llama-2-70b-chat",
-            input={
-                "prompt": parsed_prompt
-            },
-        )
-        prompt_outputs.append(''.join(output))
+    :param contexts: Iterable[Dict[str,Any]]. The contexts used for parsing.
+    :param backend: Optional[Backend]. The LLM backend ( None means MODEL on Replicate ).
+    :param output_file: str. The JSONL file to which the outputs are appended.
+    :return: Dict[str, Any]. The report of the run ( throughput and latency ).
+    """
+    from evaluation import ReplicateBackend, evaluate
+    from response_cache import CachedBackend, ResponseCache
+
+    backend = backend if backend is not None else ReplicateBackend(MODEL)
+    cache = ResponseCache(CACHE_FILE) if CACHE_FILE is not None else None
+    if cache is not None:
+        backend = CachedBackend(backend, cache)
+    summaries = None
+    if PASSAGE_BUDGETS is not None and SUMMARIES_FILE is not None and os.path.exists(SUMMARIES_FILE):
+        summaries = SummaryStore(SUMMARIES_FILE)
+    saved_tokens = 0
 
-    print(prompt_outputs)
-    # TODO -> Complete if you have a valid API access token
+    def render(context: Dict[str, Any]) -> str:
+        nonlocal saved_tokens
+        if PASSAGE_BUDGETS is None:
+            return parse_prompt(prompt, context)
+        parsed_prompt, saved = parse_prompt_within_budget(prompt, context, PASSAGE_BUDGETS, summaries)
+        saved_tokens += saved
+        return parsed_prompt
 
+    items = ((context.get("id", str(position)), render(context))
+             for position, context in enumerate(contexts))
+    report = evaluate(backend, items, output_file)
+    if PASSAGE_BUDGETS is not None:
+        report["tokens_saved"] = saved_tokens
+    if summaries is not None:
+        summaries.close()
+    if cache is not None:
+        report["cache"] = cache.stats()
+        cache.close()
+    print(report)
+    return report
 
-def parse_prompts():
+
+def parse_prompts(prompts_file: str = PROMPTS_FILE, benchmark_file: str = BENCHMARK_FILE,
+                  count: int = PARSES_PER_PROMPT):
     """
-    It parses all the prompts with a number [PARSES_PER_PROMPT]
+    It parses all the prompts with a number [count]
     of contexts chosen randomly, and they're printed on the screen.
+    :param prompts_file: str. The JSONL prompt file.
+    :param benchmark_file: str. The JSONL benchmark file of the contexts.
+    :param count: int. The number of contexts parsed per prompt.
     """
-    prompts = load_prompts(PROMPTS_FILE)
-    contexts = load_contexts(BENCHMARK_FILE)
+    prompts = load_prompts(prompts_file)
 
     for prompt in prompts:
         print("### Parsing prompt: \n", prompt)
-        parsed_prompts = parse_prompt_randomly(prompt, contexts, PARSES_PER_PROMPT)
+        parsed_prompts = parse_prompt_randomly(prompt, load_contexts(benchmark_file), count)
         print('\n'.join(parsed_prompts))
         print("-----------------------------------------------------------------------------")
 
 
+def main(argv: Optional[List[str]] = None):
+    """
+    The command line of the prompt rendering ( see "cli.py" ).
+    :param argv: Optional[List[str]]. The arguments ( None means the ones of the process ).
+    """
+    parser = argparse.ArgumentParser(description="Parses the prompts with contexts chosen randomly.")
+    parser.add_argument("--prompts", default=PROMPTS_FILE, help="the JSONL prompt file")
+    parser.add_argument("--benchmark", default=BENCHMARK_FILE, help="the JSONL benchmark file of the contexts")
+    parser.add_argument("--count", type=int, default=PARSES_PER_PROMPT, help="the number of contexts per prompt")
+    arguments = parser.parse_args(argv)
+    parse_prompts(arguments.prompts, arguments.benchmark, arguments.count)
+
+
 if __name__ == '__main__':
-    parse_prompts()
+    main()
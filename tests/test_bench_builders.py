@@ -0,0 +1,34 @@
+import types
+
+from benchmarks import bench_builders
+
+
+def test_patched_restores_and_removes_the_attributes():
+    module = types.SimpleNamespace(FILE_NAME="dataset.json")
+    with bench_builders.patched(module, FILE_NAME="other.json", print=bench_builders._no_print):
+        assert module.FILE_NAME == "other.json" and module.print is bench_builders._no_print
+    assert module.FILE_NAME == "dataset.json"
+    assert not hasattr(module, "print")
+
+
+def test_fewer_runs_have_a_wider_tolerance():
+    assert bench_builders.throughput_tolerance(bench_builders.REPEAT) == bench_builders.THROUGHPUT_TOLERANCE
+    assert bench_builders.throughput_tolerance(bench_builders.REPEAT * 2) == bench_builders.THROUGHPUT_TOLERANCE
+    assert bench_builders.THROUGHPUT_TOLERANCE < bench_builders.throughput_tolerance(1) \
+        <= bench_builders.MAX_THROUGHPUT_TOLERANCE
+
+
+def test_regressions():
+    baseline = {"records_per_second": 1000.0, "peak_traced_bytes": 1000}
+    results = {
+        "slower": {"records_per_second": 700.0, "peak_traced_bytes": 1000},
+        "bigger": {"records_per_second": 1000.0, "peak_traced_bytes": 1300},
+        "same": {"records_per_second": 900.0, "peak_traced_bytes": 1100},
+        "new": {"records_per_second": 1000.0, "peak_traced_bytes": 1000},
+    }
+    baselines = {"slower": baseline, "bigger": baseline, "same": baseline}
+    regressions = bench_builders.find_regressions(results, baselines)
+    assert [regression.split(':')[0] for regression in regressions] == ["slower", "bigger", "new"]
+    # A single run tolerates the slowdown
+    regressions = bench_builders.find_regressions(results, baselines, bench_builders.throughput_tolerance(1))
+    assert [regression.split(':')[0] for regression in regressions] == ["bigger", "new"]
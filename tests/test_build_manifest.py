@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+import passage_summary
+from build_manifest import MANIFEST_SUFFIX
+
+WIKIPEDIA = """<document>
+<doc id="1" url="https://it.wikipedia.org/wiki?curid=1" title="Punto">
+<title>Punto</title>
+Il punto è un ente geometrico. Non ha dimensioni.
+</doc>
+</document>
+"""
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch, capsys):
+    xml_file = tmp_path / "pages.xml"
+    xml_file.write_text(WIKIPEDIA, encoding='utf-8')
+    code_file = tmp_path / "code.py"
+    code_file.write_text("VERSION = 1\n", encoding='utf-8')
+    monkeypatch.setattr(passage_summary, "CODE_FILES", (str(code_file),))
+    output_file = str(tmp_path / "summaries.jsonl")
+
+    def run(**options) -> bool:
+        # True if the summaries were rebuilt
+        passage_summary.build_summaries(str(xml_file), output_file, **options)
+        return "Summaries written" in capsys.readouterr().out
+
+    run.xml_file, run.code_file, run.output_file = xml_file, code_file, output_file
+    return run
+
+
+def test_unchanged_output_is_skipped(build):
+    assert build()
+    assert os.path.exists(build.output_file + MANIFEST_SUFFIX)
+    assert not build()
+    assert build(force=True)
+    assert not build()
+
+
+def test_changed_input_is_rebuilt(build):
+    assert build()
+    build.xml_file.write_text(WIKIPEDIA.replace("Non ha dimensioni.", "Non ha parti."), encoding='utf-8')
+    assert build()
+    assert not build()
+
+
+def test_changed_parameter_is_rebuilt(build):
+    assert build()
+    assert build(tokenizer="whitespace")
+    assert not build(tokenizer="whitespace")
+
+
+def test_changed_code_is_rebuilt(build):
+    assert build()
+    build.code_file.write_text("VERSION = 2\n", encoding='utf-8')
+    assert build()
+
+
+def test_interrupted_build_is_not_up_to_date(build, monkeypatch):
+    assert build()
+
+    def interrupted(passages, count_tokens):
+        yield {"id": "Punto", "ends": [], "tokens": []}
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(passage_summary, "iter_summaries", interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            build(force=True)
+    # The partial output has no manifest, so it's rebuilt even with unchanged inputs
+    assert not os.path.exists(build.output_file + MANIFEST_SUFFIX)
+    assert build()
@@ -0,0 +1,49 @@
+import importlib
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cli
+from benchmarks import bench_imports
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The heavy modules that "import cli" must never load
+CLI_HEAVY_MODULES = ("replicate", "numpy", "orjson", "transformers")
+
+
+@pytest.mark.parametrize("argv, module, options", [
+    (["build", "task13"], "task_13", []),
+    (["build", "ghigliottina", "--games", "10"], "task_14_generator", ["--games", "10"]),
+    (["render", "--count", "2"], "tests", ["--count", "2"]),
+    (["eval"], "sharded_evaluation", []),
+    (["score", "--results", "results.jsonl"], "scoring", ["--results", "results.jsonl"]),
+    (["bench"], "benchmarks.bench_builders", []),
+])
+def test_commands_run_the_main_of_their_module(argv, module, options):
+    arguments = cli.parse_command(argv)
+    assert (arguments.module, arguments.options) == (module, options)
+    assert callable(importlib.import_module(module).main)
+
+
+def test_help_is_left_to_the_module():
+    assert cli.parse_command(["score", "--help"]).options == ["--help"]
+
+
+def test_import_does_not_load_heavy_modules():
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import cli"], cwd=ROOT,
+                             stderr=subprocess.PIPE, text=True, check=True)
+    # The lines are "import time: {self us} | {cumulative us} | {indented module}"
+    modules = {line.rsplit('|', 1)[1].strip() for line in process.stderr.splitlines()
+               if line.startswith("import time:")}
+    assert "cli" in modules
+    assert not [module for module in CLI_HEAVY_MODULES
+                if module in modules or any(name.startswith(module + ".") for name in modules)]
+
+
+@pytest.mark.parametrize("command", sorted(bench_imports.COMMANDS))
+def test_commands_start_without_unneeded_heavy_modules(command, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    result = bench_imports.measure_commands(repeat=1, only=[command])[command]
+    assert result["unexpected"] == []
@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import pytest
+
+import evaluation
+from evaluation import Backend, FakeBackend, call_with_retries, evaluate, evaluate_choices
+
+
+def _read_results(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_evaluate_with_a_failing_fake_backend(tmp_path):
+    output_file = str(tmp_path / "outputs.jsonl")
+    backend = FakeBackend(answer=lambda prompt: prompt.upper(), latency=0.005, failure_rate=0.4, seed=7)
+    items = [(str(index), f"prompt {index}") for index in range(200)]
+    retries = 2
+    report = evaluate(backend, iter(items), output_file, concurrency=4, retries=retries, backoff=0.0)
+
+    # The concurrency is bounded, and reached
+    assert backend.max_in_flight == 4
+    # Every item is completed or failed, and every call is a success or a failure
+    assert report["completed"] + report["failed"] == len(items)
+    assert report["failed"] > 0
+    assert backend.calls - backend.failures == report["completed"]
+    # A failed item used all its retries
+    assert backend.failures >= report["failed"] * (retries + 1)
+    assert backend.calls <= len(items) * (retries + 1)
+
+    results = _read_results(output_file)
+    assert sorted(result["id"] for result in results) == sorted(item_id for item_id, _ in items)
+    completed = [result for result in results if "output" in result]
+    assert len(completed) == report["completed"]
+    assert all(result["output"] == result["prompt"].upper() for result in completed)
+    assert sum("error" in result for result in results) == report["failed"]
+
+    assert 0.005 <= report["latency_p50"] <= report["latency_p95"]
+    assert report["latency_p95"] <= max(result["latency"] for result in completed)
+
+
+def test_evaluate_is_reproducible_with_a_seed(tmp_path):
+    reports = []
+    for run in range(2):
+        backend = FakeBackend(failure_rate=0.3, seed=1)
+        items = [(str(index), "prompt") for index in range(50)]
+        reports.append(evaluate(backend, items, str(tmp_path / f"outputs-{run}.jsonl"), concurrency=1,
+                                retries=0, backoff=0.0))
+    assert reports[0]["failed"] == reports[1]["failed"] > 0
+
+
+class _GenerateOnlyBackend(Backend):
+    async def generate(self, prompt: str) -> str:
+        return "si"
+
+
+def test_choice_evaluation_needs_loglikelihoods(tmp_path):
+    with pytest.raises(NotImplementedError):
+        evaluate_choices(_GenerateOnlyBackend(), [("0", "prompt", [" a", " b"])], str(tmp_path / "scores.jsonl"))
+    assert FakeBackend().supports_loglikelihoods()
+
+
+def test_errors_that_would_fail_again_are_not_retried():
+    calls = 0
+
+    async def request():
+        nonlocal calls
+        calls += 1
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_retries(request, retries=3, backoff=10.0))
+    assert calls == 1
+
+
+def test_choice_evaluation_with_the_fake_backend(tmp_path):
+    output_file = str(tmp_path / "scores.jsonl")
+    backend = FakeBackend(loglikelihood=lambda prompt, continuation: -abs(len(continuation) - len(prompt)),
+                          failure_rate=0.2, seed=3)
+    items = [(str(index), "x" * (index % 4 + 1), ["a", "bb", "ccc", "dddd"]) for index in range(40)]
+    report = evaluate_choices(backend, items, output_file, batch_size=8, concurrency=2, retries=5, backoff=0.0)
+    assert report["completed"] == 40 and report["requests"] == 5
+    results = {result["id"]: result for result in _read_results(output_file)}
+    assert all(results[str(index)]["prediction"] == index % 4 for index in range(40))
+    # The fake log-likelihoods are deterministic
+    scores = asyncio.run(FakeBackend().loglikelihoods([("prompt", [" a", " b"])]))
+    assert scores == asyncio.run(FakeBackend().loglikelihoods([("prompt", [" a", " b"])]))
+    assert all(-10 <= score < 0 for score in scores[0])
+
+
+def test_truncated_responses_are_retried():
+    calls = 0
+
+    async def request():
+        nonlocal calls
+        calls += 1
+        if calls < 3:
+            return json.loads('{"output": "tronc')
+        return "ok"
+
+    assert asyncio.run(call_with_retries(request, retries=3, backoff=0.0)) == "ok"
+    assert calls == 3
+
+
+class _UnserializableBackend(Backend):
+    async def generate(self, prompt: str) -> object:
+        return object()
+
+
+def test_a_failing_worker_stops_the_run(tmp_path):
+    # Writing the output fails: the producer waiting for the full queue must not be left blocked
+    run = evaluation.run_evaluation(_UnserializableBackend(), ((str(index), "prompt") for index in range(100)),
+                                    str(tmp_path / "outputs.jsonl"), concurrency=2, requests_per_second=None)
+    with pytest.raises(TypeError):
+        asyncio.run(asyncio.wait_for(run, timeout=5))
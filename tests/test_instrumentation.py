@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+from instrumentation import Instrumentation
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_timed_generators_report_their_peak_memory():
+    instrumentation = Instrumentation()
+
+    @instrumentation.timed("produce")
+    def produce(count):
+        for _ in range(count):
+            # A temporary allocation of about 1 MB per item
+            yield len(bytearray(1 << 20))
+
+    @instrumentation.timed("consume")
+    def consume(items):
+        return sum(items)
+
+    instrumentation.enable(trace_memory=True)
+    try:
+        assert consume(produce(5)) == 5 << 20
+    finally:
+        instrumentation.disable()
+    stages = instrumentation.report()["stages"]
+    assert stages["produce"]["records"] == 5
+    assert stages["produce"]["peak_traced_bytes"] >= 1 << 20
+    assert stages["consume"]["peak_traced_bytes"] >= stages["produce"]["peak_traced_bytes"]
+    assert "process_peak_rss_kb" in stages["produce"]
+
+
+def test_disabled_instrumentation_records_nothing():
+    instrumentation = Instrumentation()
+
+    @instrumentation.timed("produce")
+    def produce():
+        yield 1
+
+    assert list(produce()) == [1]
+    assert instrumentation.stages == {}
+
+
+def test_importing_the_instrumentation_is_cheap():
+    code = "import sys, jsonl_io; print('tracemalloc' in sys.modules, 'cProfile' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True, check=True,
+                            cwd=ROOT).stdout
+    assert output.split() == ["False", "False"]
@@ -0,0 +1,65 @@
+import json
+import random
+
+import pytest
+
+import jsonl_io
+from jsonl_io import iter_json_array, read_jsonl, write_jsonl
+
+
+def _random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randrange(6 if depth < 2 else 4)
+    if kind == 0:
+        return rng.randint(-10 ** 6, 10 ** 6)
+    if kind == 1:
+        return rng.choice([1.5, -0.25, 1.25e3, 6.02e-23, rng.uniform(-1e6, 1e6)])
+    if kind == 2:
+        return rng.choice([True, False, None])
+    if kind == 3:
+        return ''.join(rng.choice('ab "\\èé,]') for _ in range(rng.randrange(6)))
+    if kind == 4:
+        return [_random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return {f"k{index}": _random_value(rng, depth + 1) for index in range(rng.randrange(4))}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3])
+def test_iter_json_array_number_across_chunks(tmp_path, chunk_size):
+    file_path = tmp_path / "array.json"
+    file_path.write_text("[1.5, 2]", encoding='utf-8')
+    assert list(iter_json_array(str(file_path), chunk_size)) == [1.5, 2]
+
+
+def test_iter_json_array_chunk_boundary_fuzz(tmp_path):
+    rng = random.Random(0)
+    file_path = tmp_path / "array.json"
+    for _ in range(500):
+        array = [_random_value(rng) for _ in range(rng.randrange(8))]
+        separators = rng.choice([(',', ':'), (', ', ': '), (' ,\n', ' : ')])
+        file_path.write_text(' ' * rng.randrange(3) + json.dumps(array, separators=separators, ensure_ascii=False),
+                             encoding='utf-8')
+        chunk_size = rng.randint(1, 17)
+        assert list(iter_json_array(str(file_path), chunk_size)) == array, (array, chunk_size)
+
+
+def test_iter_json_array_rejects_truncated_arrays(tmp_path):
+    file_path = tmp_path / "array.json"
+    file_path.write_text("[1, 2", encoding='utf-8')
+    with pytest.raises(ValueError):
+        list(iter_json_array(str(file_path), 2))
+
+
+def test_write_and_read_jsonl_round_trip(tmp_path):
+    records = [{"id": str(index), "text": "già"} for index in range(2500)]
+    file_path = str(tmp_path / "records.jsonl.gz")
+    assert write_jsonl(file_path, records, batch_size=100) == len(records)
+    assert list(read_jsonl(file_path)) == records
+
+
+@pytest.mark.skipif(jsonl_io.orjson is None, reason="orjson is not installed")
+def test_encoders_agree_except_for_the_floats(monkeypatch):
+    record = {"id": "Città", 1: [True, None, 0.5, -3], 2.5: {"nested": "é"}, None: 1e16}
+    with_orjson = jsonl_io.dumps(record)
+    monkeypatch.setattr(jsonl_io, "orjson", None)
+    without_orjson = jsonl_io.dumps(record)
+    assert with_orjson.replace("1e16", "1e+16") == without_orjson
+    assert json.loads(with_orjson) == json.loads(without_orjson)
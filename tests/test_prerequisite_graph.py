@@ -0,0 +1,85 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from prerequisite_graph import PrerequisiteGraph, augmented_pairs
+
+# A -> B means that B is a prerequisite of A. B and C form a cycle, H is its own prerequisite,
+# and G only appears in a negative pair
+PAIRS = [
+    ("A", "B", 1), ("B", "C", 1), ("C", "B", 1), ("C", "D", 1), ("E", "F", 1), ("H", "H", 1),
+    ("G", "A", 0), ("D", "A", 0),
+]
+
+
+def _brute_force_reachable():
+    successors = {}
+    for concept_A, concept_B, label in PAIRS:
+        successors.setdefault(concept_A, set())
+        successors.setdefault(concept_B, set())
+        if label == 1:
+            successors[concept_A].add(concept_B)
+    reachable = {}
+    for concept in successors:
+        # The concepts reachable with at least an edge
+        reached, frontier = set(), list(successors[concept])
+        while frontier:
+            node = frontier.pop()
+            if node not in reached:
+                reached.add(node)
+                frontier.extend(successors[node])
+        reachable[concept] = reached
+    return reachable
+
+
+@pytest.fixture(params=[None, 0], ids=["closure", "visit"])
+def graph(request):
+    options = {} if request.param is None else {"closure_max_components": request.param}
+    graph = PrerequisiteGraph.from_pairs(PAIRS, **options)
+    assert (graph.closure is None) == (request.param == 0)
+    return graph
+
+
+def test_cycles_collapse_into_one_component(graph):
+    component = {concept: int(graph.component[graph.ids[concept]]) for concept in graph.concepts}
+    assert component["B"] == component["C"]
+    assert len(set(component.values())) == len(graph) - 1
+    assert sorted(sorted(cycle) for cycle in graph.cycles()) == [["B", "C"], ["H"]]
+    # The successors of a component have a lower number
+    for concept in graph.concepts:
+        for prerequisite in graph.prerequisites(concept):
+            assert component[prerequisite] <= component[concept]
+
+
+def test_reachable_matches_a_brute_force_visit(graph):
+    expected = _brute_force_reachable()
+    pairs = list(itertools.product(graph.concepts + ["Z"], repeat=2))
+    sources = graph.node_ids(pair[0] for pair in pairs)
+    targets = graph.node_ids(pair[1] for pair in pairs)
+    result = graph.reachable(sources, targets)
+    for (source, target), reachable in zip(pairs, result.tolist()):
+        assert reachable == (target in expected.get(source, ())), (source, target)
+    for concept in graph.concepts:
+        reached = [graph.concepts[node] for node in graph.reachable_from(graph.ids[concept])]
+        assert sorted(reached) == sorted(expected[concept])
+    assert graph.is_prerequisite("A", "D") and not graph.is_prerequisite("D", "A")
+
+
+def test_augmented_pairs_are_new_and_implied(graph):
+    expected = _brute_force_reachable()
+    labeled = {(concept_A, concept_B) for concept_A, concept_B, _ in PAIRS}
+    pairs = list(augmented_pairs(graph))
+    assert len(pairs) == len(set(pairs))
+    for concept_A, concept_B, label in pairs:
+        assert concept_A != concept_B
+        assert (concept_A, concept_B) not in labeled
+        if label == 1:
+            assert concept_B in expected[concept_A]
+        else:
+            assert concept_A in expected[concept_B] and concept_B not in expected[concept_A]
+    positives = {(concept_A, concept_B) for concept_A, concept_B, label in pairs if label == 1}
+    assert positives == {(concept, target) for concept, targets in expected.items() for target in targets
+                         if concept != target and (concept, target) not in labeled}
+    assert all(label == 1 for _, _, label in augmented_pairs(graph, negatives=False))
+    assert np.array_equal(graph.is_labeled(graph.node_ids(["G"]), graph.node_ids(["A"])), [True])
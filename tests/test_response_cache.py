@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+from evaluation import FakeBackend
+from response_cache import CachedBackend, ResponseCache
+
+
+def _put(cache, key, size):
+    cache.put(key, "model", "x" * size)
+    # The least recently used order must not depend on the clock resolution
+    time.sleep(0.002)
+
+
+def test_eviction_is_a_strict_lru_bound(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=100)
+    for index in range(10):
+        _put(cache, f"k{index}", 10)
+    assert cache.stats()["bytes"] == 100
+    assert cache.get("k0") is not None
+    time.sleep(0.002)
+    _put(cache, "k10", 25)
+    # Only the three least recently used outputs are evicted ( k0 was just used )
+    assert cache.stats() == {"hits": 1, "misses": 0, "entries": 8, "bytes": 95}
+    assert [cache.get(f"k{index}") is None for index in (0, 1, 2, 3, 4)] == [False, True, True, True, False]
+    cache.close()
+
+
+def test_processes_sharing_the_cache_respect_the_limit(tmp_path):
+    file_path = str(tmp_path / "cache.sqlite")
+    first = ResponseCache(file_path, max_bytes=100)
+    second = ResponseCache(file_path, max_bytes=100)
+    for index in range(8):
+        _put(first if index % 2 else second, f"k{index}", 20)
+        assert first.stats()["bytes"] <= 100
+    assert first.stats()["entries"] == second.stats()["entries"] == 5
+    first.close()
+    second.close()
+
+
+def test_cached_backend_answers_from_the_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    backend = FakeBackend(answer=lambda prompt: prompt[::-1])
+    cached = CachedBackend(backend, cache)
+    outputs = [asyncio.run(cached.generate(prompt)) for prompt in ["ab", "cd", "ab"]]
+    assert outputs == ["ba", "dc", "ba"]
+    assert backend.calls == 2
+    cache.close()
@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+
+from evaluation import FakeBackend
+from ngram_model import NgramBackend, NgramModel
+from scoring import parse_answers, score, score_choices
+
+PROMPT = "Quale classe? {{text}}"
+
+
+def _contexts():
+    choices = ["rosso", "verde", "blu"]
+    return [{"id": str(index), "text": f"frase {index}", "choices": choices, "label": index % 3}
+            for index in range(30)]
+
+
+def test_score_choices_offline(tmp_path):
+    def loglikelihood(prompt, continuation):
+        # The gold choice of each context is the most likely one
+        index = int(prompt.rsplit(' ', 1)[1])
+        return 0.0 if continuation.strip() == ["rosso", "verde", "blu"][index % 3] else -5.0
+
+    output_file = tmp_path / "choices.jsonl"
+    output_file.write_text(json.dumps({"id": "0", "choices": ["x"], "loglikelihoods": [0.0, 1.0, 2.0],
+                                       "prediction": 2, "latency": 0.1}) + '\n', encoding='utf-8')
+    scores = score_choices(PROMPT, _contexts(), "task-13", FakeBackend(loglikelihood=loglikelihood),
+                           str(output_file), evaluation_options={"batch_size": 4}, bootstrap_samples=100)
+    # The results of a previous run in the same file are not scored
+    assert scores["accuracy"] == 1.0
+    assert scores["run"]["completed"] == 30
+    assert len(output_file.read_text(encoding='utf-8').splitlines()) == 30
+
+
+def test_score_choices_with_the_ngram_backend(tmp_path):
+    model = NgramModel().train(["Quale classe? frase 1 verde"] * 5)
+    scores = score_choices(PROMPT, _contexts(), "task-13", NgramBackend(model), str(tmp_path / "choices.jsonl"),
+                           bootstrap_samples=100)
+    assert scores["run"]["failed"] == 0
+    assert 0.0 <= scores["accuracy"] <= 1.0
+
+
+def test_score_matches_the_confusion_matrix():
+    predictions = parse_answers(["1", "2", "non so", "2"], "choice", 3)
+    labels = np.array([1, 2, 0, 1])
+    scores = score(predictions, labels, 3, bootstrap_samples=200)
+    assert scores["accuracy"] == 0.5
+    low, high = scores["accuracy_ci"]
+    assert low <= 0.5 <= high
@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import sharded_evaluation
+from evaluation import FakeBackend
+from sharded_evaluation import checkpoint_file, iter_work, merge_shards, read_checkpoint, run_shard, shard_of
+
+SHARDS = 3
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def sweeps(tmp_path):
+    prompts_file = tmp_path / "prompt-test.jsonl"
+    prompts_file.write_text('{"prompt": "A {{word}}?"}\n{"prompt": "B {{word}}!"}\n', encoding='utf-8')
+    benchmark_file = tmp_path / "benchmark.jsonl"
+    benchmark_file.write_text(''.join(json.dumps({"id": f"c{index}", "word": f"w{index}"}) + '\n'
+                                      for index in range(10)), encoding='utf-8')
+    return [(str(prompts_file), str(benchmark_file))]
+
+
+def _write_checkpoint(file_path, results):
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.writelines(json.dumps(result) + '\n' for result in results)
+
+
+def test_shard_of_is_stable():
+    item_ids = [f"prompt-test:0:c{index}" for index in range(100)]
+    shards = [shard_of(item_id, SHARDS) for item_id in item_ids]
+    assert set(shards) == set(range(SHARDS))
+    # The assignment is the same in another process, with another hash seed ( unlike hash() of a str )
+    code = (f"from sharded_evaluation import shard_of; "
+            f"print([shard_of(f'prompt-test:0:c{{index}}', {SHARDS}) for index in range(100)])")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env={**os.environ, "PYTHONHASHSEED": "123"},
+                            stdout=subprocess.PIPE, text=True, check=True).stdout
+    assert output.strip() == str(shards)
+
+
+def test_iter_work_enumerates_every_prompt_and_context(sweeps):
+    item_ids = [item_id for item_id, _, _ in iter_work(sweeps)]
+    assert len(item_ids) == len(set(item_ids)) == 20
+    assert item_ids[:3] == ["prompt-test:0:c0", "prompt-test:1:c0", "prompt-test:0:c1"]
+
+
+def test_run_shard_resumes_a_killed_checkpoint(sweeps, tmp_path):
+    directory = str(tmp_path / "checkpoints")
+    items = [item_id for item_id, _, _ in iter_work(sweeps) if shard_of(item_id, SHARDS) == 0]
+    report = run_shard(0, SHARDS, FakeBackend(), sweeps, directory, retries=0, backoff=0.0)
+    assert report["completed"] == len(items) and report["skipped"] == 0
+
+    # A crash cuts the last result in half, without its new line
+    file_path = checkpoint_file(0, SHARDS, directory)
+    with open(file_path, 'r', encoding='utf-8') as file:
+        lines = file.readlines()
+    cut_id = json.loads(lines[-1])["id"]
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.writelines(lines[:-1])
+        file.write(lines[-1][:len(lines[-1]) // 2])
+
+    backend = FakeBackend()
+    report = run_shard(0, SHARDS, backend, sweeps, directory, retries=0, backoff=0.0)
+    # Only the item cut by the crash runs again
+    assert backend.calls == 1
+    assert report["skipped"] == len(items) - 1
+    results = list(read_checkpoint(file_path))
+    assert sorted(result["id"] for result in results) == sorted(items)
+    assert results[-1]["id"] == cut_id
+
+
+def test_run_shard_runs_the_failed_items_again(sweeps, tmp_path):
+    directory = str(tmp_path / "checkpoints")
+    run_shard(1, SHARDS, FakeBackend(failure_rate=1.0), sweeps, directory, retries=0, backoff=0.0)
+    items = {item_id for item_id, _, _ in iter_work(sweeps) if shard_of(item_id, SHARDS) == 1}
+    backend = FakeBackend()
+    report = run_shard(1, SHARDS, backend, sweeps, directory, retries=0, backoff=0.0)
+    assert backend.calls == len(items)
+    assert report["completed"] == len(items) and report["skipped"] == 0
+
+
+def test_merge_shards(sweeps, tmp_path):
+    directory = tmp_path / "checkpoints"
+    directory.mkdir()
+    work = [item_id for item_id, _, _ in iter_work(sweeps)]
+    by_shard = {shard: [item_id for item_id in work if shard_of(item_id, SHARDS) == shard] for shard in range(SHARDS)}
+    success, retried, failed = by_shard[0][:3]
+
+    def completed(item_id, output):
+        return {"id": item_id, "prompt": "p", "output": output, "latency": 0.5}
+
+    def error(item_id):
+        return {"id": item_id, "prompt": "p", "error": "RuntimeError()"}
+
+    # Shard 0: a success later failed again, a failure later completed, and a failure. Shard 1 never ran
+    _write_checkpoint(checkpoint_file(0, SHARDS, str(directory)),
+                      [completed(success, "first"), error(retried), error(failed), error(success),
+                       completed(retried, "second")]
+                      + [completed(item_id, "ok") for item_id in by_shard[0][3:]])
+    _write_checkpoint(checkpoint_file(2, SHARDS, str(directory)),
+                      [completed(item_id, "old") for item_id in by_shard[2]]
+                      + [completed(item_id, "new") for item_id in by_shard[2]])
+
+    output_file = tmp_path / "merged.jsonl"
+    report = merge_shards(SHARDS, sweeps, str(directory), str(output_file), str(tmp_path / "report.json"))
+    assert report["items"] == len(work)
+    assert report["missing"] == len(by_shard[1])
+    assert report["failed"] == 1
+    assert report["completed"] == len(work) - len(by_shard[1]) - 1
+    assert sum(counts["items"] for counts in report["prompts"].values()) == len(work)
+
+    merged = [json.loads(line) for line in output_file.read_text(encoding='utf-8').splitlines()]
+    # The work order is kept, and the missing items are left out
+    assert [result["id"] for result in merged] == [item_id for item_id in work if item_id not in by_shard[1]]
+    outputs = {result["id"]: result.get("output") for result in merged}
+    assert outputs[success] == "first"
+    assert outputs[retried] == "second"
+    assert outputs[failed] is None
+    assert all(outputs[item_id] == "new" for item_id in by_shard[2])
+    assert json.loads((tmp_path / "report.json").read_text()) == report
+
+
+def test_fake_backend_factory_is_seeded_per_shard():
+    assert sharded_evaluation.fake_backend(2).random.random() == sharded_evaluation.fake_backend(2).random.random()
@@ -0,0 +1,145 @@
+import os
+
+import numpy as np
+import pytest
+
+import task_13
+from instrumentation import INSTRUMENTATION
+from jsonl_io import read_jsonl
+
+
+def _write_dataset(file_path, rows):
+    with open(file_path, 'w') as file:
+        file.write("testset_idx\tTARGET\tPOS\tINDEX\tTEXT\tAVG\n")
+        for number, (target, index, text) in enumerate(rows):
+            file.write(f"{number}\t{target}\tV\t{index}\t{text}\t5.5\n")
+
+
+def test_misaligned_index_doesnt_pollute_the_lemma_table(tmp_path):
+    dataset = str(tmp_path / "dataset.tsv")
+    _write_dataset(dataset, [
+        ("pitturare", 1, "Puoi pitturare l' argilla ."),
+        ("pitturare", 7, "Cerca di pitturare la barca a 26,5 °c ."),
+        ("scaldare", 1, "Non scaldare oltre i 30 °c ."),
+    ])
+    lemma_table = task_13.build_lemma_table(dataset)
+    assert "°c" not in lemma_table
+    tokens = task_13.tokenize("Cerca di pitturare la barca a 26,5 °c .")
+    assert task_13.validate_record("pitturare", tokens, 7, 5.5, 7, lemma_table) == "index_mismatch"
+    tokens = task_13.tokenize("Non scaldare oltre i 30 °c .")
+    assert task_13.validate_record("scaldare", tokens, 1, 5.5, 7, lemma_table) is None
+
+
+def test_validate_record_locates_the_target_by_index(tmp_path):
+    lemma_table = {"giochi": {"gioco"}, "gioco": {"gioco"}}
+    tokens = task_13.tokenize("I giochi da tavolo sono giochi antichi")
+    assert task_13.validate_record("gioco", tokens, 1, 5.5, 7, lemma_table) == "multiple_occurrences"
+    tokens = task_13.tokenize("I giochi da tavolo sono antichi")
+    assert task_13.validate_record("gioco", tokens, 1, 5.5, 7, lemma_table) is None
+    assert task_13.validate_record("gioco", tokens, 9, 5.5, 7, lemma_table) == "index_out_of_range"
+
+
+
+def test_malformed_index_rejects_only_its_row(tmp_path):
+    dataset = str(tmp_path / "dataset.tsv")
+    _write_dataset(dataset, [
+        ("pitturare", 1, "Puoi pitturare l' argilla ."),
+        ("scaldare", "uno", "Non scaldare oltre i 30 °c ."),
+        ("scaldare", 1, "Non scaldare la pentola ."),
+    ])
+    benchmark = str(tmp_path / "benchmark.jsonl")
+    rejected = task_13.build_benchmark(dataset, benchmark, seed=0)
+    assert rejected == {"invalid_index": 1}
+    assert [record["target_word"] for record in read_jsonl(benchmark)] == ["pitturare", "scaldare"]
+
+
+def test_records_are_timed_per_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(task_13, "BATCH_SIZE", 2)
+    monkeypatch.setattr(task_13, "VALIDATION_CHUNK_SIZE", 2)
+    dataset = str(tmp_path / "dataset.tsv")
+    _write_dataset(dataset, [("scaldare", 1, "Non scaldare la pentola .")] * 5)
+    INSTRUMENTATION.enable(trace_memory=False)
+    try:
+        task_13.build_benchmark(dataset, str(tmp_path / "benchmark.jsonl"), seed=0)
+        stages = INSTRUMENTATION.snapshot()
+    finally:
+        INSTRUMENTATION.disable()
+        INSTRUMENTATION.stages = {}
+    # 5 records in batches of 2: a measure per batch, not per record
+    for name in ["validate_record", "process_text", "json_encode"]:
+        assert (stages[name]["calls"], stages[name]["records"]) == (3, 5), name
+
+
+def _rejection_samples(center, lower_limit, upper_limit, num_samples, std_dev, samples, rng):
+    # The sampler replaced by sample_distractors: rounded truncated gaussian draws, rejecting the center and
+    # the repeated numbers. The draws are generated in advance, and consumed one at a time
+    from scipy.stats import truncnorm
+
+    draws = iter(np.round(truncnorm.rvs((lower_limit - center) / std_dev, (upper_limit - center) / std_dev,
+                                        loc=center, scale=std_dev, size=samples * 20, random_state=rng)).astype(int))
+    for _ in range(samples):
+        distractors = set()
+        while len(distractors) < num_samples - 1:
+            number = next(draws)
+            if number != center:
+                distractors.add(number)
+        yield distractors
+
+
+def test_distractors_are_distinct_and_exclude_the_center():
+    centers = np.arange(1, 8).repeat(100)
+    distractors = task_13.sample_distractors(centers, 1, 7, 3, task_13.GAUSSIAN_STD_DEV, np.random.default_rng(0))
+    assert distractors.shape == (len(centers), 3)
+    assert ((distractors >= 1) & (distractors <= 7)).all()
+    for center, row in zip(centers, distractors.tolist()):
+        assert len(set(row)) == 3 and center not in row
+    # All the other numbers are sampled, if as many are requested
+    distractors = task_13.sample_distractors(centers, 1, 7, 6, 0.5, np.random.default_rng(0))
+    for center, row in zip(centers, distractors.tolist()):
+        assert sorted(row + [center]) == list(range(1, 8))
+
+
+def test_sampling_is_reproducible():
+    centers = np.array([1, 4, 7, 2])
+    first = task_13.sample_choices(centers, 1, 7, 4, 2, np.random.default_rng(42))
+    second = task_13.sample_choices(centers, 1, 7, 4, 2, np.random.default_rng(42))
+    np.testing.assert_array_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[1], second[1])
+    choices, labels = first
+    np.testing.assert_array_equal(choices[np.arange(len(centers)), labels], centers)
+    assert task_13.get_gaussian_samples(4, 1, 7, 4, 2, np.random.default_rng(1)) == \
+        task_13.get_gaussian_samples(4, 1, 7, 4, 2, np.random.default_rng(1))
+
+
+def test_too_many_distractors_are_rejected():
+    with pytest.raises(ValueError):
+        task_13.sample_distractors(np.array([3]), 1, 7, 7, 2, np.random.default_rng(0))
+    with pytest.raises(ValueError):
+        task_13.get_gaussian_samples(3, 1, 4, 5, 2)
+
+
+@pytest.mark.parametrize("center", range(1, 8))
+def test_marginals_match_the_rejection_sampler(center):
+    samples, std_dev = 2000, task_13.GAUSSIAN_STD_DEV
+    rng = np.random.default_rng(7)
+    expected = np.zeros(7)
+    for distractors in _rejection_samples(center, 1, 7, 4, std_dev, samples, rng):
+        for number in distractors:
+            expected[number - 1] += 1
+    distractors = task_13.sample_distractors(np.full(samples, center), 1, 7, 3, std_dev, np.random.default_rng(7))
+    observed = np.bincount(distractors.ravel() - 1, minlength=7)
+    # The frequency of each number among the distractors, which differs by about 0.01 from run to run
+    np.testing.assert_allclose(observed / samples, expected / samples, atol=0.05)
+
+
+def test_pool_output_is_the_same_as_the_serial_one(tmp_path, monkeypatch):
+    monkeypatch.setattr(task_13, "BATCH_SIZE", 64)
+    outputs = {}
+    for workers in [1, 2]:
+        files = [(dataset_file, str(tmp_path / f"{workers}-{os.path.basename(benchmark_file)}"))
+                 for dataset_file, benchmark_file in task_13.FILES]
+        monkeypatch.setattr(task_13, "FILES", files)
+        task_13.create_benchmark(workers=workers, force=True)
+        outputs[workers] = [open(benchmark_file, 'rb').read() for _, benchmark_file in files]
+    assert all(outputs[1])
+    assert outputs[1] == outputs[2]
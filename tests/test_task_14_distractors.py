@@ -0,0 +1,73 @@
+import json
+import random
+
+import pytest
+
+import task_14_distractors
+from task_14_distractors import HINT_KEYS
+
+
+def _dataset(games, words, seed):
+    rng = random.Random(seed)
+    vocabulary = [f"indizio{index}" for index in range(words)]
+    dataset = []
+    for game in range(games):
+        record = {key: rng.choice(vocabulary) for key in HINT_KEYS}
+        record["solution"] = f"soluzione{game}"
+        dataset.append(record)
+    return dataset
+
+
+def _quadratic_scan(element, dataset):
+    # Every record is compared with every other one, counting the pairs of equal hint words
+    similar = []
+    for position, item in enumerate(dataset):
+        if item == element:
+            continue
+        common_words = sum(item[first] == element[second] for first in HINT_KEYS for second in HINT_KEYS)
+        if common_words > 0:
+            similar.append((-common_words, position))
+    return [(dataset[position]["solution"], -count) for count, position in sorted(similar)]
+
+
+@pytest.mark.parametrize("words", [8, 40])
+def test_index_matches_the_quadratic_scan(words):
+    dataset = _dataset(60, words, seed=words)
+    hint_index = task_14_distractors.build_hint_index(dataset)
+    for element in dataset:
+        expected = _quadratic_scan(element, dataset)
+        assert task_14_distractors.extract_similar_solutions(element, dataset, hint_index) == expected
+        assert task_14_distractors.extract_similar_solutions(element, dataset, hint_index, top_k=3) == expected[:3]
+    assert task_14_distractors.extract_similar_solutions(dataset[0], dataset) == _quadratic_scan(dataset[0], dataset)
+
+
+def test_top_k_is_ordered_by_similarity():
+    element = {"w1": "mare", "w2": "sole", "w3": "sabbia", "w4": "onda", "w5": "vento", "solution": "spiaggia"}
+    dataset = [
+        element,
+        {"w1": "mare", "w2": "neve", "w3": "ghiaccio", "w4": "freddo", "w5": "monte", "solution": "inverno"},
+        {"w1": "onda", "w2": "vento", "w3": "sole", "w4": "mare", "w5": "barca", "solution": "vela"},
+        {"w1": "casa", "w2": "porta", "w3": "tetto", "w4": "muro", "w5": "finestra", "solution": "edificio"},
+        {"w1": "sole", "w2": "sabbia", "w3": "caldo", "w4": "estate", "w5": "luce", "solution": "deserto"},
+    ]
+    assert task_14_distractors.extract_similar_solutions(element, dataset) == [
+        ("vela", 4), ("deserto", 2), ("inverno", 1)]
+    assert task_14_distractors.extract_similar_solutions(element, dataset, top_k=2) == [("vela", 4), ("deserto", 2)]
+
+
+def test_check_distractors_streams_the_dataset(tmp_path, monkeypatch, capsys):
+    dataset = _dataset(30, 20, seed=3)
+    file_path = tmp_path / "dataset.json"
+    file_path.write_text(json.dumps(dataset), encoding='utf-8')
+    monkeypatch.setattr(task_14_distractors, "FILE_NAME", str(file_path))
+    monkeypatch.setattr(task_14_distractors, "load_json", None)
+    task_14_distractors.check_distractors()
+    output = capsys.readouterr().out
+    hint_index = task_14_distractors.build_hint_index(dataset)
+    for element in dataset:
+        similar_solutions = task_14_distractors.extract_similar_solutions(element, dataset, hint_index,
+                                                                          task_14_distractors.TOP_K)
+        if similar_solutions:
+            assert f"' {element['solution']} ' are:\n {similar_solutions}\n" in output
+        else:
+            assert f"There are no similair solution for:  {element['solution']}\n" in output
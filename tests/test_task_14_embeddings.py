@@ -0,0 +1,60 @@
+import random
+
+import numpy as np
+
+import task_14_embeddings
+from task_14_distractors import HINT_KEYS
+
+
+def _saved_vectors(tmp_path, words, vectors):
+    file_path = str(tmp_path / "vectors")
+    task_14_embeddings.save_vectors(words, vectors, file_path)
+    return task_14_embeddings.load_vectors(file_path)
+
+
+def test_vectors_round_trip(tmp_path):
+    words = [f"parola{index}" for index in range(10)]
+    vectors = np.random.default_rng(0).normal(size=(10, 4)).astype(np.float32)
+    loaded_words, word_index, unit_vectors, norms = _saved_vectors(tmp_path, words, vectors)
+    assert loaded_words == words
+    assert word_index == {word: row for row, word in enumerate(words)}
+    assert isinstance(unit_vectors, np.memmap)
+    np.testing.assert_allclose(np.linalg.norm(unit_vectors, axis=1), 1, rtol=1e-6)
+    np.testing.assert_allclose(unit_vectors * norms[:, None], vectors, rtol=1e-5, atol=1e-6)
+
+
+def test_most_similar_matches_brute_force_cosine(tmp_path):
+    rng = np.random.default_rng(1)
+    words = [f"parola{index}" for index in range(50)]
+    _, _, vectors, _ = _saved_vectors(tmp_path, words, rng.normal(size=(50, 8)))
+    queries = rng.normal(size=(7, 8))
+    # A block size not dividing the queries, so the last block is partial
+    nearest = task_14_embeddings.most_similar(queries, vectors, topn=5, block_size=3)
+    similarities = (queries / np.linalg.norm(queries, axis=1)[:, None]) @ np.asarray(vectors).T
+    expected = np.argsort(-similarities, axis=1)[:, :5]
+    np.testing.assert_array_equal(nearest, expected)
+    assert task_14_embeddings.most_similar(queries, vectors, topn=100).shape == (7, 50)
+
+
+def test_distractors_do_not_share_a_root_with_the_game(tmp_path):
+    hints = ["alfa", "beta", "gamma", "delta", "epsilon"]
+    # Stemmed to their first 4 letters: the words sharing a root with the game are the nearest to the hints
+    same_root = ["solemne", "alfabeto", "betatron"]
+    others = ["nave", "pane", "vino", "luna"]
+    words = hints + ["sole"] + same_root + others
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(len(words), 6))
+    for row in range(len(hints) + 1, len(hints) + 1 + len(same_root)):
+        vectors[row] = vectors[:len(hints)].sum(axis=0)
+    words, word_index, unit_vectors, norms = _saved_vectors(tmp_path, words, vectors)
+    game = dict(zip(HINT_KEYS, hints), solution="sole")
+    games = task_14_embeddings.choose_distractors([game] * 5, words, word_index, unit_vectors, norms,
+                                                  lambda word: word[:4], random.Random(0))
+    for processed_game in games:
+        assert [processed_game[key] for key in HINT_KEYS] == hints
+        choices = processed_game["choices"]
+        assert len(choices) == task_14_embeddings.DISTRACTORS + 1
+        assert choices[processed_game["label"]] == "sole"
+        distractors = [choice for choice in choices if choice != "sole"]
+        assert len(set(distractors)) == len(distractors)
+        assert set(distractors) <= set(others)
@@ -0,0 +1,112 @@
+import math
+import random
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+import task_14_generator
+from jsonl_io import read_jsonl
+from task_14_distractors import HINT_KEYS
+
+
+def _stem(word):
+    return word[:3]
+
+
+def test_cooccurrences_are_counted_within_the_window(monkeypatch):
+    monkeypatch.setattr(task_14_generator, "WINDOW", 2)
+    vocabulary = ["alfa", "beta", "gamma", "delta"]
+    task_14_generator._init_worker({word: row for row, word in enumerate(vocabulary)})
+    # "zeta" is out of the vocabulary: it's removed before taking the window
+    counts = task_14_generator._count_cooccurrences(["Alfa beta zeta gamma delta", "beta alfa", "delta"])
+    expected = np.zeros((4, 4))
+    for first, second in [(0, 1), (0, 2), (1, 2), (1, 3), (2, 3), (1, 0)]:
+        expected[first, second] += 1
+        expected[second, first] += 1
+    np.testing.assert_array_equal(counts.toarray(), expected)
+    merged = task_14_generator._merge([counts, counts, sparse.csr_matrix((4, 4), dtype=np.float32)], 4)
+    np.testing.assert_array_equal(merged.toarray(), 2 * expected)
+
+
+def test_ppmi_values():
+    # a-b and c-d co-occur often, a-c once: P(a, c) < P(a) P(c), so their PMI is negative and dropped
+    counts = np.zeros((4, 4), dtype=np.float32)
+    for first, second, count in [(0, 1, 6), (2, 3, 6), (0, 2, 1)]:
+        counts[first, second] = counts[second, first] = count
+    ppmi = task_14_generator.ppmi_matrix(sparse.csr_matrix(counts), min_cooccurrences=1).toarray()
+    # The marginals are 7, 6, 7, 6 over a total of 26
+    expected = np.zeros((4, 4))
+    expected[0, 1] = expected[1, 0] = math.log(6 * 26 / (7 * 6))
+    expected[2, 3] = expected[3, 2] = math.log(6 * 26 / (7 * 6))
+    np.testing.assert_allclose(ppmi, expected, rtol=1e-6)
+    assert task_14_generator.ppmi_matrix(sparse.csr_matrix(counts), min_cooccurrences=7).nnz == 0
+
+
+def test_ppmi_keeps_the_top_associations():
+    counts = np.zeros((4, 4), dtype=np.float32)
+    for second, count in [(1, 3), (2, 6), (3, 9)]:
+        counts[0, second] = counts[second, 0] = count
+    counts[1, 2] = counts[2, 1] = 1
+    ppmi = task_14_generator.ppmi_matrix(sparse.csr_matrix(counts), min_cooccurrences=1, top_associations=1)
+    full = task_14_generator.ppmi_matrix(sparse.csr_matrix(counts), min_cooccurrences=1)
+    assert ppmi[0].nnz == 1
+    assert ppmi[0].indices[0] == np.argmax(full[0].toarray())
+
+
+def _game_ppmi():
+    hints = ["cane", "gatto", "topo", "lupo", "orso"]
+    distractors = ["mare", "neve", "vento"]
+    # "solaio" shares the root of the solution "sole", and is associated with all the hints
+    vocabulary = ["sole", "solaio"] + hints + distractors
+    values = np.zeros((len(vocabulary), len(vocabulary)), dtype=np.float32)
+    for hint in range(2, 7):
+        values[0, hint] = 5
+        values[1, hint] = 2
+        for distractor in range(7, 10):
+            values[distractor, hint] = 1
+    return vocabulary, sparse.csr_matrix(values + values.T)
+
+
+def test_generated_games():
+    vocabulary, ppmi = _game_ppmi()
+    games = list(task_14_generator.generate_games(ppmi, vocabulary, 10, _stem, random.Random(0)))
+    # "sole" has the strongest associations, so it's the first solution
+    first = games[0]
+    assert [first[key] for key in HINT_KEYS] == ["cane", "gatto", "topo", "lupo", "orso"]
+    assert first["choices"][first["label"]] == "sole"
+    assert sorted(first["choices"]) == ["mare", "neve", "sole", "vento"]
+    for game in games:
+        assert sorted(game) == sorted(HINT_KEYS + ("choices", "label"))
+        assert len(game["choices"]) == task_14_generator.DISTRACTORS + 1
+        assert 0 <= game["label"] < len(game["choices"])
+        words = [game[key] for key in HINT_KEYS] + game["choices"]
+        assert len({_stem(word) for word in words}) == len(words)
+    assert len(list(task_14_generator.generate_games(ppmi, vocabulary, 1, _stem, random.Random(0)))) == 1
+
+
+def test_create_games_from_a_tiny_corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(task_14_generator, "SKIP_MOST_FREQUENT", 0)
+    hints = ["cane", "gatto", "topo", "lupo", "orso"]
+    lines = ["<doc id=\"1\">"]
+    for hint in hints:
+        lines += [f"sole {hint}"] * 10
+        # The distractors co-occur with the hints just enough to be associated
+        lines += [f"{word} {hint}" for word in ["mare", "neve", "vento"]] * task_14_generator.MIN_COOCCURRENCES
+    corpus_file = tmp_path / "corpus.txt"
+    corpus_file.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    output_file = str(tmp_path / "games.jsonl")
+    task_14_generator.create_games([str(corpus_file)], output_file, games=5, workers=1, stem=_stem)
+    games = list(read_jsonl(output_file))
+    assert games
+    for game in games:
+        assert sorted(game) == sorted(HINT_KEYS + ("choices", "label"))
+        words = [game[key] for key in HINT_KEYS] + game["choices"]
+        assert len({_stem(word) for word in words}) == len(words)
+    assert games[0]["choices"][games[0]["label"]] == "sole"
+
+
+def test_missing_corpus_is_an_argument_error(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        task_14_generator.main([str(tmp_path / "missing.txt")])
+    assert "corpus file not found" in capsys.readouterr().err
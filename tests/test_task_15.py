@@ -0,0 +1,59 @@
+import os
+import random
+
+import task_15
+from benchmarks import bench_builders
+
+WIKIPEDIA = """<document>
+<doc id="1" url="https://it.wikipedia.org/wiki?curid=1" title="Punto">
+<title>Punto</title>
+Il punto è un ente geometrico.
+</doc>
+<doc>
+<title>Retta &amp; piano</title>
+La retta passa per due punti.
+</doc>
+</document>
+"""
+
+
+def test_topics_index_starts_at_the_doc_elements(tmp_path):
+    xml_file = tmp_path / "pages.xml"
+    xml_file.write_text(WIKIPEDIA, encoding='utf-8')
+    index = task_15.build_topics_index(str(xml_file))
+    assert sorted(index) == ["Punto", "Retta & piano"]
+    data = xml_file.read_bytes()
+    for offset, length in index.values():
+        element = data[offset:offset + length]
+        assert element.startswith(b'<doc') and not element.startswith(b'<document')
+        assert element.endswith(b'</doc>\n')
+
+
+def test_lazy_topics_match_the_parsed_ones(tmp_path):
+    xml_file = tmp_path / "pages.xml"
+    xml_file.write_text(WIKIPEDIA, encoding='utf-8')
+    topics = task_15.open_topics(str(xml_file))
+    try:
+        assert dict(topics) == task_15.extract_topics(str(xml_file))
+    finally:
+        topics.close()
+
+
+def test_pool_output_is_the_same_as_the_serial_one(tmp_path, monkeypatch):
+    rng = random.Random(0)
+    xml_file = str(tmp_path / "pages.xml")
+    bench_builders.write_wikipedia_xml(xml_file, 50, rng)
+    task_files = []
+    for name in ["geometry", "physics", "precalculus"]:
+        task_files.append(str(tmp_path / f"{name}-pairs.csv"))
+        bench_builders.write_prelearn_pairs(task_files[-1], 200, 50, rng)
+    monkeypatch.setattr(task_15, "WIKIPEDIA_FILE", xml_file)
+    outputs = {}
+    for workers in [1, 3]:
+        files = [(task_file, str(tmp_path / f"{workers}-{os.path.basename(task_file)}.jsonl"))
+                 for task_file in task_files]
+        monkeypatch.setattr(task_15, "FILES", files)
+        task_15.create_benchmark(workers=workers, force=True)
+        outputs[workers] = [open(benchmark_file, 'rb').read() for _, benchmark_file in files]
+    assert all(outputs[1])
+    assert outputs[1] == outputs[3]
@@ -0,0 +1,98 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import passage_summary
+import task_15
+import tests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WIKIPEDIA = """<document>
+<doc id="1" url="https://it.wikipedia.org/wiki?curid=1" title="Punto">
+<title>Punto</title>
+Il punto è un ente geometrico.
+</doc>
+</document>
+"""
+
+
+def test_fallback_summaries_use_the_tokenizer_of_the_summaries_file(tmp_path):
+    xml_file = tmp_path / "pages.xml"
+    xml_file.write_text(WIKIPEDIA, encoding='utf-8')
+    summaries_file = str(tmp_path / "summaries.jsonl")
+    passage_summary.build_summaries(str(xml_file), summaries_file, tokenizer="whitespace")
+    summaries = tests.SummaryStore(summaries_file)
+    try:
+        assert summaries.tokenizer == "whitespace"
+        # The passage differs from the summarized one, so it's summarized again: 2 words, but 4 regex tokens
+        context = {"concept_A": "Punto", "wikipedia_passage_concept_A": "Uno, due. Tre, quattro."}
+        parsed, saved = tests.parse_prompt_within_budget("{{ wikipedia_passage_concept_A }}", context,
+                                                         {"wikipedia_passage_concept_A": 2}, summaries)
+    finally:
+        summaries.close()
+    assert (parsed, saved) == ("Uno, due.", 2)
+    parsed, saved = tests.parse_prompt_within_budget("{{ wikipedia_passage_concept_A }}", context,
+                                                     {"wikipedia_passage_concept_A": 2})
+    assert (parsed, saved) == ("", 8)
+
+
+def test_summaries_without_manifest_use_the_default_tokenizer(tmp_path):
+    summaries_file = tmp_path / "summaries.jsonl"
+    summaries_file.write_text('{"id": "Punto", "ends": [5], "tokens": [1]}\n', encoding='utf-8')
+    summaries = tests.SummaryStore(str(summaries_file))
+    try:
+        assert summaries.tokenizer is None
+        assert summaries.get("Punto") == ([5], [1])
+    finally:
+        summaries.close()
+
+
+def test_import_does_not_load_passage_summary():
+    code = "import sys, tests; assert 'passage_summary' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+
+def test_import_keeps_the_replicate_token():
+    code = "import os, sharded_evaluation; assert os.environ['REPLICATE_API_TOKEN'] == 'r8_token'"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                   env=dict(os.environ, REPLICATE_API_TOKEN="r8_token"))
+
+
+def _write_shared_benchmark(tmp_path):
+    topics = {"Punto": "Il punto è un ente geometrico.", "Retta \"r\"": "La retta è\nillimitata.",
+              "Piano": "Il piano contiene rette."}
+    task_file = str(tmp_path / "geometry-pairs.csv")
+    with open(task_file, 'w', encoding='utf-8') as file:
+        file.write("Retta \"r\",Punto,1\nPiano,Retta \"r\",1\nPunto,Piano,0\n")
+    shared_file = str(tmp_path / "shared.jsonl")
+    inline_file = str(tmp_path / "inline.jsonl")
+    passages_file = str(tmp_path / "passages.jsonl")
+    task_15.build_benchmark(task_file, shared_file, topics, shared_passages=True)
+    task_15.build_benchmark(task_file, inline_file, topics)
+    task_15.write_passages(topics, task_15.extract_concepts([task_file]), passages_file)
+    return topics, shared_file, inline_file, passages_file
+
+
+def test_passage_store_reads_the_written_passages(tmp_path):
+    topics, _, _, passages_file = _write_shared_benchmark(tmp_path)
+    passages = tests.PassageStore(passages_file, cache_size=1)
+    try:
+        assert sorted(passages.offsets) == sorted(topics)
+        for concept in ["Retta \"r\"", "Punto", "Retta \"r\"", "Piano"]:
+            assert passages.get(concept) == topics[concept]
+    finally:
+        passages.close()
+
+
+def test_shared_passages_are_rehydrated(tmp_path):
+    _, shared_file, inline_file, passages_file = _write_shared_benchmark(tmp_path)
+    assert list(tests.load_contexts(shared_file, passages_file)) == list(tests.load_contexts(inline_file))
+
+
+def test_shared_passages_need_the_passages_file(tmp_path):
+    _, shared_file, _, _ = _write_shared_benchmark(tmp_path)
+    with pytest.raises(ValueError, match="shared passages"):
+        list(tests.load_contexts(shared_file))